@@ -11,7 +11,7 @@ from sentry_sdk.integrations.gcp import GcpIntegration
 from sentry_sdk.types import Event, Hint
 
 import phenoback.utils.gcloud as g
-from phenoback.utils import glogging
+from phenoback.utils import clients, glogging
 
 
 def sentry_environment() -> tuple[str, float, float]:
@@ -49,6 +49,10 @@ firebase_admin.initialize_app(
     options={"storageBucket": os.environ.get("storageBucket")}
 )
 
+# comma separated names of clients created in the background on cold start
+if os.environ.get("warmClients"):
+    clients.warm(*os.environ["warmClients"].split(","))
+
 log: logging.Logger = None  # type: ignore # pylint: disable=invalid-name
 
 
@@ -159,6 +163,29 @@ def ps_rollover_phenoyear(event, context):
             rollover.main(data, context)
 
 
+def http_rollover_phenoyear(request: Request):
+    """
+    Execute a stage of a phenoyear rollover started by ps_rollover_phenoyear.
+    """
+    with setup(request):
+        with invoke():
+            from phenoback.functions import rollover
+
+            return rollover.main_process(request)
+
+
+def ps_remove_stale_individuals(event, context):
+    """
+    Remove individuals without observations of the previous or a given year.
+    """
+    data = g.get_data(event)
+    with setup(data, context):
+        with invoke():
+            from phenoback.functions import rollover
+
+            rollover.main_remove_stale(data, context)
+
+
 def ps_export_meteoswiss_data(event, context):
     """
     Manually trigger a meteoswiss export for a given year.
@@ -191,6 +218,41 @@ def fs_individuals_write(data, context):
             phenoback.functions.iot.app.main_individual_updated(data, context)
 
 
+def fs_maps_write(data, context):
+    """
+    Export the modified shards of a map to Storage.
+    """
+    with setup(data, context):
+        with invoke():
+            from phenoback.functions import map_export
+
+            map_export.main(data, context)
+
+
+def ps_export_map(event, context):
+    """
+    Export all shards of a map to Storage for a given year or the phenoyear.
+    """
+    data = g.get_data(event)
+    with setup(data, context):
+        with invoke():
+            from phenoback.functions import map_export
+
+            map_export.main_export(data, context)
+
+
+def ps_rebuild_map(event, context):
+    """
+    Rebuild the map of a given year or the phenoyear from the individuals.
+    """
+    data = g.get_data(event)
+    with setup(data, context):
+        with invoke():
+            import phenoback.functions.map
+
+            phenoback.functions.map.main_rebuild(data, context)
+
+
 def http_individuals_write__map(request: Request):
     with setup(request):
         with invoke():
@@ -253,6 +315,52 @@ def ps_iot_dragino(event, context):
             bq.main(data, context)
 
 
+def ps_iot_uplink_schedule(event, context):
+    """
+    Set the seasonal uplink frequency on all sensors of the current phenoyear.
+    """
+    data = g.get_data(event)
+    with setup(data, context):
+        with invoke():
+            from phenoback.functions.iot import app
+
+            app.main_uplink_schedule(data, context)
+
+
+def http_iot_dragino_batch(request: Request):
+    """
+    Drain the iot_dragino_batch subscription and process the uplinks in batches.
+    """
+    with setup(request):
+        with invoke():
+            from phenoback.functions.iot import batch
+
+            return batch.main(request)
+
+
+def ps_compact_sensor_history(event, context):
+    """
+    Archive old daily sensor sums and roll them into weekly and monthly sums.
+    """
+    data = g.get_data(event)
+    with setup(data, context):
+        with invoke():
+            from phenoback.functions.iot import history
+
+            history.main(data, context)
+
+
+def http_sensor_history(request: Request):
+    """
+    Read the sensor history of an individual in a given resolution.
+    """
+    with setup(request):
+        with invoke():
+            from phenoback.functions.iot import history
+
+            return history.main_read(request)
+
+
 def ps_process_statistics(event, context):
     data = g.get_data(event)
     with setup(data, context):
@@ -73,8 +73,8 @@ def process_observation(
             "species": species,
             "activity_date": d.localtime(),
             "individual_name": individual_dict["name"],
-            "phenophase_name": d.get_phenophase(species, phenophase)["de"],
-            "species_name": d.get_species(species)["de"],
+            "phenophase_name": d.get_phenophase_name(species, phenophase),
+            "species_name": d.get_species_name(species),
             "user_name": d.get_user(user_id)["nickname"],
             "action": action,
             "followers": list(followers),
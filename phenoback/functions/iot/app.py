@@ -1,17 +1,26 @@
 import logging
-
-import google.api_core.exceptions
+import time
 
 import phenoback.utils.data as d
 import phenoback.utils.firestore as f
 import phenoback.utils.gcloud as g
 from phenoback.functions.iot import dragino
-from phenoback.functions.iot.dragino import DraginoDecoder
+from phenoback.functions.iot.dragino import DECODERS
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 COLLECTION = "sensors"
+# Lookups are cached per function instance. Sensor moves are handled by
+# fs_individuals_write in another function and bump the sensors version in
+# config_dynamic, which drops the cached lookups of all instances once they
+# check the config again.
+INDIVIDUAL_CACHE_TTL = 120
+INDIVIDUAL_CACHE_NOT_FOUND_TTL = 60
+
+# (year, deveui) -> (individual id, sensors version, expiry)
+_individual_cache: dict[tuple[int, str], tuple[str | None, int, float]] = {}
+_individual_cache_stats = {"hits": 0, "misses": 0}
 
 
 def main(data, context):  # pylint: disable=unused-argument
@@ -28,15 +37,36 @@ def main_individual_updated(data, context):
             sensor_set(individual_id, str(individual), str(deveui))
         else:
             remove_sensor(individual_id)
+        d.update_sensors_version()
+
+
+def main_uplink_schedule(data, context):  # pylint: disable=unused-argument
+    """Set the seasonal uplink frequency on all sensors of the phenoyear."""
+    year = d.get_phenoyear()
+    deveuis = {
+        doc.get("deveui")
+        for doc in d.query_individuals("year", "==", year)
+        .where(filter=f.FieldFilter("deveui", ">", ""))
+        .select(["deveui"])
+        .stream()
+    }
+    scheduled = dragino.schedule_uplink_frequencies(sorted(deveuis))
+    log.info("Scheduled uplink frequency for %i of %i sensors", scheduled, len(deveuis))
 
 
 def process_dragino(data: dict) -> None:
-    decoder = DraginoDecoder(data)
+    decoder = DECODERS.decoder(data)
     decoder.decode()
     year = d.get_phenoyear()
-    individual_id = get_individual_id(year, decoder.devuei)
+    individual_id = get_cached_individual_id(year, decoder.devuei)
     if individual_id:
-        log.info("process sensor data for %s (%s)", individual_id, decoder.devuei)
+        log.info(
+            "process sensor data for %s (%s), lookup cache hits=%i misses=%i",
+            individual_id,
+            decoder.devuei,
+            _individual_cache_stats["hits"],
+            _individual_cache_stats["misses"],
+        )
         update(decoder.decoded_payload, year, individual_id)
     else:
         log.warning("No individual found for %s in %i", decoder.devuei, year)
@@ -54,26 +84,80 @@ def get_individual_id(year: int, deveui: str) -> str | None:
     return individual_id
 
 
+def get_cached_individual_id(year: int, deveui: str) -> str | None:
+    """
+    Lookup the individual for a sensor, caching the result for
+    INDIVIDUAL_CACHE_TTL seconds (INDIVIDUAL_CACHE_NOT_FOUND_TTL for unknown
+    sensors, so newly assigned sensors are picked up quickly). Entries of an
+    older sensors version are looked up again.
+    """
+    now = time.monotonic()
+    version = d.get_sensors_version()
+    cached = _individual_cache.get((year, deveui))
+    if cached and cached[1] == version and cached[2] > now:
+        _individual_cache_stats["hits"] += 1
+        return cached[0]
+    _individual_cache_stats["misses"] += 1
+    individual_id = get_individual_id(year, deveui)
+    ttl = INDIVIDUAL_CACHE_TTL if individual_id else INDIVIDUAL_CACHE_NOT_FOUND_TTL
+    _individual_cache[(year, deveui)] = (individual_id, version, now + ttl)
+    return individual_id
+
+
+def invalidate_individual_cache(
+    deveui: str | None = None, individual_id: str | None = None
+) -> None:
+    """
+    Drop cached lookups for the given sensor and/or individual.
+    Clears the whole cache if neither is given.
+    """
+    if deveui is None and individual_id is None:
+        _individual_cache.clear()
+        return
+    for key, (cached_individual_id, _, _) in list(_individual_cache.items()):
+        if key[1] == deveui or (
+            individual_id is not None and cached_individual_id == individual_id
+        ):
+            del _individual_cache[key]
+
+
 def update(data: dict, year: int, individual_id: str):
-    soil_humidity = data["soilHumidity"]["value"]
-    soil_temperature = data["soilTemperature"]["value"]
-    air_humidity = data["airHumidity"]["value"]
-    air_temperature = data["airTemperature"]["value"]
-
-    update_history(
-        year,
-        individual_id,
-        soil_humidity,
-        soil_temperature,
-        air_humidity,
-        air_temperature,
-    )
-    update_individual(
-        individual_id,
-        soil_humidity,
-        soil_temperature,
-        air_humidity,
-        air_temperature,
+    """
+    Write the sensor history and the individual's last sensor values in a
+    single atomic batch.
+    """
+    soil_humidity, soil_temperature, air_humidity, air_temperature = sensor_values(data)
+
+    with f.batch_commit() as writebatch:
+        update_history(
+            year,
+            individual_id,
+            soil_humidity,
+            soil_temperature,
+            air_humidity,
+            air_temperature,
+            writebatch=writebatch,
+        )
+        update_individual(
+            individual_id,
+            soil_humidity,
+            soil_temperature,
+            air_humidity,
+            air_temperature,
+            writebatch=writebatch,
+        )
+
+
+def sensor_values(data: dict) -> tuple[float, float, float, float]:
+    """
+    :return: soil humidity, soil temperature, air humidity and air temperature
+    of a decoded payload
+    """
+    return (
+        data["soilHumidity"]["value"],
+        data["soilTemperature"]["value"],
+        data["airHumidity"]["value"],
+        data["airTemperature"]["value"],
     )
 
 
@@ -85,6 +169,20 @@ def valid_humidity(humidity):
     return 0 <= humidity <= 100
 
 
+def valid_sensor_data(
+    soil_humidity: float,
+    soil_temperature: float,
+    air_humidity: float,
+    air_temperature: float,
+) -> bool:
+    return (
+        valid_humidity(air_humidity)
+        and valid_humidity(soil_humidity)
+        and valid_temperature(air_temperature)
+        and valid_temperature(soil_temperature)
+    )
+
+
 # pylint: disable=too-many-positional-arguments
 def update_history(
     year: int,
@@ -93,27 +191,26 @@ def update_history(
     soil_temperature: float,
     air_humidity: float,
     air_temperature: float,
+    writebatch: f.WriteBatch | None = None,
 ):
-    if (
-        valid_humidity(air_humidity)
-        and valid_humidity(soil_humidity)
-        and valid_temperature(air_temperature)
-        and valid_temperature(soil_temperature)
+    if valid_sensor_data(
+        soil_humidity, soil_temperature, air_humidity, air_temperature
     ):
-        today = d.localdate()
-        data_today = {}
-        data_today[f"data.{today}.shs"] = f.Increment(soil_humidity)
-        data_today[f"data.{today}.sts"] = f.Increment(soil_temperature)
-        data_today[f"data.{today}.ahs"] = f.Increment(air_humidity)
-        data_today[f"data.{today}.ats"] = f.Increment(air_temperature)
-        data_today[f"data.{today}.n"] = f.Increment(1)
-
-        try:
-            f.update_document(COLLECTION, individual_id, data_today)
-        except google.api_core.exceptions.NotFound:
-            # create document and try again
-            f.write_document(COLLECTION, individual_id, {"year": year})
-            f.update_document(COLLECTION, individual_id, data_today)
+        today = str(d.localdate())
+        data_today = {
+            "shs": f.Increment(soil_humidity),
+            "sts": f.Increment(soil_temperature),
+            "ahs": f.Increment(air_humidity),
+            "ats": f.Increment(air_temperature),
+            "n": f.Increment(1),
+        }
+        # merge creates the document on the first uplink of the year
+        with f.batch_commit(writebatch) as batch:
+            batch.set(
+                f.collection(COLLECTION).document(individual_id),
+                {"year": year, "data": {today: data_today}},
+                merge=True,
+            )
     else:
         log.error(
             "Invalid sensor data for %s (air_temperature=%i, soil_temperature=%i, air_humidity=%i, soil_humidity=%i) #no-sentry",
@@ -131,50 +228,60 @@ def update_individual(
     soil_temperature: float,
     air_humidity: float,
     air_temperature: float,
+    writebatch: f.WriteBatch | None = None,
 ):
-    d.update_individual(
-        individual_id,
-        {
-            "sensor": {
-                "sh": soil_humidity,
-                "st": soil_temperature,
-                "ah": air_humidity,
-                "at": air_temperature,
-                "ts": f.SERVER_TIMESTAMP,
-            }
-        },
-    )
+    with f.batch_commit(writebatch) as batch:
+        batch.update(
+            f.collection("individuals").document(individual_id),
+            {
+                "sensor": {
+                    "sh": soil_humidity,
+                    "st": soil_temperature,
+                    "ah": air_humidity,
+                    "at": air_temperature,
+                    "ts": f.SERVER_TIMESTAMP,
+                }
+            },
+        )
 
 
 def sensor_set(individual_id: str, individual: str, deveui: str) -> None:
     """Called after a sensor was set in Firebase."""
     log.debug("sensor set: %s -> %s", individual, deveui)
-    for doc in d.query_individuals("deveui", "==", deveui).stream():
-        i = doc.to_dict()
-        if doc.id != individual_id and i.get("deveui"):
+    for doc in (
+        d.query_individuals("deveui", "==", deveui).select(["__name__"]).stream()
+    ):
+        if doc.id != individual_id:
             remove_sensor(doc.id)
-    dragino.set_uplink_frequency(deveui, 3600)
+    dragino.schedule_uplink_frequency(deveui)
+
+
+def _remove_sensor_data() -> dict:
+    return {
+        "deveui": f.DELETE_FIELD,
+        "sensor": {},
+    }
 
 
 def remove_sensor(individual_id) -> None:
     log.info("remove sensor from individual_id %s", individual_id)
-    d.update_individual(
-        individual_id,
-        {
-            "deveui": f.DELETE_FIELD,
-            "sensor": {},
-        },
-    )
+    d.update_individual(individual_id, _remove_sensor_data())
 
 
 def clear_sensors(year: int) -> int:
-    """Clears all sensor data on individuals"""
+    """
+    Clears all sensor data on individuals of the given year.
+    Needs a composite index on individuals for year and deveui.
+    """
     log.info("clear all sensors for %i", year)
     individual_ids = [
         doc.id
-        for doc in f.collection("individuals").order_by("deveui").stream()
-        if doc.to_dict()["year"] == year
+        for doc in d.query_individuals("year", "==", year)
+        .where(filter=f.FieldFilter("deveui", ">", ""))
+        .select(["__name__"])
+        .stream()
     ]
-    for individual_id in individual_ids:
-        remove_sensor(individual_id)
-    return len(individual_ids)
+    return f.update_batch(
+        "individuals",
+        {individual_id: _remove_sensor_data() for individual_id in individual_ids},
+    )
@@ -0,0 +1,207 @@
+"""
+Batched ingestion of dragino uplinks. Alternative to the per-message
+ps_iot_dragino function: uplinks published on the iot_dragino topic are
+pulled from a subscription and processed many at a time, aggregating the
+sensor history per individual and day into a single write.
+"""
+
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime
+from functools import lru_cache
+from http import HTTPStatus
+
+import google.api_core.exceptions
+from flask import Request, Response
+
+import phenoback.utils.bq
+import phenoback.utils.data as d
+import phenoback.utils.firestore as f
+import phenoback.utils.gcloud as g
+from phenoback.functions.iot import app, permarobotics
+from phenoback.functions.iot.dragino import DECODERS
+from phenoback.utils import pubsub
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+SUBSCRIPTION = "iot_dragino_batch"
+BQ_TABLE = "iot.raw"
+MAX_MESSAGES = 1000
+TIME_BUDGET = 240
+# messages processed and acknowledged at once
+PROCESS_MESSAGES = 250
+# two writes per individual, firestore batches are limited to 500 writes
+COMMIT_INDIVIDUALS = 250
+
+
+def main(request: Request):  # pylint: disable=unused-argument
+    processed = drain()
+    return Response(f"processed {processed} messages", HTTPStatus.OK)
+
+
+@lru_cache
+def subscriber() -> pubsub.Subscriber:
+    return pubsub.Subscriber(SUBSCRIPTION)  # pragma: no cover
+
+
+def drain(max_messages: int = MAX_MESSAGES, time_budget: float = TIME_BUDGET) -> int:
+    """
+    Pull and process messages until the subscription is empty or the time
+    budget is used up. Pulled messages are processed in chunks of
+    PROCESS_MESSAGES, messages left when the budget is used up are returned
+    to the subscription. Messages are acknowledged after processing, invalid
+    messages are logged and acknowledged as well.
+    :return: amount of messages processed
+    """
+    start = time.perf_counter()
+    processed = 0
+    while time.perf_counter() - start < time_budget:
+        messages = subscriber().pull(max_messages)
+        if not messages:
+            break
+        for i in range(0, len(messages), PROCESS_MESSAGES):
+            if time.perf_counter() - start >= time_budget:
+                subscriber().nack([message.ack_id for message in messages[i:]])
+                break
+            processed += process_messages(messages[i : i + PROCESS_MESSAGES])
+    elapsed = time.perf_counter() - start
+    log.info(
+        "Processed %i messages in %.1fs (%.1f/s)",
+        processed,
+        elapsed,
+        processed / elapsed if elapsed else 0,
+    )
+    return processed
+
+
+def process_messages(messages: list) -> int:
+    """
+    Process and acknowledge pulled messages. Uplinks are forwarded to
+    permarobotics only after acknowledging, so a failing or slow partner
+    endpoint cannot cause a redelivery that counts the history twice.
+    :return: amount of messages processed
+    """
+    uplinks = []
+    for message in messages:
+        try:
+            uplinks.append(json.loads(message.message.data))
+        except ValueError:
+            log.error("Invalid message %s", message.message.data)
+    rows = process_uplinks(uplinks)
+    subscriber().acknowledge([message.ack_id for message in messages])
+    if rows and g.get_project() == "phaenonet":
+        permarobotics.forward_batch(rows)
+    return len(messages)
+
+
+def process_uplinks(uplinks: list[dict]) -> list[dict]:
+    """
+    Decode the uplinks, write the aggregated sensor data to firestore and
+    insert the raw data into bigquery.
+    :return: decoded uplinks
+    """
+    year = d.get_phenoyear()
+    history: dict[str, dict[str, dict[str, float]]] = defaultdict(dict)
+    latest: dict[str, tuple[str, tuple[float, float, float, float]]] = {}
+    rows = []
+    for data, decoder in zip(uplinks, DECODERS.decode_batch(uplinks)):
+        if decoder is None:
+            log.error("Could not decode uplink %s", data)
+            continue
+        rows.append(decoder.data)
+        individual_id = app.get_cached_individual_id(year, decoder.devuei)
+        if not individual_id:
+            log.warning("No individual found for %s in %i", decoder.devuei, year)
+            continue
+        values = app.sensor_values(decoder.decoded_payload)
+        if individual_id not in latest or str(decoder.time) >= latest[individual_id][0]:
+            latest[individual_id] = (str(decoder.time), values)
+        if app.valid_sensor_data(*values):
+            add_history(history[individual_id], uplink_date(decoder.time), values)
+        else:
+            log.error(
+                "Invalid sensor data for %s: %s #no-sentry", individual_id, values
+            )
+
+    write_sensor_data(year, history, {i: v for i, (_, v) in latest.items()})
+    if rows:
+        phenoback.utils.bq.insert_data(BQ_TABLE, rows)
+    log.info("Processed %i uplinks for %i individuals", len(uplinks), len(latest))
+    return rows
+
+
+def uplink_date(uplink_time: str | None) -> str:
+    try:
+        return str(d.localdate(datetime.fromisoformat(str(uplink_time))))
+    except ValueError:
+        return str(d.localdate())
+
+
+def add_history(
+    history: dict[str, dict[str, float]],
+    day: str,
+    values: tuple[float, float, float, float],
+) -> None:
+    soil_humidity, soil_temperature, air_humidity, air_temperature = values
+    sums = history.setdefault(
+        day, {"shs": 0.0, "sts": 0.0, "ahs": 0.0, "ats": 0.0, "n": 0}
+    )
+    sums["shs"] += soil_humidity
+    sums["sts"] += soil_temperature
+    sums["ahs"] += air_humidity
+    sums["ats"] += air_temperature
+    sums["n"] += 1
+
+
+def write_sensor_data(
+    year: int,
+    history: dict[str, dict[str, dict[str, float]]],
+    latest: dict[str, tuple[float, float, float, float]],
+) -> None:
+    """
+    Write the history increments and the latest sensor values with one
+    batch commit per COMMIT_INDIVIDUALS individuals. If an individual was
+    deleted in the meantime, the affected chunk is retried per individual.
+    """
+    individual_ids = list(latest)
+    for i in range(0, len(individual_ids), COMMIT_INDIVIDUALS):
+        chunk = individual_ids[i : i + COMMIT_INDIVIDUALS]
+        try:
+            _write_chunk(year, chunk, history, latest)
+        except google.api_core.exceptions.NotFound:
+            for individual_id in chunk:
+                try:
+                    _write_chunk(year, [individual_id], history, latest)
+                except google.api_core.exceptions.NotFound:
+                    log.warning("Individual %s not found", individual_id)
+                    app.invalidate_individual_cache(individual_id=individual_id)
+
+
+def _write_chunk(
+    year: int,
+    individual_ids: list[str],
+    history: dict[str, dict[str, dict[str, float]]],
+    latest: dict[str, tuple[float, float, float, float]],
+) -> None:
+    with f.batch_commit() as writebatch:
+        for individual_id in individual_ids:
+            if history.get(individual_id):
+                writebatch.set(
+                    f.collection(app.COLLECTION).document(individual_id),
+                    {
+                        "year": year,
+                        "data": {
+                            day: {
+                                key: f.Increment(value) for key, value in sums.items()
+                            }
+                            for day, sums in history[individual_id].items()
+                        },
+                    },
+                    merge=True,
+                )
+            app.update_individual(
+                individual_id, *latest[individual_id], writebatch=writebatch
+            )
@@ -1,18 +1,52 @@
+import struct
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Self
+
+
 class Decoder:
+    __slots__ = ("_data", "raw")
+
     def __init__(self, data: dict):
         self._data = data
-        if self.payload:
-            self.int_pl = int(self.payload, 16)
-            self.size = len(self.payload) * 4
+        self.raw = bytes.fromhex(self.payload) if self.payload else b""
+
+    @classmethod
+    def decode_batch(cls, data: list[dict]) -> list[Self | None]:
+        """
+        Decode many uplinks at once.
+        :return: decoders in the order of data, None if an item could not be
+        decoded
+        """
+        return [_decode(cls, item) for item in data]
+
+    @property
+    def size(self) -> int:
+        return len(self.raw) * 8
+
+    @property
+    def int_pl(self) -> int:
+        return int.from_bytes(self.raw, "big")
 
     def get_value(self, start, length, signed=False):
-        shift = self.size - start - length
-        mask = ((1 << length) - 1) << shift
-        value = (self.int_pl & mask) >> shift
+        """
+        Get a value of arbitrary bit position and length. Only the bytes
+        containing the value are converted.
+        """
+        first = start // 8
+        last = (start + length + 7) // 8
+        shift = last * 8 - start - length
+        value = (int.from_bytes(self.raw[first:last], "big") >> shift) & (
+            (1 << length) - 1
+        )
         if signed and value & (1 << (length - 1)):
             value -= 1 << length
         return value
 
+    def unpack(self, layout: struct.Struct, offset: int = 0) -> tuple:
+        """Unpack byte aligned values with a precompiled struct layout."""
+        return layout.unpack_from(self.raw, offset)
+
     @property
     def data(self) -> dict:
         return self._data
@@ -52,3 +86,142 @@ class Decoder:
 
     def decode_impl(self) -> dict:
         raise NotImplementedError()  # pragma: no cover
+
+
+def _decode(cls: type[Decoder], data: dict) -> Decoder | None:
+    try:
+        decoder = cls(data)
+        decoder.decode()
+    except (ValueError, TypeError, struct.error):
+        return None
+    return decoder
+
+
+@dataclass(frozen=True)
+class Field:
+    """
+    A byte aligned payload value, decoded to round(raw * scale + add, precision).
+    :param fmt: struct format character defining length and signedness
+    """
+
+    name: str
+    offset: int
+    fmt: str
+    unit: str
+    scale: float = 1
+    add: float = 0
+    precision: int = 2
+
+
+class Layout:
+    """Field layout of a payload, decoding all fields in a single struct pass."""
+
+    __slots__ = ("fields", "struct")
+
+    def __init__(self, fields: list[Field], byteorder: str = ">") -> None:
+        self.fields = tuple(sorted(fields, key=lambda field: field.offset))
+        fmt = byteorder
+        position = 0
+        for field in self.fields:
+            if field.offset < position:
+                raise ValueError(f"Field {field.name} overlaps previous field")
+            if field.offset > position:
+                fmt += f"{field.offset - position}x"
+            fmt += field.fmt
+            position = field.offset + struct.calcsize(byteorder + field.fmt)
+        self.struct = struct.Struct(fmt)
+
+    def decode(self, raw: bytes) -> dict:
+        if len(raw) < self.struct.size:
+            raise ValueError(
+                f"Payload too short: {len(raw)} bytes, expected {self.struct.size}"
+            )
+        return {
+            field.name: {
+                "value": round(value * field.scale + field.add, field.precision),
+                "unit": field.unit,
+            }
+            for field, value in zip(self.fields, self.struct.unpack_from(raw))
+        }
+
+
+class LayoutDecoder(Decoder):
+    """Decoder for payloads described by a field layout."""
+
+    __slots__ = ()
+
+    LAYOUT: Layout
+
+    def decode_impl(self) -> dict:
+        return self.LAYOUT.decode(self.raw)
+
+
+class DecoderRegistry:
+    """
+    Selects the decoder for an uplink by device profile, DevEUI prefix and
+    FPort. The most specific registration wins, the selection is cached per
+    combination so repeated uplinks of a device do not iterate the
+    registrations.
+    """
+
+    def __init__(self, default: type[Decoder] | None = None) -> None:
+        self.default = default
+        self._entries: list[tuple[str | None, str, int | None, type[Decoder]]] = []
+        self._select = lru_cache(maxsize=1024)(self._select_uncached)
+
+    def register(
+        self,
+        decoder: type[Decoder],
+        *,
+        profile: str | None = None,
+        deveui_prefix: str = "",
+        fport: int | None = None,
+    ) -> None:
+        self._entries.append((profile, deveui_prefix.lower(), fport, decoder))
+        # profile matches first, then longer prefixes, then specific ports
+        self._entries.sort(
+            key=lambda e: (e[0] is None, -len(e[1]), e[2] is None),
+        )
+        self._select.cache_clear()
+
+    def get(self, data: dict) -> type[Decoder]:
+        uplink = data.get("DevEUI_uplink", {})
+        fport = uplink.get("FPort")
+        return self._select(
+            uplink.get("CustomerData", {}).get("alr", {}).get("pro"),
+            str(uplink.get("DevEUI", "")).lower(),
+            int(fport) if fport is not None else None,
+        )
+
+    def _select_uncached(
+        self, profile: str | None, deveui: str, fport: int | None
+    ) -> type[Decoder]:
+        for entry_profile, prefix, entry_fport, decoder in self._entries:
+            if (
+                (entry_profile is None or entry_profile == profile)
+                and deveui.startswith(prefix)
+                and (entry_fport is None or entry_fport == fport)
+            ):
+                return decoder
+        if self.default is None:
+            raise ValueError(f"No decoder for {deveui} (profile={profile}, {fport=})")
+        return self.default
+
+    def decoder(self, data: dict) -> Decoder:
+        return self.get(data)(data)
+
+    def decode_batch(self, data: list[dict]) -> list[Decoder | None]:
+        """
+        Decode many uplinks, selecting the decoder per uplink.
+        :return: decoders in the order of data, None if an item could not be
+        decoded
+        """
+        result: list[Decoder | None] = []
+        for item in data:
+            try:
+                cls = self.get(item)
+            except (ValueError, TypeError, AttributeError):
+                result.append(None)
+                continue
+            result.append(_decode(cls, item))
+        return result
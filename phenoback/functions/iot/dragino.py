@@ -1,12 +1,19 @@
 import logging
-from collections import defaultdict
-from datetime import datetime
+from collections.abc import Iterable
+from datetime import date, datetime
 from functools import lru_cache
 from http import HTTPStatus
 
+import google.api_core.exceptions
 from flask import Request, Response
 
-from phenoback.functions.iot.decoder import Decoder
+from phenoback.functions.iot.decoder import (
+    DecoderRegistry,
+    Field,
+    Layout,
+    LayoutDecoder,
+)
+from phenoback.utils import data as d
 from phenoback.utils import pubsub, tasks
 
 log = logging.getLogger(__name__)
@@ -15,11 +22,21 @@ log.setLevel(logging.DEBUG)
 TOPIC_ID = "iot_dragino"
 DOWNLINK_QUEUE = "swisscom-iot"
 DOWNLINK_URL = "https://proxy1.lpn.swisscom.ch/thingpark/lrc/rest/downlink"
+# first month of a season -> uplink interval in seconds, sensors send less
+# often in winter to reduce uplink volume and ingestion cost
+UPLINK_SCHEDULE = {3: 3600, 11: 4 * 3600}
+
+# deveui -> (interval, day) of the last frequency change sent by this instance
+_uplink_frequencies: dict[str, tuple[int, str]] = {}
 
 
 def main(request: Request):
     if request.is_json and request.json:
-        process_dragino(request.json)
+        try:
+            process_dragino(request.json)
+        finally:
+            # messages are published asynchronously, wait before responding
+            ps_client().flush()
     else:  # pragma: no cover
         log.error("No json headers set or payload is None")
         return Response("No json payload", HTTPStatus.BAD_REQUEST)
@@ -37,47 +54,122 @@ def task_client() -> tasks.HTTPClient:
 
 
 def process_dragino(data: dict) -> None:
-    decoder = DraginoDecoder(data)
+    decoder = DECODERS.decoder(data)
     if decoder.is_uplink:
         decoder.decode()
-        ps_client().send(
+        ps_client().publish(
             decoder.data,
             {
                 "DevEUI": decoder.devuei,
                 "Time": decoder.time,
             },
         )
-        log.info("Published sensor event for %s to %s", decoder.devuei, TOPIC_ID)
+        log.info("Publish sensor event for %s to %s", decoder.devuei, TOPIC_ID)
     else:
         log.debug("No uplink data, skip")
 
 
-def set_uplink_frequency(deveui: str, interval: int, at: datetime | None = None):
+def set_uplink_frequency(
+    deveui: str,
+    interval: int,
+    at: datetime | None = None,
+    task_name: str | None = None,
+) -> bool:
+    """
+    :return: False if a downlink task with the given name already exists
+    """
     log.info("set uplink frequency to %is for %s at %s", interval, deveui, at)
-    task_client().send(
-        "",
-        params={
-            "DevEUI": deveui,
-            "Payload": f"{16777216 + interval:{0}8x}",
-            "FPort": 1,
-        },
-        at=at,
+    try:
+        task_client().send(
+            "", params=downlink_params(deveui, interval), task_name=task_name, at=at
+        )
+        return True
+    except google.api_core.exceptions.AlreadyExists:
+        log.debug("Downlink task %s already enqueued", task_name)
+        return False
+
+
+def downlink_params(deveui: str, interval: int) -> dict:
+    return {
+        "DevEUI": deveui,
+        "Payload": f"{16777216 + interval:{0}8x}",
+        "FPort": 1,
+    }
+
+
+def uplink_task_name(deveui: str, interval: int, day: date) -> str:
+    return f"uplink-{deveui}-{interval}-{day}"
+
+
+def seasonal_interval(day: date) -> int:
+    """Uplink interval of the season the day is in."""
+    # the season starting last in the year lasts until the first one starts
+    interval = UPLINK_SCHEDULE[max(UPLINK_SCHEDULE)]
+    for month, season_interval in sorted(UPLINK_SCHEDULE.items()):
+        if day.month >= month:
+            interval = season_interval
+    return interval
+
+
+def schedule_uplink_frequency(deveui: str, day: date | None = None) -> bool:
+    """
+    Set the uplink frequency of the current season on a sensor. Repeated
+    changes to the same interval on the same day are coalesced, locally and
+    across instances through deterministic task names.
+    :return: True if a downlink task was created
+    """
+    day = day or d.localdate()
+    interval = seasonal_interval(day)
+    if _uplink_frequencies.get(deveui) == (interval, str(day)):
+        log.debug("Uplink frequency %is for %s already set", interval, deveui)
+        return False
+    created = set_uplink_frequency(
+        deveui, interval, task_name=uplink_task_name(deveui, interval, day)
+    )
+    _uplink_frequencies[deveui] = (interval, str(day))
+    return created
+
+
+def schedule_uplink_frequencies(deveuis: Iterable[str], day: date | None = None) -> int:
+    """
+    Set the uplink frequency of the current season on many sensors, sending
+    the downlink tasks concurrently. See schedule_uplink_frequency.
+    :return: amount of downlink tasks created
+    """
+    day = day or d.localdate()
+    interval = seasonal_interval(day)
+    pending = [
+        deveui
+        for deveui in deveuis
+        if _uplink_frequencies.get(deveui) != (interval, str(day))
+    ]
+    created = task_client().send_batch(
+        tasks.TaskRequest(
+            "",
+            params=downlink_params(deveui, interval),
+            task_name=uplink_task_name(deveui, interval, day),
+        )
+        for deveui in pending
+    )
+    for deveui in pending:
+        _uplink_frequencies[deveui] = (interval, str(day))
+    log.info("Set uplink frequency %is on %i sensors", interval, created)
+    return created
+
+
+class DraginoDecoder(LayoutDecoder):
+    __slots__ = ()
+
+    LAYOUT = Layout(
+        [
+            Field("soilHumidity", 0, "H", "%", scale=1 / 60),
+            Field("soilTemperature", 2, "H", "°C", scale=0.1, add=-50, precision=1),
+            Field("airTemperature", 7, "h", "°C", scale=0.1),
+            Field("airHumidity", 9, "H", "%", scale=0.1),
+            Field("batteryVoltage", 11, "B", "V", scale=0.1, precision=1),
+        ]
     )
 
 
-class DraginoDecoder(Decoder):
-    result = defaultdict(dict)
-
-    def set(self, field: str, value: float, precision: int, unit: str):
-        self.result[field]["value"] = round(value, precision)
-        self.result[field]["unit"] = unit
-
-    def decode_impl(self) -> dict:
-        self.set("soilHumidity", self.get_value(0 * 8, 16) / 1000 * 50 / 3, 2, "%")
-        self.set(
-            "soilTemperature", (self.get_value(2 * 8, 16) / 1000 - 0.5) * 100, 1, "°C"
-        )
-        self.set("airHumidity", self.get_value(9 * 8, 16) / 10, 2, "%")
-        self.set("airTemperature", self.get_value(7 * 8, 16, signed=True) / 10, 2, "°C")
-        self.set("batteryVoltage", self.get_value(88, 8) / 10, 1, "V")
-        return dict(self.result)
+# decoders for additional sensor models are registered here
+DECODERS = DecoderRegistry(default=DraginoDecoder)
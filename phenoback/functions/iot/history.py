@@ -0,0 +1,252 @@
+"""
+Compaction and reads of the daily sensor sums kept in the sensors collection.
+
+Uplinks add to daily sums in `data.{date}`. Days older than
+RAW_RETENTION_DAYS are archived to BigQuery and rolled into weekly and
+monthly sums (`weeks.{yyyy-Www}`, `months.{yyyy-mm}`), keeping documents
+small. Reads combine the archived summaries with the remaining daily sums.
+"""
+
+import json
+import logging
+from datetime import date, timedelta
+from http import HTTPStatus
+
+from flask import Request, Response
+
+import phenoback.utils.bq
+import phenoback.utils.data as d
+import phenoback.utils.firestore as f
+from phenoback.functions.iot import app
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+BQ_TABLE = "iot.sensor_daily"
+RAW_RETENTION_DAYS = 35
+PAGE_SIZE = 200
+SUMS = ("shs", "sts", "ahs", "ats", "n")
+DAY = "day"
+WEEK = "week"
+MONTH = "month"
+SUMMARY_FIELDS = {WEEK: "weeks", MONTH: "months"}
+# the history is read by the web app with the firebase id token of the user
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET",
+    "Access-Control-Allow-Headers": "Authorization",
+    "Access-Control-Max-Age": "3600",
+}
+
+
+def main(data, context):  # pylint: disable=unused-argument
+    """Compact the sensor history of the current and the previous phenoyear."""
+    year = data.get("year") if isinstance(data, dict) else None
+    if year:
+        compact(int(year))
+    else:
+        phenoyear = d.get_phenoyear()
+        compact(phenoyear - 1)
+        compact(phenoyear)
+
+
+def main_read(request: Request):
+    """
+    Read the sensor history of an individual, e.g.
+    ?individual_id=2024_721&from=2024-03-01&to=2024-06-30&resolution=week
+    Requires a firebase id token in the Authorization header.
+    """
+    if request.method == "OPTIONS":
+        return Response("", HTTPStatus.NO_CONTENT, headers=CORS_HEADERS)
+    if not authorized(request):
+        log.warning("Unauthorized history request %s", request.args)
+        return Response("Unauthorized", HTTPStatus.UNAUTHORIZED, headers=CORS_HEADERS)
+    try:
+        individual_id = request.args["individual_id"]
+        start = date.fromisoformat(request.args["from"])
+        end = date.fromisoformat(request.args["to"])
+        resolution = request.args.get("resolution")
+        if resolution is not None and resolution not in (DAY, WEEK, MONTH):
+            raise ValueError(f"Unknown resolution {resolution}")
+    except (KeyError, ValueError) as ex:
+        log.warning("Invalid history request %s: %s", request.args, ex)
+        return Response(
+            f"Invalid request: {ex}", HTTPStatus.BAD_REQUEST, headers=CORS_HEADERS
+        )
+    resolution = resolution or default_resolution(start, end)
+    return Response(
+        json.dumps(
+            {
+                "resolution": resolution,
+                "data": get_history(individual_id, start, end, resolution),
+            }
+        ),
+        HTTPStatus.OK,
+        mimetype="application/json",
+        headers=CORS_HEADERS,
+    )
+
+
+def authorized(request: Request) -> bool:
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and d.get_token_user_id(token) is not None
+
+
+def period(day: str, resolution: str) -> str:
+    """:param day: date in iso format"""
+    if resolution == DAY:
+        return day
+    elif resolution == MONTH:
+        return day[:7]
+    elif resolution == WEEK:
+        iso_year, week, _ = date.fromisoformat(day).isocalendar()
+        return f"{iso_year}-W{week:02d}"
+    else:
+        raise ValueError(f"Unknown resolution {resolution}")
+
+
+def summarize(days: dict[str, dict], resolution: str) -> dict[str, dict]:
+    """Add up daily sums per period of the given resolution."""
+    result: dict[str, dict] = {}
+    for day, sums in days.items():
+        add_sums(result, period(day, resolution), sums)
+    return result
+
+
+def add_sums(result: dict[str, dict], period_key: str, sums: dict) -> None:
+    period_sums = result.setdefault(period_key, dict.fromkeys(SUMS, 0))
+    for key in SUMS:
+        period_sums[key] += sums.get(key, 0)
+
+
+def retention_cutoff() -> str:
+    """Days before the returned date are archived."""
+    return str(d.localdate() - timedelta(days=RAW_RETENTION_DAYS))
+
+
+def compact_document(
+    document_id: str, document: dict, cutoff: str
+) -> tuple[list[dict], dict]:
+    """
+    :return: bigquery rows of the archived days and the firestore update
+    removing them and adding them to the weekly and monthly sums
+    """
+    archived = {
+        day: sums for day, sums in document.get("data", {}).items() if day < cutoff
+    }
+    rows = [
+        {
+            "individual_id": document_id,
+            "year": document.get("year"),
+            "date": day,
+            **{key: sums.get(key, 0) for key in SUMS},
+        }
+        for day, sums in archived.items()
+    ]
+    return rows, archive_update(archived)
+
+
+def archive_update(archived: dict[str, dict]) -> dict:
+    """
+    :return: firestore update removing the archived days and adding them to
+    the weekly and monthly sums
+    """
+    update = {f"data.{day}": f.DELETE_FIELD for day in archived}
+    for resolution, field in SUMMARY_FIELDS.items():
+        for period_key, sums in summarize(archived, resolution).items():
+            for key, value in sums.items():
+                update[f"{field}.{period_key}.{key}"] = f.Increment(value)
+    return update
+
+
+def compact(year: int, cutoff: str | None = None) -> int:
+    """
+    Archive and summarize all days before the cutoff of the year's sensor
+    documents. Rows are inserted with deterministic ids and only days
+    inserted into BigQuery are removed, so failed days are archived again by
+    the next run.
+    :return: amount of days archived
+    """
+    if cutoff is None:
+        cutoff = retention_cutoff()
+    log.info("Compact sensor history of %i before %s", year, cutoff)
+    query = f.query_collection(app.COLLECTION, "year", "==", year).order_by("__name__")
+    archived_days = 0
+    for page in f.stream_pages(query, PAGE_SIZE):
+        rows: list[dict] = []
+        updates: dict[str, dict] = {}
+        for doc in page:
+            doc_rows, update = compact_document(doc.id, doc.to_dict(), cutoff)
+            if doc_rows:
+                rows.extend(doc_rows)
+                updates[doc.id] = update
+        if rows:
+            failed_rows = phenoback.utils.bq.insert_data(
+                BQ_TABLE,
+                rows,
+                row_ids=[f"{row['individual_id']}_{row['date']}" for row in rows],
+            )
+            if failed_rows:
+                log.error(
+                    "Failed to archive %i days, keeping them in firestore",
+                    len(failed_rows),
+                )
+                updates = archived_updates(rows, failed_rows)
+            f.update_batch(app.COLLECTION, updates)
+            archived_days += len(rows) - len(failed_rows)
+    log.info("Archived %i days of sensor history for %i", archived_days, year)
+    return archived_days
+
+
+def archived_updates(rows: list[dict], failed_rows: list[dict]) -> dict[str, dict]:
+    """
+    :return: firestore updates for the rows that were inserted into bigquery
+    """
+    failed = {(row["individual_id"], row["date"]) for row in failed_rows}
+    archived: dict[str, dict[str, dict]] = {}
+    for row in rows:
+        if (row["individual_id"], row["date"]) not in failed:
+            archived.setdefault(row["individual_id"], {})[row["date"]] = {
+                key: row[key] for key in SUMS
+            }
+    return {document_id: archive_update(days) for document_id, days in archived.items()}
+
+
+def default_resolution(start: date, end: date) -> str:
+    """Daily values for short ranges of retained days, otherwise summaries."""
+    if (end - start).days <= 31 and str(start) >= retention_cutoff():
+        return DAY
+    elif (end - start).days <= 183:
+        return WEEK
+    else:
+        return MONTH
+
+
+def get_history(
+    individual_id: str, start: date, end: date, resolution: str
+) -> dict[str, dict]:
+    """
+    Get the sensor history of an individual between start and end (inclusive)
+    as averages per period. Archived days are only available as weekly or
+    monthly values.
+    :return: period -> {sh, st, ah, at, n}
+    """
+    document = f.get_document(app.COLLECTION, individual_id) or {}
+    sums = summarize(document.get("data", {}), resolution)
+    if resolution in SUMMARY_FIELDS:
+        summaries = document.get(SUMMARY_FIELDS[resolution], {})
+        for period_key, archived in summaries.items():
+            add_sums(sums, period_key, archived)
+    first = period(str(start), resolution)
+    last = period(str(end), resolution)
+    return {
+        period_key: {
+            "sh": round(values["shs"] / values["n"], 2),
+            "st": round(values["sts"] / values["n"], 2),
+            "ah": round(values["ahs"] / values["n"], 2),
+            "at": round(values["ats"] / values["n"], 2),
+            "n": values["n"],
+        }
+        for period_key, values in sorted(sums.items())
+        if first <= period_key <= last and values["n"]
+    }
@@ -1,19 +1,78 @@
 import logging
+import os
 from collections import defaultdict
+from functools import lru_cache
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from phenoback.utils import tasks
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+URL = "https://europe-west3-permarobotics.cloudfunctions.net/saveSensorData"
 REQUEST_TIMEOUT = 5
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.5
+# name of the cloud tasks queue used to forward data, sent directly if not set
+QUEUE_ENV = "permarobotics_queue"
 
 
 def main(data, context):  # pylint: disable=unused-argument
-    send_permarobotics(data)
+    forward(data)
 
 
-def send_permarobotics(data: dict) -> bool:
+def forward_batch(rows: list[dict]) -> None:
+    """
+    Forward many uplinks, enqueueing them concurrently if a queue is
+    configured, see forward.
+    """
+    queue = os.getenv(QUEUE_ENV)
+    if queue:
+        created = task_client(queue).send_batch(
+            tasks.TaskRequest(get_payload(data)) for data in rows
+        )
+        log.debug("Enqueued %i uplinks for permarobotics on %s", created, queue)
+    else:
+        for data in rows:
+            send_permarobotics(data)
+
+
+def forward(data: dict) -> None:
+    """
+    Forward uplink data to permarobotics, via cloud tasks if a queue is
+    configured so slow responses do not extend the function runtime.
+    """
+    queue = os.getenv(QUEUE_ENV)
+    if queue:
+        enqueue_permarobotics(data, queue)
+    else:
+        send_permarobotics(data)
+
+
+@lru_cache
+def session() -> requests.Session:
+    """Shared keep-alive session retrying failed requests with backoff."""
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    )
+    http_session = requests.Session()
+    http_session.mount("https://", HTTPAdapter(max_retries=retry, pool_maxsize=10))
+    return http_session
+
+
+@lru_cache
+def task_client(queue: str) -> tasks.HTTPClient:
+    return tasks.HTTPClient(queue, URL)  # pragma: no cover
+
+
+def get_payload(data: dict) -> dict:
     deveui = data["DevEUI_uplink"]["DevEUI"]
     result = defaultdict(dict)
     result["end_device_ids"]["dev_eui"] = deveui
@@ -32,11 +91,16 @@ def send_permarobotics(data: dict) -> bool:
     result["uplink_message"]["decoded_payload"] = data["DevEUI_uplink"][
         "decoded_payload"
     ]
-    resp = requests.post(
-        url="https://europe-west3-permarobotics.cloudfunctions.net/saveSensorData",
-        json=result,
-        timeout=REQUEST_TIMEOUT,
-    )
+    return dict(result)
+
+
+def send_permarobotics(data: dict) -> bool:
+    deveui = data["DevEUI_uplink"]["DevEUI"]
+    try:
+        resp = session().post(url=URL, json=get_payload(data), timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as ex:
+        log.error("send data permarobotics error: %s", ex)
+        return False
     if resp.ok:
         log.debug("Send data permarobotics ok: %s", deveui)
         return True
@@ -47,3 +111,10 @@ def send_permarobotics(data: dict) -> bool:
             resp.text,
         )
         return False
+
+
+def enqueue_permarobotics(data: dict, queue: str) -> None:
+    task_client(queue).send(get_payload(data))
+    log.debug(
+        "Enqueued data permarobotics on %s: %s", queue, data["DevEUI_uplink"]["DevEUI"]
+    )
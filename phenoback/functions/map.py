@@ -1,9 +1,15 @@
 import logging
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timezone
 from functools import lru_cache
 from http import HTTPStatus
 
+import google.api_core.exceptions
 from flask import Request, Response
 
+from phenoback.utils import data as d
 from phenoback.utils import firestore as f
 from phenoback.utils import gcloud as g
 from phenoback.utils import tasks
@@ -16,6 +22,24 @@ FUNCTION_NAME = "http_individuals_write__map"
 
 DELETE_TOKEN = "__DELETE__"  # nosec
 
+# maps/{year} is a manifest listing the shards of the year in
+# maps/{year}/shards/{n}, individuals are assigned to shards by id hash.
+# Years without a shard count keep all individuals in maps/{year}.data.
+SHARDS = 16
+SHARD_COLLECTION = "shards"
+
+# Changes are buffered per year and time window and written to the map with
+# one update per window, so bulk changes do not contend on the map document.
+BUFFER_COLLECTION = "maps_pending"
+UPDATE_WINDOW = 30
+# delay after the end of a window so changes buffered at its end are included
+UPDATE_DELAY = 10
+
+REBUILD_PAGE_SIZE = 1000
+
+# (year, window) of the tasks enqueued by this instance
+_scheduled: set[tuple[int, int]] = set()
+
 
 def main_enqueue(data, context):
     if not g.is_delete_event(data):
@@ -37,10 +61,25 @@ def main_enqueue(data, context):
 
 
 def main_process(request: Request):
-    process_change(request.get_json(silent=True))
+    payload = request.get_json(silent=True)
+    if "window" in payload:
+        process_window(payload["year"], payload["window"])
+    else:
+        # tasks enqueued before changes were buffered carry the values
+        process_change(payload)
     return Response("ok", HTTPStatus.OK)
 
 
+def main_rebuild(data, context):  # pylint: disable=unused-argument
+    """
+    Rebuild the map of the given year, defaults to the phenoyear. With
+    dry_run the map is only compared to the individuals.
+    """
+    data = data if isinstance(data, dict) else {}
+    year = int(data["year"]) if data.get("year") else d.get_phenoyear()
+    rebuild(year, dry_run=bool(data.get("dry_run")))
+
+
 @lru_cache
 def client() -> tasks.GCFClient:
     return tasks.GCFClient(QUEUE_NAME, FUNCTION_NAME)
@@ -79,10 +118,9 @@ def enqueue_change(
         )
         values[individual_id]["hs"] = True if deveui else DELETE_TOKEN
 
-        payload = {"year": year, "values": values}
-        client().send(payload)
+        buffer_change(year, individual_id, values[individual_id])
         log.info(
-            "enqueue task for change on %s: fields=%s, created=%s",
+            "buffer change on %s: fields=%s, created=%s",
             individual_id,
             updated_fields,
             is_create_event,
@@ -96,12 +134,139 @@ def enqueue_change(
         )
 
 
-def process_change(payload: dict) -> None:
-    replace_delete_tokens(payload)
+def current_window() -> int:
+    return int(time.time() // UPDATE_WINDOW)
+
+
+def buffer_change(year: int, individual_id: str, values: dict) -> None:
+    """
+    Buffer the map values of an individual in the current window and make
+    sure the window is processed. Later changes of an individual within the
+    same window replace earlier ones.
+    """
+    window = current_window()
+    write_buffer(year, window, individual_id, values)
+    schedule_window(year, window)
+
+
+def write_buffer(year: int, window: int, individual_id: str, values: dict) -> None:
     f.write_document(
-        "maps", str(payload["year"]), {"data": payload["values"]}, merge=True
+        BUFFER_COLLECTION,
+        f"{year}_{window}_{individual_id}",
+        {
+            "year": year,
+            "window": window,
+            "individual_id": individual_id,
+            "values": values,
+        },
+    )
+
+
+def schedule_window(year: int, window: int) -> None:
+    """
+    Enqueue the task processing the window after it ended. Tasks are named
+    deterministically so each window is processed once for all instances.
+    """
+    if (year, window) in _scheduled:
+        return
+    task_name = f"map-{year}-{window}"
+    try:
+        client().send(
+            {"year": year, "window": window},
+            task_name=task_name,
+            at=datetime.fromtimestamp(
+                (window + 1) * UPDATE_WINDOW + UPDATE_DELAY, timezone.utc
+            ),
+        )
+        log.debug("Enqueued map update task %s", task_name)
+    except google.api_core.exceptions.AlreadyExists:
+        log.debug("Map update task %s already enqueued", task_name)
+    _scheduled.add((year, window))
+
+
+def process_window(year: int, window: int) -> int:
+    """
+    Write the buffered changes of the year up to and including the window
+    with a single map update. Changes of earlier windows that were not
+    processed yet are included, later windows win.
+    Needs a composite index on maps_pending for year and window.
+    :return: amount of individuals updated
+    """
+    docs = sorted(
+        f.query_collection(BUFFER_COLLECTION, "year", "==", year)
+        .where(filter=f.FieldFilter("window", "<=", window))
+        .stream(),
+        key=lambda doc: doc.get("window"),
+    )
+    if not docs:
+        log.debug("No buffered map changes for %i in window %i", year, window)
+        return 0
+    values = {doc.get("individual_id"): doc.get("values") for doc in docs}
+    process_change({"year": year, "values": values})
+    f.delete_documents(BUFFER_COLLECTION, [doc.id for doc in docs])
+    log.info(
+        "Coalesced %i changes into one map update of %i individuals for %i",
+        len(docs),
+        len(values),
+        year,
     )
-    log.info("update map for %s", str(payload["values"].keys()))
+    return len(values)
+
+
+def process_change(payload: dict) -> None:
+    replace_delete_tokens(payload)
+    write_values(payload["year"], payload["values"])
+    log.info("update map for %i individuals", len(payload["values"]))
+
+
+def shard_count(year: int) -> int:
+    """:return: amount of shards of the year, 0 if the year is not sharded"""
+    manifest = f.get_document("maps", str(year))
+    return manifest.get("shards", 0) if manifest else 0
+
+
+def shard(individual_id: str, shards: int) -> int:
+    return zlib.crc32(individual_id.encode()) % shards
+
+
+def shard_collection(year: int) -> str:
+    return f"maps/{year}/{SHARD_COLLECTION}"
+
+
+def write_values(year: int, values: dict[str, dict]) -> None:
+    """
+    Merge map values of individuals into the shards of the year with one
+    batch, marking the shards written as modified in the manifest.
+    """
+    shards = shard_count(year)
+    if not shards:
+        f.write_document("maps", str(year), {"data": values}, merge=True)
+        return
+    shard_values: dict[int, dict] = defaultdict(dict)
+    for individual_id, individual_values in values.items():
+        shard_values[shard(individual_id, shards)][individual_id] = individual_values
+    with f.batch_commit() as batch:
+        for n, data in shard_values.items():
+            batch.set(
+                f.collection(shard_collection(year)).document(str(n)),
+                {"data": data},
+                merge=True,
+            )
+        batch.set(
+            f.collection("maps").document(str(year)),
+            {"modified": {str(n): f.SERVER_TIMESTAMP for n in shard_values}},
+            merge=True,
+        )
+
+
+def read_map(year: int) -> dict[str, dict]:
+    """:return: map values of all individuals of the year"""
+    if not shard_count(year):
+        return (f.get_document("maps", str(year)) or {}).get("data", {})
+    data: dict[str, dict] = {}
+    for doc in f.collection(shard_collection(year)).stream():
+        data.update(doc.get("data") or {})
+    return data
 
 
 def replace_delete_tokens(payload: dict) -> None:
@@ -138,8 +303,131 @@ def _should_update(
 
 
 def delete(year: int, individual_id: str) -> None:
-    f.update_document("maps", str(year), {f"data.{individual_id}": f.DELETE_FIELD})
+    pending = f.query_collection(
+        BUFFER_COLLECTION, "individual_id", "==", individual_id
+    ).stream()
+    f.delete_documents(BUFFER_COLLECTION, [doc.id for doc in pending])
+    write_values(year, {individual_id: f.DELETE_FIELD})
+
+
+def init(year: int, shards: int = SHARDS) -> None:
+    """Create the manifest and empty shards of the year's map."""
+    write_map(year, {}, shards)
+
+
+def write_map(year: int, data: dict[str, dict], shards: int = SHARDS) -> None:
+    """
+    Replace the map of the year with one batch writing the manifest and all
+    shards. Shards left over from a larger shard count are deleted.
+    """
+    previous_shards = shard_count(year)
+    shard_values: dict[int, dict] = {n: {} for n in range(shards)}
+    for individual_id, values in data.items():
+        shard_values[shard(individual_id, shards)][individual_id] = values
+    with f.batch_commit() as batch:
+        batch.set(
+            f.collection("maps").document(str(year)),
+            {
+                "year": year,
+                "shards": shards,
+                "modified": {str(n): f.SERVER_TIMESTAMP for n in range(shards)},
+            },
+        )
+        for n, values in shard_values.items():
+            batch.set(
+                f.collection(shard_collection(year)).document(str(n)),
+                {"year": year, "data": values},
+            )
+        for n in range(shards, previous_shards):
+            batch.delete(f.collection(shard_collection(year)).document(str(n)))
+
+
+def individual_values(individual: dict) -> dict:
+    """Map values of an individual document, see enqueue_change."""
+    values = {
+        "t": individual.get("type"),
+        "g": individual.get("geopos"),
+        "so": individual.get("source"),
+    }
+    optional = {
+        "p": individual.get("last_phenophase"),
+        "sp": individual.get("species"),
+        "ss": individual.get("station_species"),
+        "hs": True if individual.get("deveui") else None,
+    }
+    values.update({key: value for key, value in optional.items() if value})
+    return values
+
+
+def compare(expected: dict[str, dict], actual: dict[str, dict]) -> dict[str, list]:
+    """:return: ids of individuals missing, unexpected or changed in actual"""
+    return {
+        "missing": sorted(expected.keys() - actual.keys()),
+        "unexpected": sorted(actual.keys() - expected.keys()),
+        "changed": sorted(
+            individual_id
+            for individual_id in expected.keys() & actual.keys()
+            if expected[individual_id] != actual[individual_id]
+        ),
+    }
+
+
+def read_individual_values(year: int, current: dict[str, dict]) -> dict[str, dict]:
+    """
+    Map values of the individuals of the year shown on the map, see rebuild.
+    :param current: current map of the year
+    """
+    data = {}
+    query = d.query_individuals("year", "==", year).order_by("__name__")
+    for page in f.stream_pages(query, REBUILD_PAGE_SIZE):
+        for doc in page:
+            individual = doc.to_dict()
+            if doc.id in current or _should_update(
+                [],
+                True,
+                individual.get("station_species"),
+                individual.get("last_phenophase"),
+            ):
+                data[doc.id] = individual_values(individual)
+    return data
+
+
+def rebuild(year: int, shards: int = SHARDS, dry_run: bool = False) -> dict:
+    """
+    Rebuild the map of the year from its individuals with a single batch.
+    Individuals are included by the rule of the change path: individuals
+    created with a phenophase or station species, and individuals already on
+    the map, which were added by an update of a map relevant field. The
+    current map is compared to the rebuilt one and differences are logged.
+    :return: report with counts and timings
+    """
+    start = time.perf_counter()
+    current = read_map(year)
+    data = read_individual_values(year, current)
+    read_time = time.perf_counter() - start
 
+    differences = compare(data, current)
+    for key, individual_ids in differences.items():
+        if individual_ids:
+            log.warning(
+                "Map of %i has %i %s individuals: %s",
+                year,
+                len(individual_ids),
+                key,
+                individual_ids[:10],
+            )
 
-def init(year: int) -> None:
-    f.write_document("maps", str(year), {"year": year, "data": {}})
+    start = time.perf_counter()
+    if not dry_run:
+        write_map(year, data, shards)
+    write_time = time.perf_counter() - start
+    report = {
+        "year": year,
+        "individuals": len(data),
+        **{key: len(individual_ids) for key, individual_ids in differences.items()},
+        "read_time": round(read_time, 3),
+        "write_time": round(write_time, 3),
+        "dry_run": dry_run,
+    }
+    log.info("Rebuilt map: %s", report)
+    return report
@@ -0,0 +1,148 @@
+"""
+Static export of the yearly map to Storage, so clients load the map from
+the CDN instead of reading the map documents.
+
+Each shard is rendered into a gzip compressed GeoJSON file named after its
+content hash and cached for a year. A manifest with a short cache lifetime
+lists the current file of every shard. Shards are exported again when
+their modification time in the map manifest document changes.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+from collections.abc import Iterable
+
+import phenoback.utils.data as d
+import phenoback.utils.firestore as f
+from phenoback.functions import map as pheno_map
+from phenoback.utils import gcloud as g
+from phenoback.utils import storage
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+PATH = "public/maps"
+SHARD_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MANIFEST_CACHE_CONTROL = "public, max-age=60"
+PROPERTIES = ("t", "p", "so", "sp", "ss", "hs")
+
+
+def main(data, context):
+    """Export the shards modified in a map manifest update."""
+    if g.is_delete_event(data):
+        return
+    year = int(g.get_document_id(context))
+    shards = modified_shards(g.get_fields_updated(data), g.is_create_event(data))
+    if shards:
+        export(year, shards)
+    else:
+        log.debug("No shards modified for %i, skip export", year)
+
+
+def main_export(data, context):  # pylint: disable=unused-argument
+    """Export all shards of the given year, defaults to the phenoyear."""
+    year = data.get("year") if isinstance(data, dict) else None
+    export(int(year) if year else d.get_phenoyear())
+
+
+def modified_shards(updated_fields: list[str], created: bool) -> set[int] | None:
+    """
+    :return: shards to export, None for all shards
+    """
+    if created:
+        return None
+    shards = set()
+    for field in updated_fields:
+        if field.startswith("modified."):
+            shards.add(int(field.split(".")[1]))
+        elif field.startswith("data."):
+            # years without shards are exported as a single shard
+            shards.add(0)
+    return shards
+
+
+def shard_path(year: int, shard: int, version: str) -> str:
+    return f"{PATH}/{year}/{shard}-{version}.geojson"
+
+
+def manifest_path(year: int) -> str:
+    return f"{PATH}/{year}/manifest.json"
+
+
+def read_shard(year: int, shard: int, shards: int) -> dict[str, dict]:
+    if not shards:
+        return pheno_map.read_map(year)
+    document = f.get_document(pheno_map.shard_collection(year), str(shard))
+    return document.get("data", {}) if document else {}
+
+
+def render(data: dict[str, dict]) -> bytes:
+    """Render map values as GeoJSON feature collection."""
+    features = [
+        {
+            "type": "Feature",
+            "id": individual_id,
+            "geometry": {
+                "type": "Point",
+                "coordinates": [values["g"]["lng"], values["g"]["lat"]],
+            },
+            "properties": {key: values[key] for key in PROPERTIES if key in values},
+        }
+        for individual_id, values in sorted(data.items())
+        if isinstance(values.get("g"), dict)
+    ]
+    return json.dumps(
+        {"type": "FeatureCollection", "features": features},
+        separators=(",", ":"),
+    ).encode()
+
+
+def export(year: int, shards: Iterable[int] | None = None) -> dict:
+    """
+    Export the given shards of the year (all if None) and the manifest.
+    Shards whose content did not change are not uploaded again.
+    :return: the manifest
+    """
+    document = f.get_document("maps", str(year)) or {}
+    shard_count = document.get("shards", 0)
+    exported = document.get("export", {})
+    if shards is None:
+        shards = range(max(shard_count, 1))
+    files = {}
+    for shard in shards:
+        content = render(read_shard(year, shard, shard_count))
+        path = shard_path(year, shard, hashlib.sha256(content).hexdigest()[:16])
+        if exported.get(str(shard)) != path:
+            storage.upload_string(
+                None,
+                path,
+                gzip.compress(content, mtime=0),
+                content_type="application/geo+json",
+                cache_control=SHARD_CACHE_CONTROL,
+                content_encoding="gzip",
+            )
+            files[str(shard)] = path
+    if not files:
+        log.debug("Map export of %i unchanged", year)
+        return {"year": year, "shards": exported}
+    # merge per shard, concurrent exports of other shards are kept
+    f.write_document("maps", str(year), {"export": files}, merge=True)
+    exported = (f.get_document("maps", str(year)) or {}).get("export", {})
+    manifest = {
+        "year": year,
+        "version": hashlib.sha256(
+            json.dumps(exported, sort_keys=True).encode()
+        ).hexdigest()[:16],
+        "shards": exported,
+    }
+    storage.upload_string(
+        None,
+        manifest_path(year),
+        json.dumps(manifest),
+        content_type="application/json",
+        cache_control=MANIFEST_CACHE_CONTROL,
+    )
+    log.info("Exported %i map shards of %i", len(files), year)
+    return manifest
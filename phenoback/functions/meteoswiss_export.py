@@ -79,7 +79,7 @@ def process(year: int = None):
                     "ID": "",
                     "PARENT_ID": "",
                     "MEAS_PPH_2": "",
-                    "NAME_DE": d.get_phenophase(o["species"], o["phenophase"])["de"],
+                    "NAME_DE": d.get_phenophase_name(o["species"], o["phenophase"]),
                     "NAME_FR": "",
                     "NAME_EN": "",
                     "NAME_IT": "",
@@ -91,7 +91,7 @@ def process(year: int = None):
                     "LASTNAME": "",
                     "ORGANISATION": "",
                     "MODIFIED_2": "",
-                    "SPEC_SET_TENANT": d.get_species(o["species"])["de"],
+                    "SPEC_SET_TENANT": d.get_species_name(o["species"]),
                     "SPEC_SET_DE": "",
                     "SPEC_SET_FR": "",
                     "SPEC_SET_EN": "",
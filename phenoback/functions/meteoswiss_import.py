@@ -13,6 +13,7 @@ from phenoback.utils.firestore import (
     write_batch,
     write_document,
 )
+from phenoback.utils.importreport import ImportReport
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -23,20 +24,31 @@ class ResourceNotFoundException(Exception):
 
 
 def main(data, context):  # pylint: disable=unused-argument
+    """
+    Import meteoswiss stations and observations. If the message data contains
+    `{"dry_run": true}` nothing is written and a report of the changes is
+    uploaded to storage instead.
+    """
+    dry_run = isinstance(data, dict) and bool(data.get("dry_run"))
+    report = ImportReport("meteoswiss", dry_run=dry_run) if dry_run else None
     phenoyear = d.get_phenoyear()
     log.info("Import meteoswiss stations")
-    process_stations(phenoyear)
+    process_stations(phenoyear, report=report)
     log.info("Import meteoswiss observations")
-    process_observations()
+    process_observations(report=report)
+    if report:
+        report.upload()
 
 
-def process_stations(year: int) -> bool:
+def process_stations(year: int, report: ImportReport | None = None) -> bool:
     response = get(
         "https://data.geo.admin.ch/ch.meteoschweiz.messnetz-phaenologie/ch.meteoschweiz.messnetz-phaenologie_en.csv",
         timeout=60,
     )
     if response.ok:
-        return process_stations_response(year, response.text, response.elapsed)
+        return process_stations_response(
+            year, response.text, response.elapsed, report=report
+        )
     else:
         msg = f"Could not fetch station data ({response.status_code})"
         log.error(msg)
@@ -44,10 +56,26 @@ def process_stations(year: int) -> bool:
 
 
 def process_stations_response(
-    phenoyear: int, response_text: str, response_elapsed: float
+    phenoyear: int,
+    response_text: str,
+    response_elapsed: float,
+    report: ImportReport | None = None,
 ) -> bool:
+    """
+    Write stations if the station file changed. On dry-runs the stations are
+    always processed and compared to the current state.
+    """
     csv_string = _clean_station_csv(response_text)
-    if _load_hash("stations") != _get_hash(str(phenoyear) + csv_string):
+    changed = _load_hash("stations") != _get_hash(str(phenoyear) + csv_string)
+    if report and report.dry_run:
+        report.info["stations_file_changed"] = changed
+        with report.stage("stations_transform"):
+            reader = csv.DictReader(io.StringIO(csv_string), delimiter=";")
+            stations = _get_individuals_dicts(phenoyear, reader)
+        with report.stage("stations_diff"):
+            report.write_batch("individuals", "id", stations, merge=True)
+        return changed
+    if changed:
         reader = csv.DictReader(io.StringIO(csv_string), delimiter=";")
         stations = _get_individuals_dicts(phenoyear, reader)
         log.info("Update %i stations fetched in %s", len(stations), response_elapsed)
@@ -85,21 +113,41 @@ def _get_individuals_dicts(phenoyear: int, stations: csv.DictReader) -> list[dic
     ]
 
 
-def process_observations() -> bool:
+def process_observations(report: ImportReport | None = None) -> bool:
     response = get(
         "https://data.geo.admin.ch/ch.meteoschweiz.klima/phaenologie/phaeno_current.csv",
         timeout=60,
     )
     if response.ok:
-        return process_observations_response(response.text, response.elapsed)
+        return process_observations_response(
+            response.text, response.elapsed, report=report
+        )
     else:
         msg = f"Could not fetch observation data ({response.status_code})"
         log.error(msg)
         raise ResourceNotFoundException(msg)
 
 
-def process_observations_response(response_text: str, response_elapsed: float) -> bool:
-    if _load_hash("observations") != _get_hash(response_text):
+def process_observations_response(
+    response_text: str, response_elapsed: float, report: ImportReport | None = None
+) -> bool:
+    """
+    Write observations and station species if the observation file changed.
+    On dry-runs the observations are always processed and compared to the
+    current state.
+    """
+    changed = _load_hash("observations") != _get_hash(response_text)
+    if report and report.dry_run:
+        report.info["observations_file_changed"] = changed
+        with report.stage("observations_transform"):
+            reader = csv.DictReader(io.StringIO(response_text), delimiter=";")
+            observations = _get_observations_dicts(reader)
+            station_species = _get_station_species(observations)
+        with report.stage("observations_diff"):
+            report.write_batch("observations", "id", observations, merge=True)
+            _update_station_species(station_species, report=report)
+        return changed
+    if changed:
         reader = csv.DictReader(io.StringIO(response_text), delimiter=";")
         observations = _get_observations_dicts(reader)
         log.info(
@@ -146,7 +194,20 @@ def _get_station_species(observations: list[dict]) -> dict[str, list[str] | None
     return station_species
 
 
-def _update_station_species(station_species: dict) -> None:
+def _update_station_species(
+    station_species: dict, report: ImportReport | None = None
+) -> None:
+    if report and report.dry_run:
+        report.diff(
+            "individuals",
+            "id",
+            [
+                {"id": key, "station_species": ArrayUnion(species)}
+                for key, species in station_species.items()
+            ],
+            merge=True,
+        )
+        return
     for key in station_species.keys():
         data = {"station_species": ArrayUnion(station_species[key])}
         d.update_individual(key, data)
@@ -1,14 +1,72 @@
 import logging
+import string
+from functools import lru_cache
+from http import HTTPStatus
+from time import perf_counter
+
+import google.api_core.exceptions
+from flask import Request, Response
 
 from phenoback.functions import map as pheno_map
-from phenoback.functions.statistics import weekly
 from phenoback.functions.iot import app
+from phenoback.functions.statistics import weekly
 from phenoback.utils import data as d
 from phenoback.utils import firestore as f
+from phenoback.utils import tasks
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+QUEUE_NAME = "rollover"
+FUNCTION_NAME = "http_rollover_phenoyear"
+TASK_DEADLINE = 540
+PROGRESS_COLLECTION = "rollover"
+COPY_PAGE_SIZE = 500
+# seconds a rollover task copies individuals before continuing in a new task
+COPY_TIME_BUDGET = 300
+
+# fields of individuals carried over to the new phenoyear
+ROLLOVER_FIELDS = [
+    "altitude",
+    "description",
+    "deveui",
+    "exposition",
+    "forest",
+    "geopos",
+    "gradient",
+    "habitat",
+    "individual",
+    "issue",
+    "less100",
+    "name",
+    "sensor",
+    "shade",
+    "source",
+    "species",
+    "station_species",
+    "type",
+    "user",
+    "watering",
+]
+
+STALE_SHARDS = 4
+# ordered characters of individual ids after the year prefix used for sharding
+SHARD_ALPHABET = string.digits + string.ascii_uppercase + "_" + string.ascii_lowercase
+
+PENDING = "pending"
+DONE = "done"
+
+# rollover stages and the stages they depend on, stages without pending
+# dependencies are executed in parallel
+STAGES = {
+    "init_map": [],
+    "copy_individuals": ["init_map"],
+    "statistics_1y": [],
+    "clear_sensors": ["copy_individuals"],
+    "statistics_5y_30y": ["statistics_1y"],
+    "update_phenoyear": ["clear_sensors", "statistics_5y_30y"],
+}
+
 SOURCE_ROLLOVER_MAPPING = {
     "globe": True,
     "meteoswiss": False,
@@ -18,7 +76,31 @@ SOURCE_ROLLOVER_MAPPING = {
 
 
 def main(data, context):  # pylint: disable=unused-argument
-    rollover()
+    start_rollover()
+
+
+def main_process(request: Request):
+    payload = request.get_json(silent=True)
+    if "shard" in payload:
+        remove_stale_individuals(payload["year"], payload["shard"], payload["shards"])
+    else:
+        process_stage(payload["year"], payload["stage"], payload["run"])
+    return Response("ok", HTTPStatus.OK)
+
+
+def main_remove_stale(data, context):  # pylint: disable=unused-argument
+    """
+    Remove stale individuals of the given year, defaults to the previous
+    phenoyear.
+    """
+    data = data if isinstance(data, dict) else {}
+    year = int(data["year"]) if data.get("year") else None
+    enqueue_remove_stale_individuals(year, int(data.get("shards", STALE_SHARDS)))
+
+
+@lru_cache
+def client() -> tasks.GCFClient:
+    return tasks.GCFClient(QUEUE_NAME, FUNCTION_NAME)
 
 
 def does_rollover(individual: dict) -> bool:
@@ -31,99 +113,344 @@ def does_rollover(individual: dict) -> bool:
         raise ValueError(msg) from ex
 
 
-def get_rollover_individuals(
-    source_phenoyear: int,
-    target_phenoyear: int,
-    individual: str = None,
-) -> list[dict]:
-    """
-    Copy individuals to a new phenoyear, removing all fields that are specific for the phenoyear.
-    :param source_phenoyear:
-    :param target_phenoyear:
-    :return:
-    """
-    new_individuals = []
-    query = d.query_individuals("year", "==", source_phenoyear)
-    if individual is not None:  # debuging or fixing
-        query = query.where(filter=f.FieldFilter("individual", "==", individual))
-    for individual_doc in query.stream():
-        individual = individual_doc.to_dict()
-        if does_rollover(individual):
-            individual["id"] = f'{target_phenoyear}_{individual["individual"]}'
-            individual["year"] = target_phenoyear
-            for key in [
-                "last_phenophase",
-                "last_observation_date",
-                "created",
-                "modified",
-                "reprocess",
-            ]:
-                individual.pop(key, None)
-            if individual.get("sensor"):
-                individual["sensor"] = {}
-            new_individuals.append(individual)
-            log.debug("marking individual %s for rollover", individual)
-    return new_individuals
+def rollover_individual(individual: dict, target_phenoyear: int) -> dict:
+    """
+    Transform an individual to the target phenoyear, removing all fields that
+    are specific for the phenoyear.
+    """
+    individual["id"] = f'{target_phenoyear}_{individual["individual"]}'
+    individual["year"] = target_phenoyear
+    for key in [
+        "last_phenophase",
+        "last_observation_date",
+        "created",
+        "modified",
+        "reprocess",
+    ]:
+        individual.pop(key, None)
+    if individual.get("sensor"):
+        individual["sensor"] = {}
+    log.debug("marking individual %s for rollover", individual)
+    return individual
 
 
 def rollover():
+    """
+    Execute all rollover stages of the current phenoyear within a single
+    invocation. Stages are defined in dependency order.
+    """
     source_phenoyear = d.get_phenoyear()
-    target_phenoyear = source_phenoyear + 1
-    log.info(
-        "Gather rollover individuals of %i to %i", source_phenoyear, target_phenoyear
+    log.info("Rollover %i to %i", source_phenoyear, source_phenoyear + 1)
+    for stage in STAGES:
+        state = {"status": PENDING}
+        while state["status"] != DONE:
+            state = run_stage(stage, source_phenoyear, state)
+
+
+def start_rollover() -> None:
+    """
+    Start a staged rollover of the current phenoyear. Stages are executed by
+    cloud tasks and their progress is stored in the rollover collection. Starting
+    an unfinished rollover again resumes it with the stages not yet done.
+    """
+    source_phenoyear = d.get_phenoyear()
+    progress = get_progress(source_phenoyear)
+    if progress and progress.get("finished"):
+        log.warning("Rollover of %i already finished", source_phenoyear)
+        return
+    run = progress.get("run", 0) + 1 if progress else 1
+    stages = progress.get("stages", {}) if progress else {}
+    log.info("Start rollover of %i (run %i)", source_phenoyear, run)
+    f.write_document(
+        PROGRESS_COLLECTION,
+        str(source_phenoyear),
+        {
+            "source_year": source_phenoyear,
+            "target_year": source_phenoyear + 1,
+            "run": run,
+            "started": f.SERVER_TIMESTAMP,
+            "stages": {
+                stage: stages.get(stage, {"status": PENDING}) for stage in STAGES
+            },
+        },
+        merge=True,
     )
-    new_individuals = get_rollover_individuals(source_phenoyear, target_phenoyear)
+    enqueue_ready_stages(source_phenoyear)
 
-    log.info("Create maps document for %i", target_phenoyear)
-    pheno_map.init(target_phenoyear)
 
-    log.info(
-        "Creating %i new individuals in %i", len(new_individuals), target_phenoyear
+def get_progress(source_phenoyear: int) -> dict | None:
+    return f.get_document(PROGRESS_COLLECTION, str(source_phenoyear))
+
+
+def set_stage_progress(source_phenoyear: int, stage: str, state: dict) -> None:
+    f.update_document(
+        PROGRESS_COLLECTION,
+        str(source_phenoyear),
+        {f"stages.{stage}": {**state, "updated": f.SERVER_TIMESTAMP}},
     )
-    d.write_individuals(new_individuals, "id")
 
-    cleared_sensors = app.clear_sensors(source_phenoyear)
-    log.info(
-        "Cleared %i sensors from individuals for %i", cleared_sensors, source_phenoyear
+
+def ready_stages(progress: dict) -> list[str]:
+    """Pending stages whose dependencies are all done."""
+    status = {stage: state["status"] for stage, state in progress["stages"].items()}
+    return [
+        stage
+        for stage, dependencies in STAGES.items()
+        if status.get(stage) == PENDING
+        and all(status.get(dependency) == DONE for dependency in dependencies)
+    ]
+
+
+def enqueue_ready_stages(source_phenoyear: int) -> None:
+    progress = get_progress(source_phenoyear)
+    for stage in ready_stages(progress):
+        enqueue_stage(source_phenoyear, stage, progress["run"])
+
+
+def enqueue_stage(source_phenoyear: int, stage: str, run: int, chunk: int = 0) -> None:
+    """
+    Enqueue a rollover stage. Tasks are named deterministically so concurrent
+    stages completing at the same time enqueue their successor only once.
+    """
+    task_name = f"rollover-{source_phenoyear}-{run}-{stage.replace('_', '-')}-{chunk}"
+    try:
+        client().send(
+            {"year": source_phenoyear, "stage": stage, "run": run},
+            task_name=task_name,
+            deadline=TASK_DEADLINE,
+        )
+        log.info("Enqueued rollover stage %s for %i", stage, source_phenoyear)
+    except google.api_core.exceptions.AlreadyExists:
+        log.debug("Rollover task %s already enqueued", task_name)
+
+
+def process_stage(source_phenoyear: int, stage: str, run: int) -> None:
+    """
+    Execute a rollover stage or the next chunk of it. Finished stages enqueue
+    the stages depending on them, unfinished stages enqueue their next chunk.
+    """
+    progress = get_progress(source_phenoyear)
+    if not progress or progress["run"] != run:
+        log.warning("Skip stage %s of outdated rollover run %i", stage, run)
+        return
+    state = progress["stages"][stage]
+    if state["status"] == DONE:
+        log.info("Rollover stage %s for %i already done", stage, source_phenoyear)
+    else:
+        log.info("Process rollover stage %s for %i", stage, source_phenoyear)
+        state = run_stage(stage, source_phenoyear, state)
+        set_stage_progress(source_phenoyear, stage, state)
+        if state["status"] != DONE:
+            enqueue_stage(source_phenoyear, stage, run, state.get("chunk", 0))
+            return
+    if stage == "update_phenoyear":
+        f.update_document(
+            PROGRESS_COLLECTION,
+            str(source_phenoyear),
+            {"finished": f.SERVER_TIMESTAMP},
+        )
+        log.info("Rollover of %i finished", source_phenoyear)
+    else:
+        enqueue_ready_stages(source_phenoyear)
+
+
+def run_stage(stage: str, source_phenoyear: int, state: dict) -> dict:
+    """
+    Execute a rollover stage and return its new state.
+    """
+    target_phenoyear = source_phenoyear + 1
+    if stage == "init_map":
+        log.info("Create maps document for %i", target_phenoyear)
+        pheno_map.init(target_phenoyear)
+    elif stage == "copy_individuals":
+        return copy_individuals_chunk(source_phenoyear, target_phenoyear, state)
+    elif stage == "clear_sensors":
+        cleared_sensors = app.clear_sensors(source_phenoyear)
+        log.info(
+            "Cleared %i sensors from individuals for %i",
+            cleared_sensors,
+            source_phenoyear,
+        )
+        return {"status": DONE, "cleared": cleared_sensors}
+    elif stage == "statistics_1y":
+        log.info("Process year aggregate statistics for %i", source_phenoyear)
+        weekly.process_1y_aggregate_statistics(source_phenoyear)
+    elif stage == "statistics_5y_30y":
+        log.info("Process 5/30y aggregate statistics for %i", target_phenoyear)
+        weekly.process_5y_30y_aggregate_statistics(target_phenoyear)
+    elif stage == "update_phenoyear":
+        log.info(
+            "Setting current phenoyear from %i to %i",
+            source_phenoyear,
+            target_phenoyear,
+        )
+        d.update_phenoyear(target_phenoyear)
+    else:
+        raise ValueError(f"Unknown rollover stage {stage}")
+    return {"status": DONE}
+
+
+def copy_individuals_chunk(
+    source_phenoyear: int, target_phenoyear: int, state: dict
+) -> dict:
+    """
+    Copy individuals to the target year until the time budget of the task is
+    used. The id of the last processed individual is kept as cursor to resume
+    in the next task.
+    """
+    copied, cursor = copy_individuals(
+        source_phenoyear,
+        target_phenoyear,
+        cursor=state.get("cursor"),
+        time_budget=COPY_TIME_BUDGET,
     )
+    copied += state.get("copied", 0)
+    if cursor is None:
+        return {"status": DONE, "copied": copied}
+    return {
+        "status": PENDING,
+        "cursor": cursor,
+        "chunk": state.get("chunk", 0) + 1,
+        "copied": copied,
+    }
 
-    log.info("Process year aggregate statistics for %i", source_phenoyear)
-    weekly.process_1y_aggregate_statistics(source_phenoyear)
-    log.info("Process 5/30y aggregate statistics for %i", target_phenoyear)
-    weekly.process_5y_30y_aggregate_statistics(target_phenoyear)
 
+def copy_individuals(
+    source_phenoyear: int,
+    target_phenoyear: int,
+    cursor: str | None = None,
+    time_budget: float | None = None,
+) -> tuple[int, str | None]:
+    """
+    Stream the individuals of the source phenoyear page by page into batched
+    writes for the target phenoyear. Only the fields carried over are read.
+    :param cursor: id of the last individual already copied
+    :param time_budget: stop after the page exceeding the budget (seconds)
+    :return: amount of individuals copied and the cursor to continue with or
+        None if all individuals were copied
+    """
+    query = (
+        d.query_individuals("year", "==", source_phenoyear)
+        .select(ROLLOVER_FIELDS)
+        .order_by("__name__")
+    )
+    start_after = f.collection("individuals").document(cursor) if cursor else None
+    start = perf_counter()
+    read = copied = 0
+    for page in f.stream_pages(query, COPY_PAGE_SIZE, start_after):
+        new_individuals = [
+            rollover_individual(individual, target_phenoyear)
+            for individual in (doc.to_dict() for doc in page)
+            if does_rollover(individual)
+        ]
+        d.write_individuals(new_individuals, "id")
+        read += len(page)
+        copied += len(new_individuals)
+        elapsed = perf_counter() - start
+        log.debug(
+            "Copied %i of %i individuals to %i (%.1f/s)",
+            copied,
+            read,
+            target_phenoyear,
+            read / elapsed if elapsed else 0,
+        )
+        if time_budget is not None and elapsed > time_budget:
+            log.info("Time budget exceeded after %i individuals", read)
+            return copied, page[-1].id
+    elapsed = perf_counter() - start
     log.info(
-        "Setting current phenoyear from %i to %i", source_phenoyear, target_phenoyear
+        "Copied %i of %i individuals from %i to %i in %.1fs (%.1f/s)",
+        copied,
+        read,
+        source_phenoyear,
+        target_phenoyear,
+        elapsed,
+        read / elapsed if elapsed else 0,
+    )
+    return copied, None
+
+
+def shard_bounds(year: int, shard: int, shards: int) -> tuple[str | None, str | None]:
+    """
+    Document id range [start, end) of a shard of the individuals of a year.
+    None is returned for open bounds on the first and last shard.
+    """
+    if not 0 <= shard < shards <= len(SHARD_ALPHABET):
+        raise ValueError(f"Invalid shard {shard} of {shards}")
+    step = len(SHARD_ALPHABET) / shards
+    start = f"{year}_{SHARD_ALPHABET[round(shard * step)]}" if shard > 0 else None
+    end = (
+        f"{year}_{SHARD_ALPHABET[round((shard + 1) * step)]}"
+        if shard < shards - 1
+        else None
     )
-    d.update_phenoyear(target_phenoyear)
+    return start, end
 
 
-def get_stale_individuals(year: int) -> list[str]:
+def get_stale_individuals(year: int, shard: int = 0, shards: int = 1) -> list[str]:
     """
-    Remove all individuals in Firestore that have no observations for any
-    sources or sensor data for the given phenoyear year.
+    Get all individuals in Firestore that have no observations for any
+    sources or sensor data for the given phenoyear year. Only the fields
+    needed to decide are read.
     :param year: the phenoyear
+    :param shard: the shard to process
+    :param shards: amount of shards the individuals are split into
     """
-    stale_list = []
-    for individual_doc in d.query_individuals("year", "==", year).stream():
-        individual = individual_doc.to_dict()
-        if not (d.has_observations(individual) or d.has_sensor(individual)):
-            stale_list.append(individual_doc.id)
-    return stale_list
+    query = d.query_individuals("year", "==", year).select(
+        ["last_observation_date", "sensor"]
+    )
+    start, end = shard_bounds(year, shard, shards)
+    if start:
+        query = query.where(
+            filter=f.FieldFilter(
+                "__name__", ">=", f.collection("individuals").document(start)
+            )
+        )
+    if end:
+        query = query.where(
+            filter=f.FieldFilter(
+                "__name__", "<", f.collection("individuals").document(end)
+            )
+        )
+    return [
+        individual_doc.id
+        for individual_doc in query.stream()
+        if not (
+            d.has_observations(individual_doc.to_dict())
+            or d.has_sensor(individual_doc.to_dict())
+        )
+    ]
 
 
-def remove_stale_individuals(year: int = None):
+def remove_stale_individuals(
+    year: int | None = None, shard: int = 0, shards: int = 1
+) -> int:
     # split querying and deleting to avoid stream timeouts
     if not year:
         year = d.get_phenoyear() - 1
-    log.info("Gather stale individuals for %i", year)
-    stale_individuals = get_stale_individuals(year)
+    log.info("Gather stale individuals for %i (shard %i/%i)", year, shard, shards)
+    stale_individuals = get_stale_individuals(year, shard, shards)
 
     log.info(
-        "Remove %i stale individuals for %i",
+        "Remove %i stale individuals for %i (shard %i/%i)",
         len(stale_individuals),
         year,
+        shard,
+        shards,
     )
-    for individual_id in stale_individuals:
-        log.debug("Remove individual %s", individual_id)
-        d.delete_individual(individual_id)
+    return f.delete_documents("individuals", stale_individuals)
+
+
+def enqueue_remove_stale_individuals(
+    year: int | None = None, shards: int = STALE_SHARDS
+) -> None:
+    """
+    Remove stale individuals of a year with one task per shard.
+    """
+    if not year:
+        year = d.get_phenoyear() - 1
+    log.info("Enqueue removal of stale individuals for %i in %i shards", year, shards)
+    for shard in range(shards):
+        client().send(
+            {"year": year, "shard": shard, "shards": shards}, deadline=TASK_DEADLINE
+        )
@@ -3,27 +3,28 @@ import io
 import logging
 import os
 from datetime import datetime
-from functools import lru_cache
 from zipfile import ZipFile
 
 from google.cloud.storage import Blob
 
-from phenoback.functions.statistics import weekly
+from phenoback.functions.statistics import datacache, weekly
 from phenoback.utils import data as d
 from phenoback.utils import firestore as f
 from phenoback.utils import storage as s
+from phenoback.utils.importreport import ImportReport
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
 SOURCE = "wld"
+IMPORT_PATH = "private/wld_import/"
+ALL_YEARS_FOLDER = "all_years"
+DRY_RUN_FOLDER = "dry_run"
 NICKNAME = "PhaenoWaldWSL"
 FILES = {"tree.csv", "observation_phaeno.csv", "user_id.csv", "site.csv"}
 MAX_ARCHIVE_BYTES = 100000
 
-loaded_data = {}  # pylint: disable=invalid-name
-
 SPECIES_MAP = {
     "58": "BA",
     "10": "FI",
@@ -52,21 +53,50 @@ PHASES_MAP = {
 
 def main(data, context):  # pylint: disable=unused-argument
     """
-    Import wld data on file upload to private/wld_import
+    Import wld data on file upload to private/wld_import. Archives uploaded to
+    an all_years folder import every year present in the observations, archives
+    uploaded to a dry_run folder only report the changes, e.g.
+    private/wld_import/dry_run/all_years/archive.zip.
     """
     pathfile = data["name"]
-    if pathfile.startswith("private/wld_import/"):
-        # default to previous year if not specified
-        year = d.get_phenoyear() - 1
-        log.info("Import wld data for %s", pathfile)
-        import_data(pathfile, year)
-
-
-def update_statistics(year: int) -> None:
-    log.info("Process year aggregate statistics for %i", year)
-    weekly.process_1y_aggregate_statistics(year)
-    log.info("Process 5/30y aggregate statistics for %i", year)
-    weekly.process_5y_30y_aggregate_statistics(year)
+    if pathfile.startswith(IMPORT_PATH):
+        folders = pathfile[len(IMPORT_PATH) :].split("/")[:-1]
+        dry_run = DRY_RUN_FOLDER in folders
+        if ALL_YEARS_FOLDER in folders:
+            log.info("Import wld data for all years in %s", pathfile)
+            import_data(pathfile, dry_run=dry_run)
+        else:
+            # default to previous year if not specified
+            year = d.get_phenoyear() - 1
+            log.info("Import wld data for %s", pathfile)
+            import_data(pathfile, year, dry_run=dry_run)
+
+
+def update_statistics(years: list[int]) -> None:
+    """
+    Recompute the statistics affected by imported years. 1y aggregates are
+    processed for each imported year, 5/30y aggregates for every year up to the
+    current phenoyear that includes one of the imported years. 1y statistics
+    are loaded once for the whole range.
+
+    :param years: Imported years
+    """
+    if not years:
+        return
+    datacache.cache_clear()
+    weekly.get_1y_agg_statistics.cache_clear()
+    for year in years:
+        log.info("Process year aggregate statistics for %i", year)
+        weekly.process_1y_aggregate_statistics(year)
+
+    first_year = min(years) + 1
+    last_year = min(max(years) + 30, d.get_phenoyear())
+    log.info("Process 5/30y aggregate statistics for %i-%i", first_year, last_year)
+    for year in range(first_year, last_year + 1):
+        weekly.process_5y_30y_aggregate_statistics(
+            year, stat_start_range=first_year - 30, stat_end_range=last_year
+        )
+    weekly.get_1y_agg_statistics.cache_clear()
 
 
 def members_by_basename(z: ZipFile) -> dict[str, list[str]]:
@@ -134,7 +164,77 @@ def load_data(input_zip: ZipFile) -> dict[str, list[dict]]:
     return data
 
 
-def check_data_integrity():
+class ImportContext:
+    """
+    Data loaded from an import archive together with the lookup indexes needed
+    for validation and transformation. Indexes are built in a single pass over
+    each file when the context is created and live as long as the import.
+    """
+
+    def __init__(self, data: dict[str, list[dict]]) -> None:
+        self.data = data
+        self.user_ids: set[str] = {u["user_id"] for u in data["user_id.csv"]}
+        self.site_ids: set[str] = {s["site_id"] for s in data["site.csv"]}
+        self.station_species: dict[str, set[str]] = {}
+        self.tree_species: dict[str, dict[str, str]] = {}
+        self.site_users: dict[str, dict[str, str]] = {}
+        self.year_observations: dict[int, list[dict]] = {}
+
+        for tree in data["tree.csv"]:
+            species = map_species(tree["species_id"])
+            self.station_species.setdefault(tree["site_id"], set()).add(species)
+            self.tree_species.setdefault(tree["site_id"], {})[tree["tree_id"]] = species
+
+        for obs in data["observation_phaeno.csv"]:
+            self.site_users.setdefault(obs["site_id"], {})[obs["year"]] = obs["user_id"]
+            self.year_observations.setdefault(int(obs["year"]), []).append(obs)
+
+    @property
+    def years(self) -> list[int]:
+        """Years present in the observation file in ascending order."""
+        return sorted(self.year_observations)
+
+    @property
+    def tree_cnt(self) -> int:
+        return len(self.data["tree.csv"])
+
+    def has_tree(self, site_id: str, tree_id: str) -> bool:
+        return tree_id in self.tree_species.get(site_id, {})
+
+    def unique_tree_cnt(self) -> int:
+        return sum(len(trees) for trees in self.tree_species.values())
+
+    def get_site_species(self, site_id: str) -> list[str]:
+        """
+        Gets list of species present at a specific site.
+
+        :param site_id: ID of the site
+        :returns: List of species codes (filtered to remove None values)
+        """
+        return [species for species in self.station_species[site_id] if species]
+
+    def get_tree_species(self, site_id: str, tree_id: str) -> str:
+        """
+        Gets the species of a specific tree at a site.
+
+        :param site_id: ID of the site
+        :param tree_id: ID of the tree
+        :returns: Species code for the tree
+        """
+        return self.tree_species[site_id][tree_id]
+
+    def get_user(self, site_id: str, year: str | int) -> str | None:
+        """
+        Gets the user ID who made observations at a site in a specific year.
+
+        :param site_id: ID of the site
+        :param year: Year of the observations
+        :returns: User ID or None if no user found
+        """
+        return self.site_users.get(site_id, {}).get(str(year))
+
+
+def check_data_integrity(ctx: ImportContext):
     """
     Validates data integrity across all imported CSV files.
 
@@ -146,27 +246,25 @@ def check_data_integrity():
     - No multiple users have observations for same site in same year
     - Tree ID format is correct
 
+    :param ctx: Import context of the loaded archive
     :raises ValueError: If any data integrity check fails
     """
     error = False
-    users = {u["user_id"]: True for u in loaded_data["user_id.csv"]}
-    sites = {s["site_id"]: True for s in loaded_data["site.csv"]}
-    trees = {f"${s['site_id']},${s['tree_id']}": True for s in loaded_data["tree.csv"]}
     site_year_user = {}
 
-    for row in loaded_data["observation_phaeno.csv"]:
+    for row in ctx.data["observation_phaeno.csv"]:
         user_id = row.get("user_id")
         site_id = row.get("site_id")
         tree_id = row.get("tree_id")
         observation_id = row.get("observation_id")
         year = row.get("year")
-        if not users.get(user_id):
+        if user_id not in ctx.user_ids:
             log.error("user_id not found: %s", user_id)
             error = True
-        if not sites.get(site_id):
+        if site_id not in ctx.site_ids:
             log.error("site_id not found: %s", site_id)
             error = True
-        if not trees.get(f"${site_id},${tree_id}"):
+        if not ctx.has_tree(site_id, tree_id):
             log.error("tree not found: site_id=%s, tree_id=%s", site_id, tree_id)
             error = True
         if not PHASES_MAP.get(observation_id):
@@ -188,7 +286,7 @@ def check_data_integrity():
             log.error("wrong tree_id format: %s", tree_id)
             error = True
 
-    if len(loaded_data["tree.csv"]) != len(trees.keys()):
+    if ctx.tree_cnt != ctx.unique_tree_cnt():
         log.error("Duplicate entries in trees file")
         error = True
 
@@ -196,102 +294,65 @@ def check_data_integrity():
         raise ValueError("Data integrity check failed")
 
 
-def import_data(pathfile: str, year: int, bucket=None):
+def import_data(
+    pathfile: str, year: int | None = None, bucket=None, dry_run: bool = False
+) -> list[int]:
     """
     Main import function that processes WLD data from a ZIP file.
 
     :param pathfile: Path to the ZIP file in cloud storage
+    :param year: Year to import data for. If not set all years present in the
+        observations are imported and statistics are recomputed for the
+        affected years.
     :param bucket: Optional GCS bucket (defaults to configured bucket)
-    :param year: Year to import data for (defaults to previous phenological year)
-    """
-    global loaded_data  # pylint: disable=global-statement
-
-    log.info("importing year %i", year)
-    blob = s.get_blob(bucket, pathfile)
-    check_file_size(blob)
-
-    with ZipFile(io.BytesIO(blob.download_as_bytes()), mode="r") as input_zip:
-        check_zip_archive(input_zip)
-        loaded_data = load_data(input_zip)
-    check_data_integrity()
-
-    insert_data("public_users", public_users())
-    insert_data("users", users())
-    insert_data("individuals", individuals(year))
-    insert_data("observations", observations(year))
-
-
-@lru_cache
-def station_species() -> dict[str, set[str]]:
-    """
-    Creates a mapping of site IDs to sets of species present at each site.
-
-    :returns: Dictionary mapping site_id to set of species codes
-    """
-    result = {}
-    for tree in loaded_data["tree.csv"]:
-        result.setdefault(tree["site_id"], set()).add(map_species(tree["species_id"]))
-    return result
-
-
-@lru_cache
-def tree_species() -> dict[str, dict[str, str]]:
-    """
-    Creates a nested mapping of site IDs to tree IDs to species.
-
-    :returns: Dictionary mapping site_id -> tree_id -> species code
-    """
-    result = {}
-    for tree in loaded_data["tree.csv"]:
-        result.setdefault(tree["site_id"], {})[tree["tree_id"]] = map_species(
-            tree["species_id"]
-        )
-    return result
-
-
-@lru_cache
-def site_users() -> dict[str, dict[str, str]]:
-    """
-    Creates a mapping of site IDs to years to user IDs.
-
-    :returns: Dictionary mapping site_id -> year -> user_id
-    """
-    result = {}
-    for obs in loaded_data["observation_phaeno.csv"]:
-        result.setdefault(obs["site_id"], {})[obs["year"]] = obs["user_id"]
-    return result
-
-
-def get_site_species(site_id: str) -> list[str]:
-    """
-    Gets list of species present at a specific site.
-
-    :param site_id: ID of the site
-    :returns: List of species codes (filtered to remove None values)
-    """
-    return list(filter(lambda species: species, station_species()[site_id]))
-
-
-def get_tree_species(site_id: str, tree_id: str) -> str:
-    """
-    Gets the species of a specific tree at a site.
-
-    :param site_id: ID of the site
-    :param tree_id: ID of the tree
-    :returns: Species code for the tree
-    """
-    return tree_species()[site_id][tree_id]
-
-
-def get_user(site_id: str, year: str) -> str:
-    """
-    Gets the user ID who made observations at a site in a specific year.
-
-    :param site_id: ID of the site
-    :param year: Year as string
-    :returns: User ID or None if no user found
-    """
-    return site_users().get(site_id, {}).get(str(year))
+    :param dry_run: Do not write any data but upload a report of the changes
+    :returns: The imported years
+    """
+    report = ImportReport(SOURCE, dry_run=dry_run)
+    with report.stage("load"):
+        blob = s.get_blob(bucket, pathfile)
+        check_file_size(blob)
+
+        with ZipFile(io.BytesIO(blob.download_as_bytes()), mode="r") as input_zip:
+            check_zip_archive(input_zip)
+            ctx = ImportContext(load_data(input_zip))
+    with report.stage("validate"):
+        check_data_integrity(ctx)
+
+    years = [year] if year is not None else ctx.years
+    log.info("importing years %s (dry_run=%s)", years, dry_run)
+    report.info.update({"pathfile": pathfile, "years": years})
+
+    with report.stage("transform"):
+        user_documents = {
+            "public_users": public_users(ctx),
+            "users": users(ctx),
+        }
+    with report.stage("write"):
+        for collection, documents in user_documents.items():
+            insert_data(collection, documents, report)
+    for import_year in years:
+        with report.stage("transform"):
+            year_documents = {
+                "individuals": individuals(ctx, import_year),
+                "observations": observations(ctx, import_year),
+            }
+        with report.stage("write"):
+            for collection, documents in year_documents.items():
+                insert_data(collection, documents, report)
+
+    if year is None:
+        if dry_run:
+            report.info["statistics_years"] = years
+        else:
+            with report.stage("statistics"):
+                update_statistics(years)
+
+    if dry_run:
+        report.upload(bucket)
+    else:
+        log.info("Import timings: %s", report.to_dict()["stages"])
+    return years
 
 
 def wsl_user(user_id) -> str:
@@ -324,10 +385,11 @@ def map_phenophase(wsl_observation_id):
     return PHASES_MAP[wsl_observation_id]
 
 
-def individuals(year: int):
+def individuals(ctx: ImportContext, year: int):
     """
     Creates individual records for all sites with observations in the given year.
 
+    :param ctx: Import context of the loaded archive
     :param year: Year to process
     :returns: List of individual dictionaries ready for Firestore insertion
     """
@@ -340,28 +402,29 @@ def individuals(year: int):
             "name": site["site_name"],
             "source": SOURCE,
             "type": "station",
-            "user": wsl_user(get_user(site["site_id"], year)),
+            "user": wsl_user(ctx.get_user(site["site_id"], year)),
             "year": year,
-            "station_species": get_site_species(site["site_id"]),
+            "station_species": ctx.get_site_species(site["site_id"]),
         }
-        for site in loaded_data["site.csv"]
-        if get_user(site["site_id"], year) and get_site_species(site["site_id"])
+        for site in ctx.data["site.csv"]
+        if ctx.get_user(site["site_id"], year) and ctx.get_site_species(site["site_id"])
     ]
 
 
-def observations(year: int):
+def observations(ctx: ImportContext, year: int):
     """
     Creates observation records for the given year.
 
+    :param ctx: Import context of the loaded archive
     :param year: Year to filter observations
     :returns: List of observation dictionaries ready for Firestore insertion
     """
     return [
         {
-            "id": f"{SOURCE}_{o['site_id']}_{o['tree_id']}_{o['year']}_{get_tree_species(o['site_id'], o['tree_id'])}_{map_phenophase(o['observation_id'])}",
+            "id": f"{SOURCE}_{o['site_id']}_{o['tree_id']}_{o['year']}_{ctx.get_tree_species(o['site_id'], o['tree_id'])}_{map_phenophase(o['observation_id'])}",
             "individual": f"{SOURCE}_{o['site_id']}",
             "individual_id": f"{o['year']}_{SOURCE}_{o['site_id']}",
-            "species": get_tree_species(o["site_id"], o["tree_id"]),
+            "species": ctx.get_tree_species(o["site_id"], o["tree_id"]),
             "user": f"{SOURCE}_{o['user_id']}",
             "year": year,
             "tree_id": o["tree_id"].split("_", 1)[1],
@@ -369,15 +432,16 @@ def observations(year: int):
             "phenophase": map_phenophase(o["observation_id"]),
             "source": SOURCE,
         }
-        for o in loaded_data["observation_phaeno.csv"]
-        if int(o["year"]) == year and get_tree_species(o["site_id"], o["tree_id"])
+        for o in ctx.year_observations.get(year, [])
+        if ctx.get_tree_species(o["site_id"], o["tree_id"])
     ]
 
 
-def users():
+def users(ctx: ImportContext):
     """
     Creates user records from imported user data.
 
+    :param ctx: Import context of the loaded archive
     :returns: List of user dictionaries with formatted IDs and names
     """
     return [
@@ -387,28 +451,32 @@ def users():
             "lastname": u["name_last"],
             "nickname": NICKNAME,
         }
-        for u in loaded_data["user_id.csv"]
+        for u in ctx.data["user_id.csv"]
     ]
 
 
-def public_users():
+def public_users(ctx: ImportContext):
     """
     Creates public user records with limited information.
 
+    :param ctx: Import context of the loaded archive
     :returns: List of public user dictionaries with ID, nickname, and roles
     """
     return [
         {"id": wsl_user(u["user_id"]), "nickname": NICKNAME, "roles": [SOURCE]}
-        for u in loaded_data["user_id.csv"]
+        for u in ctx.data["user_id.csv"]
     ]
 
 
-def insert_data(collection: str, documents: list[dict]) -> None:
+def insert_data(
+    collection: str, documents: list[dict], report: ImportReport | None = None
+) -> None:
     """
     Batch inserts documents into a Firestore collection.
 
     :param collection: Name of the Firestore collection
     :param documents: List of documents to insert
+    :param report: Optional import report, only reporting changes on dry-runs
     """
     if len(documents) == 0:
         log.error(
@@ -417,4 +485,7 @@ def insert_data(collection: str, documents: list[dict]) -> None:
         )
     else:
         log.debug("Import %i record to collection %s", len(documents), collection)
-        f.write_batch(collection, "id", documents)
+        if report is not None:
+            report.write_batch(collection, "id", documents)
+        else:
+            f.write_batch(collection, "id", documents)
@@ -1,21 +1,77 @@
 import logging
-from functools import lru_cache
+import time
 
-from google.cloud import bigquery
+from phenoback.utils import clients
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# row errors caused by other rows or transient backend failures
+RETRYABLE_REASONS = {"stopped", "backendError", "internalError", "timeout"}
+MAX_RETRIES = 3
+RETRY_DELAY = 1.0
+
 
-@lru_cache
 def client():
-    return bigquery.Client()  # pragma: no cover
+    return clients.get("bigquery")  # pragma: no cover
 
 
-def insert_data(table: str, data: dict | list[dict]):
+def insert_data(
+    table: str,
+    data: dict | list[dict],
+    retries: int = MAX_RETRIES,
+    row_ids: list[str] | None = None,
+) -> list[dict]:
+    """
+    Insert rows into a table. Rows failing with a retryable reason are
+    inserted again with exponential backoff, other row errors are logged.
+    :param row_ids: optional insert ids used by bigquery to deduplicate rows
+    :return: rows that were not inserted
+    """
     if isinstance(data, dict):
         data = [data]
     log.debug("Insert %i rows into %s", len(data), table)
-    errors = client().insert_rows_json(table, data)
-    if errors:
-        log.error("errors: %s", errors)
+    rows = data
+    failed_rows: list[dict] = []
+    for attempt in range(retries + 1):
+        if row_ids is None:
+            errors = client().insert_rows_json(table, rows)
+        else:
+            errors = client().insert_rows_json(table, rows, row_ids=row_ids)
+        if not errors:
+            return failed_rows
+        if row_ids is not None:
+            row_ids = _split_errors(row_ids, errors)[0]
+        rows, failed, failed_errors = _split_errors(rows, errors)
+        failed_rows.extend(failed)
+        if failed_errors:
+            log.error("errors: %s", failed_errors)
+        if not rows:
+            return failed_rows
+        if attempt < retries:
+            log.warning(
+                "Retry inserting %i rows into %s (%i)", len(rows), table, attempt + 1
+            )
+            time.sleep(RETRY_DELAY * 2**attempt)
+    log.error("Failed to insert %i rows into %s after retries", len(rows), table)
+    return failed_rows + rows
+
+
+def _split_errors(rows: list, errors: list[dict]) -> tuple[list, list, list]:
+    """
+    :return: rows to retry, rows that cannot be retried and their errors
+    """
+    retry_rows = []
+    failed_rows = []
+    failed = []
+    for error in errors:
+        if "index" not in error:
+            # the error cannot be attributed to a row, treat all rows as failed
+            return [], list(rows), errors
+        reasons = {e.get("reason") for e in error.get("errors", [])}
+        if reasons and reasons <= RETRYABLE_REASONS:
+            retry_rows.append(rows[error["index"]])
+        else:
+            failed_rows.append(rows[error["index"]])
+            failed.append(error)
+    return retry_rows, failed_rows, failed
@@ -0,0 +1,110 @@
+"""
+Registry of the Google Cloud API clients used by phenoback.utils.
+
+Clients are created once per process on first use and shared by all
+callers, so they share their channels and connection pools. Clients can be
+warmed in the background during a cold start, creation times are recorded
+for each client.
+"""
+
+import logging
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+_clients: dict[str, Any] = {}
+_creation_times: dict[str, float] = {}
+_lock = threading.RLock()
+
+
+def _firestore():  # pragma: no cover
+    from firebase_admin import firestore  # pylint: disable=import-outside-toplevel
+
+    return firestore.client()
+
+
+def _bigquery():  # pragma: no cover
+    from google.cloud import bigquery  # pylint: disable=import-outside-toplevel
+
+    return bigquery.Client()
+
+
+def _cloudtasks():
+    from google.cloud import tasks_v2  # pylint: disable=import-outside-toplevel
+
+    return tasks_v2.CloudTasksClient()
+
+
+def _secretmanager():
+    from google.cloud import secretmanager  # pylint: disable=import-outside-toplevel
+
+    return secretmanager.SecretManagerServiceClient()
+
+
+def _subscriber():
+    from google.cloud import pubsub_v1  # pylint: disable=import-outside-toplevel
+
+    return pubsub_v1.SubscriberClient()
+
+
+FACTORIES: dict[str, Callable[[], Any]] = {
+    "firestore": _firestore,
+    "bigquery": _bigquery,
+    "cloudtasks": _cloudtasks,
+    "secretmanager": _secretmanager,
+    "pubsub_subscriber": _subscriber,
+}
+
+
+def get(name: str, factory: Callable[[], Any] | None = None) -> Any:
+    """
+    Get the client registered under the name, creating it on first use.
+    :param factory: creates the client, defaults to the factory registered
+    in FACTORIES. Clients configured by the caller are registered under a
+    name including their configuration.
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                start = time.perf_counter()
+                client = (factory or FACTORIES[name])()
+                _creation_times[name] = time.perf_counter() - start
+                _clients[name] = client
+                log.info("Created %s client in %.3fs", name, _creation_times[name])
+    return client
+
+
+def warm(*names: str) -> threading.Thread:
+    """
+    Create the named clients in a background thread. Callers requesting a
+    client while it is created wait for it.
+    """
+
+    def _warm() -> None:
+        for name in names:
+            try:
+                get(name)
+            except Exception:  # pylint: disable=broad-except
+                log.warning("Warming %s client failed", name, exc_info=True)
+
+    thread = threading.Thread(target=_warm, name="warm-clients", daemon=True)
+    thread.start()
+    return thread
+
+
+def creation_times() -> dict[str, float]:
+    """:return: seconds spent creating each client of this process"""
+    return dict(_creation_times)
+
+
+def reset() -> None:
+    """Drop all clients, they are created again on next use."""
+    with _lock:
+        _clients.clear()
+        _creation_times.clear()
@@ -1,5 +1,5 @@
+import time
 from datetime import date, datetime
-from functools import lru_cache
 from typing import Any
 
 import pytz
@@ -7,8 +7,10 @@ from firebase_admin import auth
 
 from phenoback.utils.firestore import (  # pylint: disable=unused-import
     ArrayUnion,
+    Increment,
     Query,
     Transaction,
+    collection,
     delete_batch,
     delete_document,
     get_count,
@@ -19,21 +21,51 @@ from phenoback.utils.firestore import (  # pylint: disable=unused-import
     write_document,
 )
 
+# Config documents are checked for changes after their TTL by reading their
+# metadata only. Unchanged configs and their lookup tables are kept.
+CONFIG_TTL = {"config_static": 300, "config_dynamic": 30}
+
+# document id -> (config, update time, time of the last check)
+_configs: dict[str, tuple[dict, Any, float]] = {}
+# lookup tables of names derived from config_static
+_names: dict[str, dict] = {}
+
+
+def _get_config(document_id: str) -> dict:
+    now = time.monotonic()
+    cached = _configs.get(document_id)
+    if cached and now - cached[2] < CONFIG_TTL[document_id]:
+        return cached[0]
+    ref = collection("definitions").document(document_id)
+    if cached:
+        metadata = ref.get(field_paths=[])
+        if metadata.exists and metadata.update_time == cached[1]:
+            _configs[document_id] = (cached[0], cached[1], now)
+            return cached[0]
+    snapshot = ref.get()
+    if not snapshot.exists:
+        raise ValueError(f"{document_id} not found")  # pragma: no cover
+    config = snapshot.to_dict()
+    _configs[document_id] = (config, snapshot.update_time, now)
+    if document_id == "config_static":
+        _names.clear()
+    return config
+
 
-@lru_cache
 def _get_static_config() -> dict:
-    config = get_document("definitions", "config_static")
-    if not config:
-        raise ValueError("config_static not found")  # pragma: no cover
-    return config
+    return _get_config("config_static")
 
 
-@lru_cache
 def _get_dynamic_config() -> dict:
-    config = get_document("definitions", "config_dynamic")
-    if not config:
-        raise ValueError("config_dynamic not found")  # pragma: no cover
-    return config
+    return _get_config("config_dynamic")
+
+
+def reset_config_cache(document_id: str | None = None) -> None:
+    """Read the given or all config documents again on next use."""
+    if document_id is None:
+        _configs.clear()
+    else:
+        _configs.pop(document_id, None)
 
 
 def get_phenophase(species: str, phenophase: str) -> dict:
@@ -44,6 +76,35 @@ def get_species(species: str) -> dict:
     return _get_static_config()["species"][species]
 
 
+def _get_names(language: str) -> dict:
+    """
+    Lookup table of species and phenophase names in the language, built
+    once per version of config_static.
+    """
+    species_config = _get_static_config()["species"]
+    if language not in _names:
+        _names[language] = {
+            "species": {
+                species: values.get(language)
+                for species, values in species_config.items()
+            },
+            "phenophases": {
+                (species, phenophase): phenophase_values.get(language)
+                for species, values in species_config.items()
+                for phenophase, phenophase_values in values["phenophases"].items()
+            },
+        }
+    return _names[language]
+
+
+def get_species_name(species: str, language: str = "de") -> str:
+    return _get_names(language)["species"][species]
+
+
+def get_phenophase_name(species: str, phenophase: str, language: str = "de") -> str:
+    return _get_names(language)["phenophases"][(species, phenophase)]
+
+
 def is_actual_observation(comment: str | None) -> bool:
     """Check if the comment indicates an actual observation that should be counted in statistics."""
     return _get_static_config()["comments"].get(comment, {"stats": True})["stats"]
@@ -51,7 +112,7 @@ def is_actual_observation(comment: str | None) -> bool:
 
 def get_phenoyear(reset_cache=False) -> int:
     if reset_cache:
-        _get_dynamic_config.cache_clear()
+        reset_config_cache("config_dynamic")
     return _get_dynamic_config()["phenoyear"]
 
 
@@ -63,7 +124,17 @@ def update_phenoyear(year: int, transaction: Transaction | None = None) -> None:
         merge=True,
         transaction=transaction,
     )
-    _get_dynamic_config.cache_clear()
+    reset_config_cache("config_dynamic")
+
+
+def get_sensors_version() -> int:
+    """Version of the sensor assignments, changed whenever a sensor moves."""
+    return _get_dynamic_config().get("sensors_version", 0)
+
+
+def update_sensors_version() -> None:
+    update_document("definitions", "config_dynamic", {"sensors_version": Increment(1)})
+    reset_config_cache("config_dynamic")
 
 
 def get_individual(
@@ -179,6 +250,14 @@ def get_user_id_by_email(email: str) -> str:  # pragma: no cover
     return auth.get_user_by_email(email).uid
 
 
+def get_token_user_id(id_token: str) -> str | None:
+    """:return: user id of a valid firebase id token, None otherwise"""
+    try:
+        return auth.verify_id_token(id_token)["uid"]
+    except (ValueError, auth.InvalidIdTokenError):
+        return None
+
+
 def follow_user(
     follower_id: str, followee_id: str, transaction: Transaction | None = None
 ) -> bool:
@@ -1,9 +1,10 @@
 import logging
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from time import sleep
 from typing import Any
 
-from firebase_admin import firestore
 from google.cloud.firestore_v1 import DELETE_FIELD as _DELETE_FIELD
 from google.cloud.firestore_v1 import SERVER_TIMESTAMP as _SERVER_TIMESTAMP
 from google.cloud.firestore_v1 import ArrayUnion as _ArrayUnion
@@ -16,8 +17,12 @@ from google.cloud.firestore_v1.client import Client as _Client
 from google.cloud.firestore_v1.collection import (
     CollectionReference as _CollectionReference,
 )
+from google.cloud.firestore_v1.document import DocumentReference as _DocumentReference
+from google.cloud.firestore_v1.document import DocumentSnapshot as _DocumentSnapshot
 from google.cloud.firestore_v1.transaction import Transaction as _Transaction
 
+from phenoback.utils import clients
+
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
@@ -31,6 +36,8 @@ Increment = _Increment
 Query = _Query
 Client = _Client
 CollectionReference = _CollectionReference
+DocumentReference = _DocumentReference
+DocumentSnapshot = _DocumentSnapshot
 Transaction = _Transaction
 transactional = _transactional
 FieldFilter = _FieldFilter
@@ -39,7 +46,7 @@ FieldFilter = _FieldFilter
 def firestore_client() -> Client:
     global _db  # pylint: disable=invalid-name,global-statement
     if not _db:  # pragma: no cover
-        _db = firestore.client()
+        _db = clients.get("firestore")
     return _db
 
 
@@ -54,6 +61,20 @@ def transaction_commit():
     transaction.commit()
 
 
+@contextmanager
+def batch_commit(writebatch: WriteBatch | None = None):
+    """
+    Yield a write batch that is committed on exit. If a batch is given, it is
+    yielded as is and committing is left to the caller.
+    """
+    if writebatch is not None:
+        yield writebatch
+    else:
+        writebatch = firestore_client().batch()
+        yield writebatch
+        writebatch.commit()
+
+
 def delete_document(
     collection: str, document_id: str, transaction: Transaction | None = None
 ) -> None:
@@ -80,6 +101,34 @@ def _delete_batch(coll_ref, batch_size: int = 1000):
         return None
 
 
+def delete_documents(
+    collection: str,
+    document_ids: list[str],
+    commit_size: int = 500,
+    max_workers: int = 4,
+) -> int:
+    """
+    Delete documents by id with batched commits executed concurrently.
+    :return: amount of documents deleted
+    """
+    coll_ref = firestore_client().collection(collection)
+
+    def _commit(chunk: list[str]) -> int:
+        writebatch = firestore_client().batch()
+        for document_id in chunk:
+            writebatch.delete(coll_ref.document(document_id))
+        writebatch.commit()
+        log.debug("Deleted %i documents from %s", len(chunk), collection)
+        return len(chunk)
+
+    chunks = [
+        document_ids[i : i + commit_size]
+        for i in range(0, len(document_ids), commit_size)
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(_commit, chunks))
+
+
 def delete_collection(collection_name: str, batch_size: int = 1000) -> None:
     _delete_batch(collection(collection_name), batch_size)
 
@@ -163,6 +212,29 @@ def write_batch(
     )
 
 
+def update_batch(
+    collection: str, updates: dict[str, dict], commit_size: int = 500
+) -> int:
+    """
+    Update multiple documents with batched commits.
+    :param updates: document id -> data to update
+    :return: amount of documents updated
+    """
+    log.debug("Batch-update %i documents on %s", len(updates), collection)
+    coll_ref = firestore_client().collection(collection)
+    writebatch = firestore_client().batch()
+    cnt = 0
+    for document_id, data in updates.items():
+        writebatch.update(coll_ref.document(document_id), data)
+        cnt += 1
+        if cnt % commit_size == 0:
+            writebatch.commit()
+            writebatch = firestore_client().batch()
+    if cnt % commit_size:
+        writebatch.commit()
+    return cnt
+
+
 def write_document(
     collection: str,
     document_id: str | None,
@@ -236,6 +308,27 @@ def query_collection(
     )
 
 
+def stream_pages(
+    query: Query, page_size: int, start_after: DocumentReference | None = None
+) -> Iterator[list[DocumentSnapshot]]:
+    """
+    Stream query results page by page, using the last document of a page as
+    cursor for the next one. Only one page is held in memory and every page is
+    a separate request, avoiding stream timeouts on long running consumers.
+    The query must be ordered by document id (`__name__`).
+    """
+    while True:
+        page_query = query.limit(page_size)
+        if start_after is not None:
+            page_query = page_query.start_after({"__name__": start_after})
+        page = list(page_query.stream())
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        start_after = page[-1].reference
+
+
 def get_collection_documents(collection_name: str) -> list[dict]:
     return [location.to_dict() for location in collection(collection_name).stream()]
 
@@ -246,3 +339,22 @@ def docs2str(docs):  # pragma: no cover
 
 def get_count(query: Query) -> int:
     return query.count().get()[0][0].value
+
+
+def get_documents(
+    collection: str, document_ids: list[str], chunk_size: int = 500
+) -> dict[str, dict | None]:
+    """
+    Read multiple documents of a collection with batched reads.
+    Documents that do not exist are returned as None.
+    """
+    log.debug("Get %i documents in %s", len(document_ids), collection)
+    coll_ref = firestore_client().collection(collection)
+    result = {}
+    for i in range(0, len(document_ids), chunk_size):
+        refs = [
+            coll_ref.document(doc_id) for doc_id in document_ids[i : i + chunk_size]
+        ]
+        for snapshot in firestore_client().get_all(refs):
+            result[snapshot.id] = snapshot.to_dict()
+    return result
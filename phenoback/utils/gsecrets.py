@@ -1,25 +1,80 @@
 import logging
-from functools import lru_cache
+import os
+import threading
+import time
 
-from google.cloud import secretmanager
-
-from phenoback.utils import gcloud
+from phenoback.utils import clients, gcloud
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Secrets are served from the cache and refreshed in the background once
+# older than SECRET_TTL. Values older than SECRET_MAX_AGE are not served.
+SECRET_TTL = 600
+SECRET_MAX_AGE = 3600
+LATEST = "latest"
+
+# (key, version) -> (value, fetch time)
+_cache: dict[tuple[str, str], tuple[str, float]] = {}
+_refreshing: set[tuple[str, str]] = set()
+_lock = threading.Lock()
+
+
+def get_secret(key: str, version: str | None = None) -> str:
+    """
+    Get a secret from the cache. Expired values are returned while they are
+    refreshed in the background, rotated secrets are picked up without a
+    fetch on the request path.
+    :param version: defaults to the version pinned in the environment as
+    {key}_version, otherwise the latest version. Pinned versions never
+    change and are not refreshed.
+    """
+    version = version or pinned_version(key)
+    cached = _cache.get((key, version))
+    if cached is None:
+        return refresh(key, version)
+    value, fetched = cached
+    age = time.monotonic() - fetched
+    if version == LATEST and age > SECRET_MAX_AGE:
+        return refresh(key, version)
+    if version == LATEST and age > SECRET_TTL:
+        _refresh_async(key, version)
+    return value
+
+
+def pinned_version(key: str) -> str:
+    return os.environ.get(f"{key}_version", LATEST)
 
-@lru_cache
-def get_secret(key: str):
-    log.debug("Access %s", key)
-    client = secretmanager.SecretManagerServiceClient()
-    response = client.access_secret_version(
-        name=f"projects/{gcloud.get_project()}/secrets/{key}/versions/latest"
+
+def refresh(key: str, version: str = LATEST) -> str:
+    """Fetch a secret version and update the cache."""
+    log.debug("Access %s (%s)", key, version)
+    response = clients.get("secretmanager").access_secret_version(
+        name=f"projects/{gcloud.get_project()}/secrets/{key}/versions/{version}"
     )
     payload = response.payload.data.decode("UTF-8")
+    _cache[(key, version)] = (payload, time.monotonic())
     return payload
 
 
+def _refresh_async(key: str, version: str) -> None:
+    with _lock:
+        if (key, version) in _refreshing:
+            return
+        _refreshing.add((key, version))
+
+    def _refresh() -> None:
+        try:
+            refresh(key, version)
+        except Exception:  # pylint: disable=broad-except
+            log.warning("Refreshing secret %s failed", key, exc_info=True)
+        finally:
+            with _lock:
+                _refreshing.discard((key, version))
+
+    threading.Thread(target=_refresh, name=f"refresh-{key}", daemon=True).start()
+
+
 def get_mailer_pw():  # pragma: no cover
     return get_secret("mailer_pw")
 
@@ -33,5 +88,6 @@ def get_tinify_apikey():  # pragma: no cover
 
 
 def reset():
+    """Drop all cached secrets, e.g. after a secret was rejected."""
     log.debug("Reset all secret caches")
-    get_secret.cache_clear()
+    _cache.clear()
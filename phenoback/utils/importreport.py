@@ -0,0 +1,113 @@
+import json
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any
+
+from phenoback.utils import firestore as f
+from phenoback.utils import storage
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+REPORT_PATH = "private/import_reports"
+
+NEW = "new"
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+
+# set by the fs_document_write trigger, never by an import
+IGNORED_FIELDS = {"created", "modified"}
+
+
+class ImportReport:
+    """
+    Collects timings per stage and the writes of an import. In dry-run mode
+    writes are not executed but compared to the current state in Firestore,
+    counting new, changed and unchanged documents per collection.
+    """
+
+    def __init__(self, name: str, dry_run: bool = False) -> None:
+        self.name = name
+        self.dry_run = dry_run
+        self.created = datetime.now(timezone.utc)
+        self.stages: dict[str, float] = {}
+        self.collections: dict[str, dict[str, int]] = {}
+        self.info: dict[str, Any] = {}
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.stages[stage] = self.stages.get(stage, 0) + elapsed
+            log.debug("Stage %s of %s took %.3fs", stage, self.name, elapsed)
+
+    def write_batch(
+        self, collection: str, key: str, documents: list[dict], *, merge: bool = False
+    ) -> None:
+        if self.dry_run:
+            self.diff(collection, key, documents, merge=merge)
+        else:
+            f.write_batch(collection, key, documents, merge=merge)
+
+    def diff(
+        self, collection: str, key: str, documents: list[dict], *, merge: bool = False
+    ) -> None:
+        counts = self.collections.setdefault(
+            collection, {NEW: 0, CHANGED: 0, UNCHANGED: 0}
+        )
+        current = f.get_documents(collection, [str(doc[key]) for doc in documents])
+        for document in documents:
+            data = {k: v for k, v in document.items() if k != key}
+            counts[diff_state(current.get(str(document[key])), data, merge)] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "dry_run": self.dry_run,
+            "created": self.created.isoformat(),
+            "stages": {k: round(v, 3) for k, v in self.stages.items()},
+            "collections": self.collections,
+            "info": self.info,
+        }
+
+    def path(self) -> str:
+        return f"{REPORT_PATH}/{self.name}/{self.created:%Y%m%dT%H%M%S}.json"
+
+    def upload(self, bucket=None) -> str:
+        path = self.path()
+        log.info("Upload import report %s: %s", path, self.to_dict())
+        storage.upload_string(
+            bucket,
+            path,
+            json.dumps(self.to_dict(), indent=2, default=str),
+            content_type="application/json",
+        )
+        return path
+
+
+def diff_state(current: dict | None, data: dict, merge: bool) -> str:
+    if current is None:
+        return NEW
+    if merge:
+        unchanged = _is_merge_unchanged(current, data)
+    else:
+        current = {k: v for k, v in current.items() if k not in IGNORED_FIELDS}
+        unchanged = current == data
+    return UNCHANGED if unchanged else CHANGED
+
+
+def _is_merge_unchanged(current: dict, data: dict) -> bool:
+    return all(_is_value_unchanged(current.get(k), v) for k, v in data.items())
+
+
+def _is_value_unchanged(current: Any, value: Any) -> bool:
+    if isinstance(value, f.ArrayUnion):
+        return isinstance(current, list) and all(v in current for v in value.values)
+    if isinstance(value, dict):
+        return isinstance(current, dict) and _is_merge_unchanged(current, value)
+    return current == value
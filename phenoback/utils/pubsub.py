@@ -1,23 +1,66 @@
 import json
 import logging
+import threading
+import time
+from concurrent.futures import Future
 
 from google.cloud import pubsub_v1
 
-from phenoback.utils import gcloud
+from phenoback.utils import clients, gcloud
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
 class Publisher:
-    def __init__(self, topic: str) -> None:
-        self.client = pubsub_v1.PublisherClient()
+    """
+    Publish messages on a topic. send blocks until the message is published,
+    publish returns immediately and messages are sent in batches according
+    to the batch settings. Pending messages are awaited with flush.
+    """
+
+    def __init__(
+        self,
+        topic: str,
+        max_messages: int = 100,
+        max_bytes: int = 1024 * 1024,
+        max_latency: float = 0.01,
+    ) -> None:
+        # publishers with the same batch settings share their client
+        self.client = clients.get(
+            f"pubsub_publisher_{max_messages}_{max_bytes}_{max_latency}",
+            lambda: pubsub_v1.PublisherClient(
+                batch_settings=pubsub_v1.types.BatchSettings(
+                    max_messages=max_messages,
+                    max_bytes=max_bytes,
+                    max_latency=max_latency,
+                )
+            ),
+        )
         self.topic = topic
         self.project = gcloud.get_project()
         self.topic_path = self.client.topic_path(self.project, self.topic)
+        self._pending: list[Future] = []
+        self._lock = threading.Lock()
+        self.stats = {
+            "published": 0,
+            "failed": 0,
+            "latency_sum": 0.0,
+            "latency_max": 0.0,
+        }
         log.debug("Publisher created for topic %s", self.topic)
 
     def send(self, payload: dict | str, metadata: dict[str, str] | None = None) -> None:
+        msg_id = self.publish(payload, metadata).result()
+        log.debug("Published message on topic %s (%s)", self.topic, msg_id)
+
+    def publish(
+        self, payload: dict | str, metadata: dict[str, str] | None = None
+    ) -> Future:
+        """
+        Publish a message without waiting for the result.
+        :return: future resolving to the message id
+        """
         if metadata is None:
             metadata = {}
         if isinstance(payload, dict):
@@ -25,8 +68,94 @@ class Publisher:
 
         bytes_payload = payload.encode("utf-8")
 
-        msg_id = self.client.publish(
-            self.topic_path, bytes_payload, **metadata
-        ).result()
+        start = time.perf_counter()
+        future = self.client.publish(self.topic_path, bytes_payload, **metadata)
+        future.add_done_callback(lambda f: self._published(f, start))
+        with self._lock:
+            self._pending.append(future)
+        return future
 
-        log.debug("Published message on topic %s (%s)", self.topic, msg_id)
+    def _published(self, future: Future, start: float) -> None:
+        latency = time.perf_counter() - start
+        with self._lock:
+            if future.exception() is None:
+                self.stats["published"] += 1
+                self.stats["latency_sum"] += latency
+                self.stats["latency_max"] = max(self.stats["latency_max"], latency)
+            else:
+                self.stats["failed"] += 1
+
+    def flush(self, timeout: float | None = None) -> int:
+        """
+        Wait for all pending messages to be published.
+        :return: amount of messages that failed to publish
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+        failed = 0
+        for future in pending:
+            try:
+                future.result(timeout=timeout)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Failed to publish message on topic %s", self.topic)
+                failed += 1
+        if pending:
+            published = self.stats["published"]
+            log.debug(
+                "Flushed %i messages on topic %s, latency avg=%.3fs max=%.3fs",
+                len(pending),
+                self.topic,
+                self.stats["latency_sum"] / published if published else 0,
+                self.stats["latency_max"],
+            )
+        return failed
+
+
+class Subscriber:
+    def __init__(self, subscription: str) -> None:
+        self.client = clients.get("pubsub_subscriber")
+        self.subscription = subscription
+        self.project = gcloud.get_project()
+        self.subscription_path = self.client.subscription_path(
+            self.project, self.subscription
+        )
+        log.debug("Subscriber created for subscription %s", self.subscription)
+
+    def pull(self, max_messages: int, timeout: float = 10) -> list:
+        """
+        Synchronously pull up to max_messages from the subscription.
+        :return: received messages, empty if none are available
+        """
+        response = self.client.pull(
+            request={
+                "subscription": self.subscription_path,
+                "max_messages": max_messages,
+            },
+            timeout=timeout,
+        )
+        log.debug(
+            "Pulled %i messages from %s",
+            len(response.received_messages),
+            self.subscription,
+        )
+        return list(response.received_messages)
+
+    def acknowledge(self, ack_ids: list[str]) -> None:
+        if ack_ids:
+            self.client.acknowledge(
+                request={"subscription": self.subscription_path, "ack_ids": ack_ids}
+            )
+            log.debug("Acknowledged %i messages on %s", len(ack_ids), self.subscription)
+
+    def nack(self, ack_ids: list[str]) -> None:
+        """Return messages to the subscription for immediate redelivery."""
+        if ack_ids:
+            self.client.modify_ack_deadline(
+                request={
+                    "subscription": self.subscription_path,
+                    "ack_ids": ack_ids,
+                    "ack_deadline_seconds": 0,
+                }
+            )
+            log.debug("Returned %i messages to %s", len(ack_ids), self.subscription)
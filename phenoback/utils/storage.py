@@ -36,10 +36,12 @@ def upload_string(
     string,
     content_type: str = "text/plain",
     cache_control: str | None = None,
+    content_encoding: str | None = None,
 ) -> None:  # pragma: no cover
     log.debug("Upload file %s of type %s to %s from string", path, content_type, bucket)
     blob = storage.bucket(bucket).blob(path)
     blob.cache_control = cache_control
+    blob.content_encoding = content_encoding
     blob.upload_from_string(string, content_type=content_type)
 
 
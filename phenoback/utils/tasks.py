@@ -2,24 +2,49 @@ import datetime
 import json
 import logging
 import urllib.parse
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from typing import Any
 
+import google.api_core.exceptions
 import google.cloud.tasks_v2.types.task
 from google.cloud import tasks_v2
 from google.protobuf import duration_pb2, timestamp_pb2
 
-from phenoback.utils import gcloud
+from phenoback.utils import clients, gcloud
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+MAX_WORKERS = 8
+
+
+@dataclass
+class TaskRequest:
+    """Arguments of a task sent with send_batch, see HTTPClient.send."""
+
+    payload: dict | str
+    params: dict | None = None
+    task_name: str | None = None
+    at: datetime.datetime | None = None
+    deadline: int | None = None
+    # requests without a result are not sent or already existed
+    result: google.cloud.tasks_v2.types.task.Task | None = field(
+        default=None, repr=False
+    )
+
 
 class HTTPClient:
     def __init__(self, queue: str, url: str) -> None:
         self.queue = queue
-        self.client = tasks_v2.CloudTasksClient()
+        # shared by all clients of the process
+        self.client = clients.get("cloudtasks")
         self.parent = self.client.queue_path(self.project, self.location, self.queue)
         self.url = url
+        self.oidc_token = {
+            "service_account_email": f"gcf-invoker@{self.project}.iam.gserviceaccount.com",
+        }
         log.debug("Client created on sending to %s dispatching to %s", queue, self.url)
 
     @property
@@ -39,13 +64,57 @@ class HTTPClient:
         at: datetime.datetime | None = None,
         deadline: int | None = None,
     ) -> google.cloud.tasks_v2.types.task.Task:
+        response = self.client.create_task(
+            request={
+                "parent": self.parent,
+                "task": self.build_task(payload, params, task_name, at, deadline),
+            }
+        )
+
+        log.debug("Created task on %s (%s)", self.queue, response.name)
+        return response
+
+    def send_batch(
+        self, requests: Iterable[TaskRequest], max_workers: int = MAX_WORKERS
+    ) -> int:
+        """
+        Create many tasks concurrently over the client's channel. Named tasks
+        that already exist are skipped, so repeated batches are de-duplicated.
+        :return: amount of tasks created
+        """
+        requests = list(requests)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            created = sum(executor.map(self._send_request, requests))
+        log.debug("Created %i of %i tasks on %s", created, len(requests), self.queue)
+        return created
+
+    def _send_request(self, request: TaskRequest) -> bool:
+        try:
+            request.result = self.send(
+                request.payload,
+                params=request.params,
+                task_name=request.task_name,
+                at=request.at,
+                deadline=request.deadline,
+            )
+            return True
+        except google.api_core.exceptions.AlreadyExists:
+            log.debug("Task %s already exists on %s", request.task_name, self.queue)
+            return False
+
+    def build_task(
+        self,
+        payload: dict | str,
+        params: dict | None = None,
+        task_name: str | None = None,
+        at: datetime.datetime | None = None,
+        deadline: int | None = None,
+    ) -> dict[str, Any]:
         task: dict[str, Any] = {
             "http_request": {
                 "http_method": tasks_v2.HttpMethod.POST,
                 "url": f"{self.url}{self.encode_params(params)}",
-                "oidc_token": {
-                    "service_account_email": f"gcf-invoker@{self.project}.iam.gserviceaccount.com",
-                },
+                "oidc_token": self.oidc_token,
             }
         }
 
@@ -73,12 +142,7 @@ class HTTPClient:
             duration.FromSeconds(deadline)
             task["dispatch_deadline"] = duration
 
-        response = self.client.create_task(
-            request={"parent": self.parent, "task": task}
-        )
-
-        log.debug("Created task on %s (%s)", self.queue, response.name)
-        return response
+        return task
 
     def encode_params(self, params: dict | None) -> str:
         return "?" + urllib.parse.urlencode(params) if params else ""
@@ -118,3 +182,8 @@ class GCFClient:
         return self.http_client.send(
             payload=payload, task_name=task_name, at=at, deadline=deadline
         )
+
+    def send_batch(
+        self, requests: Iterable[TaskRequest], max_workers: int = MAX_WORKERS
+    ) -> int:
+        return self.http_client.send_batch(requests, max_workers=max_workers)
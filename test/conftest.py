@@ -23,6 +23,20 @@ def clear_emulator_data():
     )
 
 
+@pytest.fixture(autouse=True)
+def reset_clients():
+    from phenoback.utils import clients
+
+    clients.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_config_cache():
+    from phenoback.utils import data
+
+    data.reset_config_cache()
+
+
 @pytest.fixture(autouse=True)
 def mock_main(mocker):
     import firebase_admin
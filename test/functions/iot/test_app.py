@@ -2,6 +2,7 @@
 import datetime
 from test.functions.iot.sample_data import DraginoData as dd
 
+import google.api_core.exceptions
 import pytest
 
 from phenoback.functions.iot import app
@@ -18,6 +19,14 @@ def set_phenoyear():
     f.write_document("definitions", "config_dynamic", {"phenoyear": YEAR})
 
 
+@pytest.fixture(autouse=True)
+def clear_individual_cache():
+    app.invalidate_individual_cache()
+    app._individual_cache_stats.update(  # pylint: disable=protected-access
+        {"hits": 0, "misses": 0}
+    )
+
+
 def add_individual(individual_id, individual, year, deveui=None):
     if deveui:
         data = {
@@ -42,8 +51,8 @@ def remove_sensor_mock(mocker):
 
 
 @pytest.fixture(autouse=True)
-def set_uplink_frequency_mock(mocker):
-    return mocker.patch("phenoback.functions.iot.dragino.set_uplink_frequency")
+def schedule_uplink_frequency_mock(mocker):
+    return mocker.patch("phenoback.functions.iot.dragino.schedule_uplink_frequency")
 
 
 def today() -> str:
@@ -103,6 +112,7 @@ def test_main_individual_updated(
     sensor_set_mock.assert_called_with(
         g.get_document_id(context), "individual", "deveui_new"
     )
+    assert d.get_sensors_version() == 1
 
 
 @pytest.mark.parametrize(
@@ -130,6 +140,7 @@ def test_main_individual_updated__delete(
 
     sensor_set_mock.assert_not_called()
     remove_sensor_mock.assert_called_with(g.get_document_id(context))
+    assert d.get_sensors_version() == 1
 
 
 def test_process_dragino__e2e(mocker):
@@ -164,6 +175,76 @@ def test_get_individual_id__not_found():
     assert app.get_individual_id(2000, "unknown_deveui") is None
 
 
+def test_get_cached_individual_id(mocker):
+    add_individual("id1", "ind1", 2000, deveui="deveui1")
+    lookup_spy = mocker.spy(app, "get_individual_id")
+
+    assert app.get_cached_individual_id(2000, "deveui1") == "id1"
+    assert app.get_cached_individual_id(2000, "deveui1") == "id1"
+    assert app.get_cached_individual_id(2001, "deveui1") is None
+
+    assert lookup_spy.call_count == 2
+    # pylint: disable=protected-access
+    assert app._individual_cache_stats == {"hits": 1, "misses": 2}
+
+
+def test_get_cached_individual_id__expired(mocker):
+    add_individual("id1", "ind1", 2000, deveui="deveui1")
+    lookup_spy = mocker.spy(app, "get_individual_id")
+    monotonic_mock = mocker.patch("time.monotonic", return_value=1000.0)
+
+    app.get_cached_individual_id(2000, "deveui1")
+    monotonic_mock.return_value += app.INDIVIDUAL_CACHE_TTL
+    app.get_cached_individual_id(2000, "deveui1")
+
+    assert lookup_spy.call_count == 2
+
+
+def test_get_cached_individual_id__sensor_moved(mocker):
+    add_individual("id1", "ind1", 2000, deveui="deveui1")
+    lookup_spy = mocker.spy(app, "get_individual_id")
+
+    assert app.get_cached_individual_id(2000, "deveui1") == "id1"
+    app.remove_sensor("id1")
+    add_individual("id2", "ind2", 2000, deveui="deveui1")
+    d.update_sensors_version()  # by main_individual_updated on another instance
+    assert app.get_cached_individual_id(2000, "deveui1") == "id2"
+
+    assert lookup_spy.call_count == 2
+
+
+def test_get_cached_individual_id__not_found_expires_early(mocker):
+    lookup_spy = mocker.spy(app, "get_individual_id")
+    monotonic_mock = mocker.patch("time.monotonic", return_value=1000.0)
+
+    assert app.get_cached_individual_id(2000, "deveui1") is None
+    add_individual("id1", "ind1", 2000, deveui="deveui1")
+    monotonic_mock.return_value += app.INDIVIDUAL_CACHE_NOT_FOUND_TTL
+    assert app.get_cached_individual_id(2000, "deveui1") == "id1"
+
+    assert lookup_spy.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "deveui, individual_id, remaining",
+    [
+        ("deveui1", None, {(2000, "deveui2")}),
+        (None, "id2", {(2000, "deveui1")}),
+        ("deveui1", "id2", set()),
+        (None, None, set()),
+    ],
+)
+def test_invalidate_individual_cache(deveui, individual_id, remaining):
+    add_individual("id1", "ind1", 2000, deveui="deveui1")
+    add_individual("id2", "ind2", 2000, deveui="deveui2")
+    app.get_cached_individual_id(2000, "deveui1")
+    app.get_cached_individual_id(2000, "deveui2")
+
+    app.invalidate_individual_cache(deveui, individual_id)
+
+    assert set(app._individual_cache) == remaining  # pylint: disable=protected-access
+
+
 def test_update(mocker):
     individual_id = "id"
     update_history_mock = mocker.patch("phenoback.functions.iot.app.update_history")
@@ -175,6 +256,30 @@ def test_update(mocker):
 
     update_history_mock.assert_called()
     update_individual_mock.assert_called()
+    assert (
+        update_history_mock.call_args.kwargs["writebatch"]
+        is update_individual_mock.call_args.kwargs["writebatch"]
+    )
+
+
+def test_update__e2e():
+    individual_id = "id"
+    add_individual(individual_id, "individual", YEAR)
+
+    app.update(dd.DECODED_PAYLOAD, YEAR, individual_id)
+
+    assert d.get_individual(individual_id)["sensor"]
+    sensor = f.get_document("sensors", individual_id)
+    assert sensor["year"] == YEAR
+    assert sensor["data"][today()]["n"] == 1
+
+
+def test_update__atomic():
+    """History must not be written if the individual update fails."""
+    with pytest.raises(google.api_core.exceptions.NotFound):
+        app.update(dd.DECODED_PAYLOAD, YEAR, "unknown_individual")
+
+    assert not f.get_document("sensors", "unknown_individual")
 
 
 def test_update_history__new():
@@ -204,6 +309,19 @@ def test_update_history__two():
     assert result.get("n") == 2, result
 
 
+def test_update_history__keeps_other_days():
+    individual_id = "something"
+    f.write_document(
+        "sensors", individual_id, {"year": YEAR, "data": {"2000-01-01": {"n": 5}}}
+    )
+    app.update_history(YEAR, individual_id, 1.0, 1.0, 1.0, 1.0)
+
+    result = f.get_document("sensors", individual_id)["data"]
+
+    assert result["2000-01-01"] == {"n": 5}
+    assert result[today()]["n"] == 1
+
+
 @pytest.mark.parametrize(
     "data",
     [(9999, 0, 0, 0), (0, 0, 9999, 0), (0, 9999, 0, 0), (0, 0, 0, 9999)],
@@ -232,19 +350,19 @@ def test_update_individual():
     assert result["ts"]
 
 
-def test_set_sensor__new(remove_sensor_mock, set_uplink_frequency_mock):
+def test_set_sensor__new(remove_sensor_mock, schedule_uplink_frequency_mock):
     add_individual("id1", "ind1", 2000, deveui="deveui1")
     add_individual("id2", "ind2", 2000)
 
     app.sensor_set("id1", "ind1", "deveui1")
 
     remove_sensor_mock.assert_not_called()
-    set_uplink_frequency_mock.assert_called_with("deveui1", 3600)
+    schedule_uplink_frequency_mock.assert_called_with("deveui1")
 
 
 def test_set_sensor__switch_individual(
     remove_sensor_mock,
-    set_uplink_frequency_mock,
+    schedule_uplink_frequency_mock,
 ):
     add_individual("id1", "ind1", 2000, deveui="deveui1")
     add_individual("id2", "ind2", 2000, deveui="deveui1")
@@ -252,12 +370,12 @@ def test_set_sensor__switch_individual(
     app.sensor_set("id2", "ind2", "deveui1")
 
     remove_sensor_mock.assert_called_with("id1")
-    set_uplink_frequency_mock.assert_called_with("deveui1", 3600)
+    schedule_uplink_frequency_mock.assert_called_with("deveui1")
 
 
 def test_set_sensor__switch_year(
     remove_sensor_mock,
-    set_uplink_frequency_mock,
+    schedule_uplink_frequency_mock,
 ):
     add_individual("id1", "ind1", 1999, deveui="deveui1")
     add_individual("id2", "ind1", 2000, deveui="deveui1")
@@ -265,7 +383,21 @@ def test_set_sensor__switch_year(
     app.sensor_set("id2", "ind2", "deveui1")
 
     remove_sensor_mock.assert_called_with("id1")
-    set_uplink_frequency_mock.assert_called_with("deveui1", 3600)
+    schedule_uplink_frequency_mock.assert_called_with("deveui1")
+
+
+def test_main_uplink_schedule(mocker):
+    schedule_mock = mocker.patch(
+        "phenoback.functions.iot.dragino.schedule_uplink_frequencies"
+    )
+    add_individual("id1", "ind1", 2000, deveui="deveui1")
+    add_individual("id2", "ind2", 2000, deveui="deveui2")
+    add_individual("id3", "ind3", 2000)
+    add_individual("id4", "ind4", 1999, deveui="deveui4")
+
+    app.main_uplink_schedule(None, None)
+
+    schedule_mock.assert_called_once_with(["deveui1", "deveui2"])
 
 
 def test_remove_sensor():
@@ -292,6 +424,16 @@ def test_clear_sensors():
 
     assert result == 2
     assert not d.get_individual(individual_id)["sensor"]  # present but empty
+    assert "deveui" not in d.get_individual(individual_id)
+    assert d.get_individual("id3")["sensor"]  # other year untouched
+    assert d.get_individual("id3")["deveui"] == "some_deveui"
+
+
+def test_clear_sensors__no_sensors():
+    add_individual("id1", "individual", 2000)
+
+    assert app.clear_sensors(YEAR) == 0
+    assert d.get_individual("id1") == {"year": 2000, "individual": "individual"}
 
 
 @pytest.mark.parametrize(
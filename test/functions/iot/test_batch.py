@@ -0,0 +1,266 @@
+# pylint: disable=unused-argument
+import datetime
+import json
+from test.functions.iot.sample_data import DraginoData as dd
+
+import pytest
+
+from phenoback.functions.iot import app, batch
+from phenoback.utils import data as d
+from phenoback.utils import firestore as f
+
+YEAR = 2000
+TIME = "2000-06-01T10:00:00.000+02:00"
+INVALID_PAYLOAD_HEX = "ffff034001f30800fc01b821"
+
+
+@pytest.fixture(autouse=True)
+def set_phenoyear():
+    f.write_document("definitions", "config_dynamic", {"phenoyear": YEAR})
+
+
+@pytest.fixture(autouse=True)
+def clear_individual_cache():
+    app.invalidate_individual_cache()
+
+
+@pytest.fixture(autouse=True)
+def insert_data_mock(mocker):
+    return mocker.patch("phenoback.utils.bq.insert_data")
+
+
+@pytest.fixture
+def subscriber_mock(mocker):
+    return mocker.patch("phenoback.functions.iot.batch.subscriber").return_value
+
+
+@pytest.fixture
+def process_uplinks_mock(mocker):
+    return mocker.patch("phenoback.functions.iot.batch.process_uplinks")
+
+
+def uplink(deveui: str, time: str = TIME, payload: str = dd.PAYLOAD_HEX) -> dict:
+    return {
+        "DevEUI_uplink": {
+            "DevEUI": deveui,
+            "Time": time,
+            "payload_hex": payload,
+        }
+    }
+
+
+def message(mocker, ack_id: str, data: bytes):
+    return mocker.Mock(ack_id=ack_id, message=mocker.Mock(data=data))
+
+
+def add_individual(individual_id: str, deveui: str):
+    d.write_individual(
+        individual_id, {"year": YEAR, "individual": individual_id, "deveui": deveui}
+    )
+
+
+def test_main(mocker):
+    drain_mock = mocker.patch("phenoback.functions.iot.batch.drain", return_value=3)
+
+    response = batch.main(mocker.Mock())
+
+    drain_mock.assert_called_once()
+    assert response.status_code == 200
+
+
+def test_drain(mocker, subscriber_mock, process_uplinks_mock):
+    subscriber_mock.pull.side_effect = [
+        [
+            message(mocker, "ack1", json.dumps(uplink("deveui1")).encode()),
+            message(mocker, "ack2", json.dumps(uplink("deveui2")).encode()),
+        ],
+        [message(mocker, "ack3", json.dumps(uplink("deveui3")).encode())],
+        [],
+    ]
+
+    assert batch.drain() == 3
+
+    assert process_uplinks_mock.call_count == 2
+    assert process_uplinks_mock.call_args_list[0].args[0] == [
+        uplink("deveui1"),
+        uplink("deveui2"),
+    ]
+    assert [c.args[0] for c in subscriber_mock.acknowledge.call_args_list] == [
+        ["ack1", "ack2"],
+        ["ack3"],
+    ]
+
+
+def test_drain__invalid_message(
+    mocker, subscriber_mock, process_uplinks_mock, caperrors
+):
+    subscriber_mock.pull.side_effect = [[message(mocker, "ack1", b"invalid")], []]
+
+    assert batch.drain() == 1
+
+    process_uplinks_mock.assert_called_once_with([])
+    subscriber_mock.acknowledge.assert_called_once_with(["ack1"])
+    assert len(caperrors.records) == 1
+
+
+def test_drain__time_budget(subscriber_mock, process_uplinks_mock):
+    assert batch.drain(time_budget=0) == 0
+
+    subscriber_mock.pull.assert_not_called()
+
+
+def test_drain__time_budget_within_pull(mocker, subscriber_mock, process_uplinks_mock):
+    mocker.patch("phenoback.functions.iot.batch.PROCESS_MESSAGES", 2)
+    mocker.patch("time.perf_counter", side_effect=[0, 0, 0, 1, 1, 1])
+    subscriber_mock.pull.return_value = [
+        message(mocker, f"ack{i}", json.dumps(uplink(f"deveui{i}")).encode())
+        for i in range(4)
+    ]
+
+    assert batch.drain(time_budget=1) == 2
+
+    subscriber_mock.pull.assert_called_once()
+    subscriber_mock.acknowledge.assert_called_once_with(["ack0", "ack1"])
+    subscriber_mock.nack.assert_called_once_with(["ack2", "ack3"])
+
+
+@pytest.mark.parametrize(
+    "project, expected",
+    [("phaenonet", True), ("phaenonet-test", False)],
+)
+def test_process_messages__permarobotics(
+    mocker, subscriber_mock, process_uplinks_mock, project, expected
+):
+    mocker.patch("phenoback.utils.gcloud.get_project", return_value=project)
+    forward_mock = mocker.patch("phenoback.functions.iot.permarobotics.forward_batch")
+    manager = mocker.Mock()
+    manager.attach_mock(subscriber_mock.acknowledge, "acknowledge")
+    manager.attach_mock(forward_mock, "forward_batch")
+
+    batch.process_messages([message(mocker, "ack1", b"{}")])
+
+    assert forward_mock.called == expected
+    if expected:
+        # forwarded after acknowledging
+        assert [c[0] for c in manager.mock_calls] == ["acknowledge", "forward_batch"]
+        forward_mock.assert_called_once_with(process_uplinks_mock.return_value)
+
+
+def test_process_uplinks(insert_data_mock):
+    add_individual("id1", "deveui1")
+    add_individual("id2", "deveui2")
+    uplinks = [
+        uplink("deveui1", "2000-06-01T10:00:00.000+02:00"),
+        uplink("deveui1", "2000-06-01T12:00:00.000+02:00"),
+        uplink("deveui1", "2000-06-02T10:00:00.000+02:00"),
+        uplink("deveui2"),
+    ]
+
+    assert batch.process_uplinks(uplinks) == uplinks
+
+    history = f.get_document("sensors", "id1")
+    assert history["year"] == YEAR
+    assert history["data"]["2000-06-01"]["n"] == 2
+    assert history["data"]["2000-06-01"]["ahs"] == pytest.approx(
+        2 * dd.DECODED_PAYLOAD["airHumidity"]["value"]
+    )
+    assert history["data"]["2000-06-02"]["n"] == 1
+    assert f.get_document("sensors", "id2")["data"]["2000-06-01"]["n"] == 1
+    sensor = d.get_individual("id1")["sensor"]
+    assert sensor["at"] == dd.DECODED_PAYLOAD["airTemperature"]["value"]
+    assert sensor["ts"]
+    insert_data_mock.assert_called_once_with(batch.BQ_TABLE, uplinks)
+
+
+def test_process_uplinks__increments_existing():
+    add_individual("id1", "deveui1")
+    batch.process_uplinks([uplink("deveui1")])
+    batch.process_uplinks([uplink("deveui1"), uplink("deveui1")])
+
+    assert f.get_document("sensors", "id1")["data"]["2000-06-01"]["n"] == 3
+
+
+def test_process_uplinks__latest_sensor_value():
+    add_individual("id1", "deveui1")
+    batch.process_uplinks(
+        [
+            uplink("deveui1", "2000-06-01T12:00:00.000+02:00"),
+            uplink("deveui1", "2000-06-01T10:00:00.000+02:00", INVALID_PAYLOAD_HEX),
+        ]
+    )
+
+    assert d.get_individual("id1")["sensor"]["sh"] == pytest.approx(
+        dd.DECODED_PAYLOAD["soilHumidity"]["value"]
+    )
+
+
+def test_process_uplinks__invalid_values(caperrors):
+    add_individual("id1", "deveui1")
+
+    assert batch.process_uplinks([uplink("deveui1", payload=INVALID_PAYLOAD_HEX)])
+
+    assert not f.get_document("sensors", "id1")
+    assert d.get_individual("id1")["sensor"]
+    assert len(caperrors.records) == 1
+
+
+def test_process_uplinks__unknown_individual(insert_data_mock, capwarnings):
+    assert batch.process_uplinks([uplink("deveui1")]) == [uplink("deveui1")]
+
+    assert not f.get_document("sensors", "id1")
+    insert_data_mock.assert_called_once()
+    assert len(capwarnings.records) == 1
+
+
+def test_process_uplinks__undecodable(insert_data_mock, caperrors):
+    assert not batch.process_uplinks([{"foo": "bar"}])
+
+    insert_data_mock.assert_not_called()
+    assert len(caperrors.records) == 1
+
+
+@pytest.mark.parametrize(
+    "uplink_time, expected",
+    [
+        ("2000-06-01T23:30:00.000+00:00", "2000-06-02"),
+        ("2000-06-01T10:00:00.000+02:00", "2000-06-01"),
+        ("invalid", str(datetime.date.today())),
+        (None, str(datetime.date.today())),
+    ],
+)
+def test_uplink_date(uplink_time, expected):
+    assert batch.uplink_date(uplink_time) == expected
+
+
+def test_write_sensor_data__chunks(mocker):
+    mocker.patch("phenoback.functions.iot.batch.COMMIT_INDIVIDUALS", 2)
+    write_chunk_spy = mocker.spy(batch, "_write_chunk")
+    values = (1.0, 2.0, 3.0, 4.0)
+    for i in range(5):
+        add_individual(f"id{i}", f"deveui{i}")
+
+    batch.write_sensor_data(
+        YEAR,
+        {f"id{i}": {"2000-06-01": {"n": 1}} for i in range(5)},
+        {f"id{i}": values for i in range(5)},
+    )
+
+    assert write_chunk_spy.call_count == 3
+    for i in range(5):
+        assert f.get_document("sensors", f"id{i}")["data"]["2000-06-01"]["n"] == 1
+        assert d.get_individual(f"id{i}")["sensor"]["ah"] == 3.0
+
+
+def test_write_sensor_data__deleted_individual(capwarnings):
+    values = (1.0, 2.0, 3.0, 4.0)
+    add_individual("id1", "deveui1")
+
+    batch.write_sensor_data(
+        YEAR,
+        {"id1": {"2000-06-01": {"n": 1}}, "deleted": {"2000-06-01": {"n": 1}}},
+        {"id1": values, "deleted": values},
+    )
+
+    assert f.get_document("sensors", "id1")["data"]["2000-06-01"]["n"] == 1
+    assert not f.get_document("sensors", "deleted")
+    assert len(capwarnings.records) == 1
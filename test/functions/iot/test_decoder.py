@@ -1,6 +1,14 @@
+import struct
+
 import pytest
 
-from phenoback.functions.iot.decoder import Decoder
+from phenoback.functions.iot.decoder import (
+    Decoder,
+    DecoderRegistry,
+    Field,
+    Layout,
+    LayoutDecoder,
+)
 
 UPLINK_KEY = "DevEUI_uplink"
 PAYLOAD_HEX_KEY = "payload_hex"
@@ -81,3 +89,130 @@ def test_is_uplink(data, expected):
 def test_get_value(payload_hex, start, length, signed, expected):
     decoder = DecoderImpl({UPLINK_KEY: {PAYLOAD_HEX_KEY: payload_hex}})
     assert decoder.get_value(start, length, signed=signed) == expected
+
+
+def test_unpack():
+    decoder = DecoderImpl({UPLINK_KEY: {PAYLOAD_HEX_KEY: "0102FF"}})
+    assert decoder.unpack(struct.Struct(">Hb")) == (258, -1)
+    assert decoder.unpack(struct.Struct(">B"), 1) == (2,)
+
+
+def test_slots():
+    with pytest.raises(AttributeError):
+        # pylint: disable-next=assigning-non-slot
+        Decoder(SAMPLE_DATA).result = {}  # type: ignore
+
+
+def test_decode_batch():
+    data = [SAMPLE_DATA, {}, {UPLINK_KEY: {PAYLOAD_HEX_KEY: "invalid"}}]
+
+    decoders = DecoderImpl.decode_batch(data)
+
+    assert len(decoders) == 3
+    assert decoders[0] is not None
+    assert decoders[0].decoded_payload == DECODED_PAYLOAD
+    assert decoders[1] is None
+    assert decoders[2] is None
+
+
+class OtherDecoderImpl(Decoder):
+    def decode_impl(self):
+        return "other"
+
+
+def uplink(deveui: str = "A840", fport: int | str | None = None, profile=None):
+    data: dict = {DEVEUI: deveui, PAYLOAD_HEX_KEY: PAYLOAD_HEX}
+    if fport is not None:
+        data["FPort"] = fport
+    if profile:
+        data["CustomerData"] = {"alr": {"pro": profile}}
+    return {UPLINK_KEY: data}
+
+
+def test_layout():
+    layout = Layout(
+        [
+            Field("b", 3, "h", "°C", scale=0.1, add=-1, precision=1),
+            Field("a", 0, "H", "%", scale=1 / 60),
+        ]
+    )
+
+    assert layout.struct.format == ">H1xh"
+    assert layout.decode(bytes.fromhex("0e10ff00c8")) == {
+        "a": {"value": 60.0, "unit": "%"},
+        "b": {"value": 19.0, "unit": "°C"},
+    }
+
+
+def test_layout__too_short():
+    layout = Layout([Field("a", 0, "H", "%")])
+    with pytest.raises(ValueError):
+        layout.decode(b"\x01")
+
+
+def test_layout__overlapping():
+    with pytest.raises(ValueError):
+        Layout([Field("a", 0, "H", "%"), Field("b", 1, "B", "%")])
+
+
+def test_layout_decoder():
+    class LayoutDecoderImpl(LayoutDecoder):
+        LAYOUT = Layout([Field("a", 1, "B", "V", precision=0)])
+
+    decoder = LayoutDecoderImpl(SAMPLE_DATA)
+    decoder.decode()
+
+    assert decoder.decoded_payload == {"a": {"value": 0xAA, "unit": "V"}}
+
+
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        (uplink("B000"), DecoderImpl),
+        (uplink("A840"), OtherDecoderImpl),
+        (uplink("a8400001"), OtherDecoderImpl),
+        (uplink("A840", fport=2), DecoderImpl),
+        (uplink("A840", fport="2"), DecoderImpl),
+        (uplink("A841", fport=2), OtherDecoderImpl),
+        (uplink("B000", profile="DRAGINO/OTHER"), OtherDecoderImpl),
+        ({}, DecoderImpl),
+    ],
+)
+def test_registry(data, expected):
+    registry = DecoderRegistry(default=DecoderImpl)
+    registry.register(OtherDecoderImpl, deveui_prefix="A8")
+    registry.register(DecoderImpl, deveui_prefix="A840", fport=2)
+    registry.register(OtherDecoderImpl, profile="DRAGINO/OTHER")
+
+    assert registry.get(data) == expected
+    assert isinstance(registry.decoder(data), expected)
+
+
+def test_registry__no_default():
+    registry = DecoderRegistry()
+    registry.register(DecoderImpl, deveui_prefix="A8")
+
+    assert registry.get(uplink("A840")) == DecoderImpl
+    with pytest.raises(ValueError):
+        registry.get(uplink("B000"))
+
+
+def test_registry__register_clears_cache():
+    registry = DecoderRegistry(default=DecoderImpl)
+    assert registry.get(uplink("A840")) == DecoderImpl
+
+    registry.register(OtherDecoderImpl, deveui_prefix="A840")
+
+    assert registry.get(uplink("A840")) == OtherDecoderImpl
+
+
+def test_registry__decode_batch():
+    registry = DecoderRegistry()
+    registry.register(DecoderImpl, deveui_prefix="A8")
+    registry.register(OtherDecoderImpl, deveui_prefix="B0")
+
+    decoders = registry.decode_batch([uplink("A840"), uplink("C000"), uplink("B000")])
+
+    assert decoders[0].decoded_payload == DECODED_PAYLOAD
+    assert decoders[1] is None
+    assert decoders[2].decoded_payload == "other"
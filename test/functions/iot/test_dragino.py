@@ -1,7 +1,8 @@
-from datetime import datetime
+from datetime import date, datetime
 from test.functions.iot.sample_data import DraginoData as dd
 from unittest.mock import ANY
 
+import google.api_core.exceptions
 import pytest
 from flask import Request
 from werkzeug.test import EnvironBuilder
@@ -19,7 +20,12 @@ def task_client(mocker):
     return mocker.patch("phenoback.functions.iot.dragino.task_client").return_value
 
 
-def test_main(mocker):
+@pytest.fixture(autouse=True)
+def clear_uplink_frequencies():
+    dragino._uplink_frequencies.clear()  # pylint: disable=protected-access
+
+
+def test_main(mocker, ps_client):
     process_mock = mocker.patch("phenoback.functions.iot.dragino.process_dragino")
     payload = {"foo": "bar"}
     request = Request(
@@ -32,19 +38,32 @@ def test_main(mocker):
 
     assert result.status_code == 200
     process_mock.assert_called_with(payload)
+    ps_client.flush.assert_called_once()
+
+
+def test_main__flush_on_error(mocker, ps_client):
+    mocker.patch(
+        "phenoback.functions.iot.dragino.process_dragino", side_effect=ValueError
+    )
+    request = Request(EnvironBuilder(method="POST", json={"foo": "bar"}).get_environ())
+
+    with pytest.raises(ValueError):
+        dragino.main(request)
+
+    ps_client.flush.assert_called_once()
 
 
 def test_process(ps_client):
     dragino.process_dragino(dd.SAMPLE_DATA)
     dd.SAMPLE_DATA[dd.UPLINK_KEY][dd.DECODED_PAYLOAD_KEY] = dd.DECODED_PAYLOAD
 
-    ps_client.send.assert_called_with(dd.SAMPLE_DATA, ANY)
+    ps_client.publish.assert_called_with(dd.SAMPLE_DATA, ANY)
 
 
 def test_process__no_uplink(ps_client):
     dragino.process_dragino({})
 
-    ps_client.send.assert_not_called()
+    ps_client.publish.assert_not_called()
 
 
 def test_decode_impl():
@@ -53,6 +72,63 @@ def test_decode_impl():
     assert decoder.decoded_payload == dd.DECODED_PAYLOAD
 
 
+def test_decode_impl__independent_results():
+    data1 = {dd.UPLINK_KEY: {dd.PAYLOAD_HEX_KEY: dd.PAYLOAD_HEX}}
+    data2 = {dd.UPLINK_KEY: {dd.PAYLOAD_HEX_KEY: "000000000000000000000000"}}
+    decoder1 = dragino.DraginoDecoder(data1)
+    decoder2 = dragino.DraginoDecoder(data2)
+
+    decoder1.decode()
+    decoder2.decode()
+
+    assert decoder1.decoded_payload == dd.DECODED_PAYLOAD
+    assert decoder2.decoded_payload["airTemperature"]["value"] == 0
+
+
+def test_decode_impl__too_short():
+    decoder = dragino.DraginoDecoder({dd.UPLINK_KEY: {dd.PAYLOAD_HEX_KEY: "01b4"}})
+    with pytest.raises(ValueError):
+        decoder.decode()
+
+
+@pytest.mark.parametrize(
+    "payload, expected",
+    [
+        (
+            "01b4034001f30800fc01b821",
+            [7.27, 33.2, 44.0, 25.2, 3.3],
+        ),
+        (
+            "000000000000000000000000",
+            [0.0, -50.0, 0.0, 0.0, 0.0],
+        ),
+        (
+            "0fa000c8000000ff9c02ee1e",
+            [66.67, -30.0, 75.0, -10.0, 3.0],
+        ),
+        (
+            "ffffffffffffffffffffffff",
+            [1092.25, 6503.5, 6553.5, -0.1, 25.5],
+        ),
+    ],
+)
+def test_decode_batch__values(payload, expected):
+    decoders = dragino.DraginoDecoder.decode_batch(
+        [{dd.UPLINK_KEY: {dd.PAYLOAD_HEX_KEY: payload}}]
+    )
+
+    assert [
+        decoders[0].decoded_payload[key]["value"]
+        for key in [
+            "soilHumidity",
+            "soilTemperature",
+            "airHumidity",
+            "airTemperature",
+            "batteryVoltage",
+        ]
+    ] == expected
+
+
 def test_set_uplink_frequency(task_client):
     at = datetime(2020, 1, 1)
     dragino.set_uplink_frequency(dd.DEVEUI, 60, at)
@@ -64,5 +140,80 @@ def test_set_uplink_frequency(task_client):
             "Payload": "0100003c",
             "FPort": 1,
         },
+        task_name=None,
         at=at,
     )
+
+
+def test_set_uplink_frequency__already_exists(task_client):
+    task_client.send.side_effect = google.api_core.exceptions.AlreadyExists("exists")
+
+    assert not dragino.set_uplink_frequency(dd.DEVEUI, 60, task_name="name")
+
+
+@pytest.mark.parametrize(
+    "day, expected",
+    [
+        (date(2020, 1, 15), 14400),
+        (date(2020, 2, 29), 14400),
+        (date(2020, 3, 1), 3600),
+        (date(2020, 10, 31), 3600),
+        (date(2020, 11, 1), 14400),
+        (date(2020, 12, 31), 14400),
+    ],
+)
+def test_seasonal_interval(day, expected):
+    assert dragino.seasonal_interval(day) == expected
+
+
+def test_schedule_uplink_frequency(task_client):
+    assert dragino.schedule_uplink_frequency(dd.DEVEUI, date(2020, 6, 1))
+
+    task_client.send.assert_called_once()
+    assert task_client.send.call_args.kwargs["params"]["Payload"] == "01000e10"
+    assert (
+        task_client.send.call_args.kwargs["task_name"]
+        == f"uplink-{dd.DEVEUI}-3600-2020-06-01"
+    )
+
+
+def test_schedule_uplink_frequency__coalesced(task_client):
+    assert dragino.schedule_uplink_frequency(dd.DEVEUI, date(2020, 6, 1))
+    assert not dragino.schedule_uplink_frequency(dd.DEVEUI, date(2020, 6, 1))
+    assert dragino.schedule_uplink_frequency("other", date(2020, 6, 1))
+    assert dragino.schedule_uplink_frequency(dd.DEVEUI, date(2020, 11, 1))
+
+    assert task_client.send.call_count == 3
+
+
+def test_schedule_uplink_frequency__other_instance(task_client):
+    task_client.send.side_effect = google.api_core.exceptions.AlreadyExists("exists")
+
+    assert not dragino.schedule_uplink_frequency(dd.DEVEUI, date(2020, 6, 1))
+    assert not dragino.schedule_uplink_frequency(dd.DEVEUI, date(2020, 6, 1))
+
+    task_client.send.assert_called_once()
+
+
+def test_schedule_uplink_frequencies(task_client):
+    sent = []
+
+    def send_batch(requests):
+        sent.extend(requests)
+        return len(sent)
+
+    task_client.send_batch.side_effect = send_batch
+    dragino.schedule_uplink_frequency("deveui1", date(2020, 6, 1))
+
+    assert (
+        dragino.schedule_uplink_frequencies(
+            ["deveui1", "deveui2", "deveui3"], date(2020, 6, 1)
+        )
+        == 2
+    )
+    assert [request.task_name for request in sent] == [
+        "uplink-deveui2-3600-2020-06-01",
+        "uplink-deveui3-3600-2020-06-01",
+    ]
+    assert sent[0].params == dragino.downlink_params("deveui2", 3600)
+    assert not dragino.schedule_uplink_frequency("deveui2", date(2020, 6, 1))
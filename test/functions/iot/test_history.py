@@ -0,0 +1,292 @@
+import json
+
+import pytest
+from flask import Request
+from werkzeug.test import EnvironBuilder
+
+from phenoback.functions.iot import history
+from phenoback.utils import firestore as f
+
+YEAR = 2000
+CUTOFF = "2000-05-10"
+
+
+def day_sums(value: float, n: int = 1) -> dict:
+    return {"shs": value, "sts": value, "ahs": value, "ats": value, "n": n}
+
+
+@pytest.fixture
+def insert_data_mock(mocker):
+    return mocker.patch("phenoback.utils.bq.insert_data", return_value=[])
+
+
+@pytest.fixture
+def compact_mock(mocker):
+    return mocker.patch("phenoback.functions.iot.history.compact")
+
+
+@pytest.fixture(autouse=True)
+def token_mock(mocker):
+    return mocker.patch(
+        "phenoback.utils.data.get_token_user_id", return_value="user_id"
+    )
+
+
+def request(method: str = "GET", bearer: str | None = "token", **args) -> Request:
+    headers = {"Authorization": f"Bearer {bearer}"} if bearer else {}
+    return Request(
+        EnvironBuilder(method=method, query_string=args, headers=headers).get_environ()
+    )
+
+
+def test_main__year(compact_mock):
+    history.main({"year": 2010}, None)
+
+    compact_mock.assert_called_once_with(2010)
+
+
+def test_main__phenoyear(compact_mock, phenoyear):
+    history.main(None, None)
+
+    assert [c.args for c in compact_mock.call_args_list] == [
+        (phenoyear - 1,),
+        (phenoyear,),
+    ]
+
+
+def test_main_read(mocker):
+    get_history_mock = mocker.patch(
+        "phenoback.functions.iot.history.get_history", return_value={"foo": "bar"}
+    )
+
+    response = history.main_read(
+        request(individual_id="id", **{"from": "2000-01-01", "to": "2000-12-31"})
+    )
+
+    assert response.status_code == 200
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    assert json.loads(response.data) == {
+        "resolution": history.MONTH,
+        "data": {"foo": "bar"},
+    }
+    get_history_mock.assert_called_once()
+
+
+def test_main_read__options():
+    response = history.main_read(request("OPTIONS", bearer=None))
+
+    assert response.status_code == 204
+    assert response.headers["Access-Control-Allow-Headers"] == "Authorization"
+
+
+def test_main_read__no_token(token_mock, capwarnings):
+    response = history.main_read(request(bearer=None, individual_id="id"))
+
+    assert response.status_code == 401
+    token_mock.assert_not_called()
+    assert len(capwarnings.records) == 1
+
+
+def test_main_read__invalid_token(token_mock, capwarnings):
+    token_mock.return_value = None
+
+    response = history.main_read(request(individual_id="id"))
+
+    assert response.status_code == 401
+    token_mock.assert_called_once_with("token")
+    assert len(capwarnings.records) == 1
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        {"from": "2000-01-01", "to": "2000-12-31"},
+        {"individual_id": "id", "from": "2000-01-01"},
+        {"individual_id": "id", "from": "invalid", "to": "2000-12-31"},
+        {
+            "individual_id": "id",
+            "from": "2000-01-01",
+            "to": "2000-12-31",
+            "resolution": "year",
+        },
+    ],
+)
+def test_main_read__invalid(args, capwarnings):
+    response = history.main_read(request(**args))
+
+    assert response.status_code == 400
+    assert len(capwarnings.records) == 1
+
+
+@pytest.mark.parametrize(
+    "day, resolution, expected",
+    [
+        ("2000-05-10", history.DAY, "2000-05-10"),
+        ("2000-05-10", history.WEEK, "2000-W19"),
+        ("2000-01-01", history.WEEK, "1999-W52"),
+        ("2000-05-10", history.MONTH, "2000-05"),
+    ],
+)
+def test_period(day, resolution, expected):
+    assert history.period(day, resolution) == expected
+
+
+def test_period__unknown():
+    with pytest.raises(ValueError):
+        history.period("2000-05-10", "year")
+
+
+def test_summarize():
+    days = {
+        "2000-04-30": day_sums(1.0),
+        "2000-05-01": day_sums(2.0, 2),
+        "2000-05-08": {"n": 1},
+    }
+
+    assert history.summarize(days, history.MONTH) == {
+        "2000-04": day_sums(1.0),
+        "2000-05": {"shs": 2.0, "sts": 2.0, "ahs": 2.0, "ats": 2.0, "n": 3},
+    }
+    assert set(history.summarize(days, history.WEEK)) == {
+        "2000-W17",
+        "2000-W18",
+        "2000-W19",
+    }
+
+
+def test_compact_document():
+    document = {
+        "year": YEAR,
+        "data": {"2000-05-08": day_sums(1.0), "2000-05-10": day_sums(2.0)},
+    }
+
+    rows, update = history.compact_document("id", document, CUTOFF)
+
+    assert rows == [
+        {"individual_id": "id", "year": YEAR, "date": "2000-05-08"} | day_sums(1.0)
+    ]
+    assert update["data.2000-05-08"] == f.DELETE_FIELD
+    assert "data.2000-05-10" not in update
+    assert update["weeks.2000-W19.n"].value == 1
+    assert update["months.2000-05.shs"].value == 1.0
+
+
+def test_compact(insert_data_mock):
+    f.write_document(
+        "sensors",
+        "id1",
+        {
+            "year": YEAR,
+            "data": {
+                "2000-05-01": day_sums(1.0),
+                "2000-05-02": day_sums(2.0),
+                "2000-05-10": day_sums(3.0),
+            },
+            "months": {"2000-04": day_sums(10.0), "2000-05": day_sums(5.0)},
+        },
+    )
+    f.write_document(
+        "sensors", "id2", {"year": YEAR, "data": {"2000-05-10": day_sums(1.0)}}
+    )
+    f.write_document(
+        "sensors", "id3", {"year": YEAR - 1, "data": {"1999-05-01": day_sums(1.0)}}
+    )
+
+    assert history.compact(YEAR, CUTOFF) == 2
+
+    insert_data_mock.assert_called_once()
+    assert insert_data_mock.call_args.kwargs["row_ids"] == [
+        "id1_2000-05-01",
+        "id1_2000-05-02",
+    ]
+    document = f.get_document("sensors", "id1")
+    assert document["data"] == {"2000-05-10": day_sums(3.0)}
+    assert document["weeks"] == {"2000-W18": day_sums(3.0, 2)}
+    assert document["months"] == {
+        "2000-04": day_sums(10.0),
+        "2000-05": day_sums(8.0, 3),
+    }
+    assert f.get_document("sensors", "id3")["data"]  # other year untouched
+
+    assert history.compact(YEAR, CUTOFF) == 0
+
+
+def test_compact__insert_failed(insert_data_mock, caperrors):
+    f.write_document(
+        "sensors",
+        "id1",
+        {
+            "year": YEAR,
+            "data": {"2000-05-01": day_sums(1.0), "2000-05-02": day_sums(2.0)},
+        },
+    )
+    f.write_document(
+        "sensors", "id2", {"year": YEAR, "data": {"2000-05-01": day_sums(4.0)}}
+    )
+    insert_data_mock.side_effect = lambda table, rows, row_ids: [
+        row for row in rows if row["date"] == "2000-05-02"
+    ]
+
+    assert history.compact(YEAR, CUTOFF) == 2
+
+    document = f.get_document("sensors", "id1")
+    assert document["data"] == {"2000-05-02": day_sums(2.0)}
+    assert document["months"] == {"2000-05": day_sums(1.0)}
+    assert f.get_document("sensors", "id2")["data"] == {}
+    assert len(caperrors.records) == 1
+
+
+@pytest.mark.parametrize(
+    "start, end, expected",
+    [
+        ("2000-05-10", "2000-06-10", history.DAY),
+        ("2000-05-09", "2000-06-09", history.WEEK),
+        ("2000-05-10", "2000-06-11", history.WEEK),
+        ("2000-01-01", "2000-07-02", history.WEEK),
+        ("2000-01-01", "2000-07-03", history.MONTH),
+    ],
+)
+def test_default_resolution(mocker, start, end, expected):
+    mocker.patch(
+        "phenoback.functions.iot.history.retention_cutoff", return_value=CUTOFF
+    )
+    assert (
+        history.default_resolution(
+            history.date.fromisoformat(start), history.date.fromisoformat(end)
+        )
+        == expected
+    )
+
+
+def test_get_history():
+    f.write_document(
+        "sensors",
+        "id1",
+        {
+            "year": YEAR,
+            "data": {"2000-05-10": day_sums(3.0), "2000-06-01": day_sums(4.0, 2)},
+            "weeks": {"2000-W19": day_sums(1.0)},
+            "months": {"2000-04": day_sums(10.0, 5), "2000-05": day_sums(5.0)},
+        },
+    )
+    start = history.date(2000, 5, 1)
+    end = history.date(2000, 6, 30)
+
+    assert history.get_history("id1", start, end, history.MONTH) == {
+        "2000-05": {"sh": 4.0, "st": 4.0, "ah": 4.0, "at": 4.0, "n": 2},
+        "2000-06": {"sh": 2.0, "st": 2.0, "ah": 2.0, "at": 2.0, "n": 2},
+    }
+    assert history.get_history("id1", start, end, history.WEEK) == {
+        "2000-W19": {"sh": 2.0, "st": 2.0, "ah": 2.0, "at": 2.0, "n": 2},
+        "2000-W22": {"sh": 2.0, "st": 2.0, "ah": 2.0, "at": 2.0, "n": 2},
+    }
+    assert list(history.get_history("id1", start, end, history.DAY)) == [
+        "2000-05-10",
+        "2000-06-01",
+    ]
+
+
+def test_get_history__not_found():
+    assert not history.get_history(
+        "unknown", history.date(2000, 1, 1), history.date(2000, 12, 31), history.MONTH
+    )
@@ -1,9 +1,16 @@
 import pytest
+import requests
 from requests.models import Response
 
 from phenoback.functions.iot import dragino, permarobotics
 
 
+@pytest.fixture
+def post_mock(mocker):
+    session_mock = mocker.patch("phenoback.functions.iot.permarobotics.session")
+    return session_mock.return_value.post
+
+
 @pytest.fixture
 def raw_data():
     return {
@@ -39,13 +46,82 @@ def data(raw_data, decoded_payload):
 
 
 def test_main(mocker, pubsub_event_data, context):
-    send_permarobotics_mock = mocker.patch(
-        "phenoback.functions.iot.permarobotics.send_permarobotics"
-    )
+    forward_mock = mocker.patch("phenoback.functions.iot.permarobotics.forward")
 
     permarobotics.main(pubsub_event_data, context)
 
-    send_permarobotics_mock.assert_called_once_with({"foo": "bar"})
+    forward_mock.assert_called_once_with({"foo": "bar"})
+
+
+@pytest.mark.parametrize("queue", [None, "permarobotics"])
+def test_forward(mocker, monkeypatch, data, queue):
+    if queue:
+        monkeypatch.setenv(permarobotics.QUEUE_ENV, queue)
+    else:
+        monkeypatch.delenv(permarobotics.QUEUE_ENV, raising=False)
+    send_mock = mocker.patch("phenoback.functions.iot.permarobotics.send_permarobotics")
+    enqueue_mock = mocker.patch(
+        "phenoback.functions.iot.permarobotics.enqueue_permarobotics"
+    )
+
+    permarobotics.forward(data)
+
+    if queue:
+        enqueue_mock.assert_called_once_with(data, queue)
+        send_mock.assert_not_called()
+    else:
+        send_mock.assert_called_once_with(data)
+        enqueue_mock.assert_not_called()
+
+
+@pytest.mark.parametrize("queue", [None, "permarobotics"])
+def test_forward_batch(mocker, monkeypatch, data, queue):
+    if queue:
+        monkeypatch.setenv(permarobotics.QUEUE_ENV, queue)
+    else:
+        monkeypatch.delenv(permarobotics.QUEUE_ENV, raising=False)
+    send_mock = mocker.patch("phenoback.functions.iot.permarobotics.send_permarobotics")
+    task_client_mock = mocker.patch("phenoback.functions.iot.permarobotics.task_client")
+    sent = []
+
+    def send_batch(requests):
+        sent.extend(requests)
+        return len(sent)
+
+    task_client_mock.return_value.send_batch.side_effect = send_batch
+
+    permarobotics.forward_batch([data, data])
+
+    if queue:
+        task_client_mock.assert_called_once_with(queue)
+        assert [request.payload for request in sent] == [
+            permarobotics.get_payload(data)
+        ] * 2
+        send_mock.assert_not_called()
+    else:
+        assert send_mock.call_count == 2
+        task_client_mock.assert_not_called()
+
+
+def test_session():
+    permarobotics.session.cache_clear()
+    session = permarobotics.session()
+
+    assert permarobotics.session() is session
+    retry = session.get_adapter(permarobotics.URL).max_retries
+    assert retry.total == permarobotics.MAX_RETRIES
+    assert "POST" in retry.allowed_methods
+
+
+def test_enqueue_permarobotics(mocker, data):
+    task_client_mock = mocker.patch("phenoback.functions.iot.permarobotics.task_client")
+
+    permarobotics.enqueue_permarobotics(data, "queue")
+
+    task_client_mock.assert_called_once_with("queue")
+    task_client_mock.return_value.send.assert_called_once_with(
+        permarobotics.get_payload(data)
+    )
 
 
 def test_assert_compatible_decoder(raw_data, decoded_payload):
@@ -54,12 +130,12 @@ def test_assert_compatible_decoder(raw_data, decoded_payload):
     assert decoder.decoded_payload == decoded_payload
 
 
-def test_send_permarobotics(mocker, data):
+def test_send_permarobotics(post_mock, data):
     response = Response()
     response.status_code = 200
-    request_mock = mocker.patch("requests.post", return_value=response)
+    post_mock.return_value = response
     assert permarobotics.send_permarobotics(data)
-    args = request_mock.call_args[1]
+    args = post_mock.call_args[1]
 
     assert (
         args["url"]
@@ -69,13 +145,13 @@ def test_send_permarobotics(mocker, data):
     assert args["json"] is not None
 
 
-def test_send_permarobotics__payload_format(mocker, data):
+def test_send_permarobotics__payload_format(post_mock, data):
     response = Response()
     response.status_code = 200
-    request_mock = mocker.patch("requests.post", return_value=response)
+    post_mock.return_value = response
 
     assert permarobotics.send_permarobotics(data)
-    call_json = request_mock.call_args[1]["json"]
+    call_json = post_mock.call_args[1]["json"]
 
     assert call_json == {
         "end_device_ids": {"dev_eui": "cb773133e929f8a7"},
@@ -96,10 +172,16 @@ def test_send_permarobotics__payload_format(mocker, data):
     }
 
 
-def test_send_permarobotics__error(mocker, caperrors, data):
+def test_send_permarobotics__error(post_mock, caperrors, data):
     response = Response()
     response.status_code = 500
     response._content = str.encode("some error")  # pylint: disable=protected-access
-    mocker.patch("requests.post", return_value=response)
+    post_mock.return_value = response
+    assert not permarobotics.send_permarobotics(data)
+    assert len(caperrors.records) == 1
+
+
+def test_send_permarobotics__connection_error(post_mock, caperrors, data):
+    post_mock.side_effect = requests.ConnectionError("unreachable")
     assert not permarobotics.send_permarobotics(data)
     assert len(caperrors.records) == 1
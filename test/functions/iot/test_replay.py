@@ -0,0 +1,128 @@
+"""
+Load test harness replaying dragino uplinks against the firestore emulator,
+comparing per-message ingestion (ps_iot_dragino) with batched ingestion.
+
+Recorded uplinks are read from the file set in REPLAY_FILE (one JSON message
+per line), otherwise a synthetic set is generated. Run with `pytest -s` to see
+the timings.
+"""
+
+# pylint: disable=unused-argument
+import copy
+import json
+import os
+import time
+from test.functions.iot.sample_data import DraginoData as dd
+
+import pytest
+
+from phenoback.functions.iot import app, batch
+from phenoback.utils import data as d
+from phenoback.utils import firestore as f
+
+REPLAY_FILE = os.getenv("REPLAY_FILE")
+REPLAY_BATCH_SIZE = int(os.getenv("REPLAY_BATCH_SIZE", "500"))
+SYNTHETIC_SENSORS = 10
+SYNTHETIC_UPLINKS_PER_SENSOR = 5
+
+
+@pytest.fixture(autouse=True)
+def insert_data_mock(mocker):
+    return mocker.patch("phenoback.utils.bq.insert_data")
+
+
+def load_uplinks(filename: str) -> list[dict]:
+    with open(filename, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def generate_uplinks(sensors: int, uplinks_per_sensor: int) -> list[dict]:
+    now = d.localtime().replace(minute=0, second=0, microsecond=0)
+    return [
+        {
+            "DevEUI_uplink": {
+                "DevEUI": f"deveui{sensor}",
+                "Time": now.replace(hour=i % 24).isoformat(),
+                "payload_hex": dd.PAYLOAD_HEX,
+            }
+        }
+        for i in range(uplinks_per_sensor)
+        for sensor in range(sensors)
+    ]
+
+
+def add_individuals(uplinks: list[dict], year: int) -> None:
+    deveuis = {uplink["DevEUI_uplink"]["DevEUI"] for uplink in uplinks}
+    d.write_individuals(
+        [
+            {"id": f"{year}_{deveui}", "year": year, "deveui": deveui}
+            for deveui in deveuis
+        ],
+        "id",
+    )
+
+
+def replay_single(uplinks: list[dict]) -> None:
+    for uplink in uplinks:
+        app.main(uplink, None)
+
+
+def replay_batched(uplinks: list[dict], batch_size: int) -> None:
+    for i in range(0, len(uplinks), batch_size):
+        batch.process_uplinks(uplinks[i : i + batch_size])
+
+
+def sensor_totals() -> dict[str, tuple[int, float]]:
+    """:return: individual_id -> (data points, air temperature sum)"""
+    totals = {}
+    for doc in f.collection(app.COLLECTION).stream():
+        days = doc.to_dict()["data"].values()
+        totals[doc.id] = (
+            sum(day["n"] for day in days),
+            sum(day["ats"] for day in days),
+        )
+    return totals
+
+
+def commits(batch_commit_spy) -> int:
+    """Count batches created and committed by batch_commit itself."""
+    return sum(
+        1 for c in batch_commit_spy.call_args_list if not c.args and not c.kwargs
+    )
+
+
+def timed(function, *args) -> float:
+    app.invalidate_individual_cache()
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def test_replay(mocker, phenoyear):
+    if REPLAY_FILE:
+        uplinks = load_uplinks(REPLAY_FILE)
+    else:
+        uplinks = generate_uplinks(SYNTHETIC_SENSORS, SYNTHETIC_UPLINKS_PER_SENSOR)
+    add_individuals(uplinks, phenoyear)
+    commit_spy = mocker.spy(f, "batch_commit")
+
+    single_time = timed(replay_single, copy.deepcopy(uplinks))
+    single_commits = commits(commit_spy)
+    single_totals = sensor_totals()
+
+    f.delete_collection(app.COLLECTION)
+    commit_spy.reset_mock()
+    batched_time = timed(replay_batched, copy.deepcopy(uplinks), REPLAY_BATCH_SIZE)
+    batched_commits = commits(commit_spy)
+    batched_totals = sensor_totals()
+
+    print(
+        f"\nreplayed {len(uplinks)} uplinks: "
+        f"single {single_time:.2f}s ({single_commits} commits), "
+        f"batched {batched_time:.2f}s ({batched_commits} commits)"
+    )
+    assert batched_totals.keys() == single_totals.keys()
+    for individual_id, (n, ats) in single_totals.items():
+        assert batched_totals[individual_id][0] == n
+        assert batched_totals[individual_id][1] == pytest.approx(ats)
+    assert batched_commits <= single_commits
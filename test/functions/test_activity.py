@@ -37,8 +37,8 @@ def test_main(
 )
 def test_process_observation__status(mocker, followers, expected):
     mocker.patch("phenoback.utils.data.get_individual")
-    mocker.patch("phenoback.utils.data.get_phenophase")
-    mocker.patch("phenoback.utils.data.get_species")
+    mocker.patch("phenoback.utils.data.get_phenophase_name")
+    mocker.patch("phenoback.utils.data.get_species_name")
     mocker.patch("phenoback.utils.data.get_user")
     mocker.patch("phenoback.functions.activity.get_followers", return_value=followers)
     update_mock = mocker.patch("phenoback.utils.firestore.write_document")
@@ -60,8 +60,8 @@ def test_process_observation__status(mocker, followers, expected):
 def test_process_observation__values(mocker):
     followers = {"a_follower", "another_follower"}
     mocker.patch("phenoback.utils.data.get_individual")
-    mocker.patch("phenoback.utils.data.get_phenophase")
-    mocker.patch("phenoback.utils.data.get_species")
+    mocker.patch("phenoback.utils.data.get_phenophase_name")
+    mocker.patch("phenoback.utils.data.get_species_name")
     mocker.patch("phenoback.utils.data.get_user")
     mocker.patch("phenoback.functions.activity.get_followers", return_value=followers)
     update_mock = mocker.patch("phenoback.utils.firestore.write_document")
@@ -1,7 +1,13 @@
 # pylint: disable=unused-argument,protected-access
+from datetime import datetime, timezone
+
+import google.api_core.exceptions
 import pytest
+from flask import Request
+from werkzeug.test import EnvironBuilder
 
 from phenoback.functions import map as pheno_map
+from phenoback.utils import data as d
 from phenoback.utils import firestore as f
 
 
@@ -27,6 +33,16 @@ def mapdata(initialdata):
     )
 
 
+@pytest.fixture(autouse=True)
+def clear_scheduled():
+    pheno_map._scheduled.clear()
+
+
+@pytest.fixture
+def client_mock(mocker):
+    return mocker.patch("phenoback.functions.map.client").return_value
+
+
 def get_changepayload(initialdata, year, individual, key, value):
     data = {individual: initialdata[individual].copy()}
     data[individual][key] = value
@@ -47,7 +63,7 @@ def test_client(mocker):
 
 @pytest.mark.parametrize("should_update", [True, False])
 def test_enqueue_change__should_update(mocker, should_update):
-    client_mock = mocker.patch("phenoback.functions.map.client")
+    buffer_change_mock = mocker.patch("phenoback.functions.map.buffer_change")
     should_update_mock = mocker.patch(
         "phenoback.functions.map._should_update", return_value=should_update
     )
@@ -69,14 +85,11 @@ def test_enqueue_change__should_update(mocker, should_update):
     should_update_mock.assert_called_with(
         ["updated_fields"], False, ["station_species"], "last_phenophase"
     )
-    if should_update:
-        client_mock.return_value.send.assert_called()
-    else:
-        client_mock.assert_not_called()
+    assert buffer_change_mock.called == should_update
 
 
 def test_enqueue_change__values(mocker):
-    client_mock = mocker.patch("phenoback.functions.map.client")
+    buffer_change_mock = mocker.patch("phenoback.functions.map.buffer_change")
     mocker.patch("phenoback.functions.map._should_update", return_value=True)
 
     pheno_map.enqueue_change(
@@ -93,26 +106,23 @@ def test_enqueue_change__values(mocker):
         is_create_event=False,
     )
 
-    client_mock.return_value.send.assert_called_with(
+    buffer_change_mock.assert_called_with(
+        2020,
+        "individual_id",
         {
-            "year": 2020,
-            "values": {
-                "individual_id": {
-                    "sp": "species",
-                    "ss": ["station_species"],
-                    "t": "individual_type",
-                    "p": "last_phenophase",
-                    "g": {"lng": 1, "lat": 2},
-                    "so": "source",
-                    "hs": True,
-                }
-            },
-        }
+            "sp": "species",
+            "ss": ["station_species"],
+            "t": "individual_type",
+            "p": "last_phenophase",
+            "g": {"lng": 1, "lat": 2},
+            "so": "source",
+            "hs": True,
+        },
     )
 
 
 def test_enqueue_change__optional_fields_delete(mocker):
-    client_mock = mocker.patch("phenoback.functions.map.client")
+    buffer_change_mock = mocker.patch("phenoback.functions.map.buffer_change")
     mocker.patch("phenoback.functions.map._should_update", return_value=True)
 
     pheno_map.enqueue_change(
@@ -129,22 +139,125 @@ def test_enqueue_change__optional_fields_delete(mocker):
         is_create_event=False,
     )
 
-    client_mock.return_value.send.assert_called_with(
+    buffer_change_mock.assert_called_with(
+        2020,
+        "individual_id",
         {
-            "year": 2020,
-            "values": {
-                "individual_id": {
-                    "sp": pheno_map.DELETE_TOKEN,
-                    "ss": pheno_map.DELETE_TOKEN,
-                    "t": "individual_type",
-                    "p": pheno_map.DELETE_TOKEN,
-                    "g": {"lng": 1, "lat": 2},
-                    "so": "source",
-                    "hs": pheno_map.DELETE_TOKEN,
-                }
-            },
-        }
+            "sp": pheno_map.DELETE_TOKEN,
+            "ss": pheno_map.DELETE_TOKEN,
+            "t": "individual_type",
+            "p": pheno_map.DELETE_TOKEN,
+            "g": {"lng": 1, "lat": 2},
+            "so": "source",
+            "hs": pheno_map.DELETE_TOKEN,
+        },
+    )
+
+
+@pytest.mark.parametrize(
+    "payload, expected",
+    [
+        ({"year": 2020, "window": 5}, "process_window"),
+        ({"year": 2020, "values": {}}, "process_change"),
+    ],
+)
+def test_main_process(mocker, payload, expected):
+    process_mock = mocker.patch(f"phenoback.functions.map.{expected}")
+    request = Request(EnvironBuilder(method="POST", json=payload).get_environ())
+
+    assert pheno_map.main_process(request).status_code == 200
+
+    process_mock.assert_called_once()
+
+
+def test_buffer_change(mocker, client_mock):
+    mocker.patch("phenoback.functions.map.current_window", return_value=10)
+
+    pheno_map.buffer_change(2020, "individual_1", {"p": "BEA"})
+    pheno_map.buffer_change(2020, "individual_1", {"p": "BFA"})
+    pheno_map.buffer_change(2020, "individual_2", {"p": "BEA"})
+
+    assert f.get_document(pheno_map.BUFFER_COLLECTION, "2020_10_individual_1") == {
+        "year": 2020,
+        "window": 10,
+        "individual_id": "individual_1",
+        "values": {"p": "BFA"},
+    }
+    assert f.get_document(pheno_map.BUFFER_COLLECTION, "2020_10_individual_2")
+    client_mock.send.assert_called_once_with(
+        {"year": 2020, "window": 10},
+        task_name="map-2020-10",
+        at=datetime.fromtimestamp(
+            11 * pheno_map.UPDATE_WINDOW + pheno_map.UPDATE_DELAY, timezone.utc
+        ),
+    )
+
+
+def test_schedule_window(client_mock):
+    pheno_map.schedule_window(2020, 10)
+    pheno_map.schedule_window(2020, 10)
+    pheno_map.schedule_window(2020, 11)
+    pheno_map.schedule_window(2021, 11)
+
+    assert [c.kwargs["task_name"] for c in client_mock.send.call_args_list] == [
+        "map-2020-10",
+        "map-2020-11",
+        "map-2021-11",
+    ]
+
+
+def test_schedule_window__already_exists(client_mock):
+    client_mock.send.side_effect = google.api_core.exceptions.AlreadyExists("exists")
+
+    pheno_map.schedule_window(2020, 10)
+    pheno_map.schedule_window(2020, 10)
+
+    client_mock.send.assert_called_once()
+
+
+def test_process_window(mapdata, initialdata: dict):
+    pheno_map.write_buffer(2020, 9, "individual_1", {"key1": "old_value"})
+    pheno_map.write_buffer(2020, 10, "individual_1", {"key1": "new_value"})
+    pheno_map.write_buffer(
+        2020, 10, "individual_3", {"key1": pheno_map.DELETE_TOKEN, "key2": "x"}
     )
+    pheno_map.write_buffer(2020, 11, "individual_2", {"key1": "next_window"})
+    pheno_map.write_buffer(2021, 10, "individual_2", {"key1": "other_year"})
+
+    assert pheno_map.process_window(2020, 10) == 2
+
+    result_year = f.get_document("maps", "2020")["data"]
+    assert result_year["individual_1"] == {"key1": "new_value", "key2": "value2"}
+    assert result_year["individual_2"] == initialdata["individual_2"]
+    assert result_year["individual_3"] == {"key2": "x"}
+    assert f.get_document("maps", "2021")["data"] == initialdata
+    assert {
+        doc["individual_id"]: doc["window"]
+        for doc in f.get_collection_documents(pheno_map.BUFFER_COLLECTION)
+    } == {"individual_2": 11}
+
+
+def test_process_window__sharded(mocker, client_mock):
+    mocker.patch("phenoback.functions.map.current_window", return_value=10)
+    pheno_map.init(2025, 4)
+    values = {f"individual_{i}": {"key1": f"value{i}"} for i in range(10)}
+    for individual_id, individual_values in values.items():
+        pheno_map.buffer_change(2025, individual_id, individual_values)
+    pheno_map.buffer_change(2025, "individual_1", {"key1": "changed"})
+
+    assert pheno_map.process_window(2025, 10) == 10
+
+    assert pheno_map.read_map(2025) == {**values, "individual_1": {"key1": "changed"}}
+    assert not f.get_collection_documents(pheno_map.BUFFER_COLLECTION)
+    client_mock.send.assert_called_once()
+
+
+def test_process_window__nothing_buffered(mapdata, initialdata: dict, mocker):
+    process_change_spy = mocker.spy(pheno_map, "process_change")
+
+    assert pheno_map.process_window(2020, 10) == 0
+
+    process_change_spy.assert_not_called()
 
 
 def test_process_change__other_individuals_unchanged(mapdata, initialdata: dict):
@@ -232,6 +345,9 @@ def test_should_update__on_update(updated_fields, expected):
 
 
 def test_delete(mapdata):
+    pheno_map.write_buffer(2020, 10, "individual_1", {"key1": "pending"})
+    pheno_map.write_buffer(2020, 10, "individual_2", {"key1": "pending"})
+
     pheno_map.delete(2020, "individual_1")
 
     result_year = f.get_document("maps", "2020")["data"]
@@ -241,6 +357,10 @@ def test_delete(mapdata):
     assert result_year.get("individual_2") is not None, result_year
     assert other_year.get("individual_1") is not None, other_year
     assert other_year.get("individual_2") is not None, other_year
+    assert [
+        doc["individual_id"]
+        for doc in f.get_collection_documents(pheno_map.BUFFER_COLLECTION)
+    ] == ["individual_2"]
 
 
 def test_init():
@@ -250,4 +370,185 @@ def test_init():
     doc = f.get_document("maps", str(year))
     assert doc
     assert doc["year"] == year
-    assert doc["data"] == {}
+    assert doc["shards"] == pheno_map.SHARDS
+    shards = f.get_collection_documents(pheno_map.shard_collection(year))
+    assert len(shards) == pheno_map.SHARDS
+    assert all(shard["data"] == {} for shard in shards)
+    assert pheno_map.read_map(year) == {}
+
+
+def test_shard():
+    shards = [pheno_map.shard(f"2025_{i}", 4) for i in range(100)]
+
+    assert pheno_map.shard("2025_1", 4) == shards[1]
+    assert set(shards) == {0, 1, 2, 3}
+
+
+def test_shard_count(mapdata):
+    pheno_map.init(2025, 4)
+
+    assert pheno_map.shard_count(2025) == 4
+    assert pheno_map.shard_count(2020) == 0
+    assert pheno_map.shard_count(1999) == 0
+
+
+def test_process_change__sharded(initialdata: dict):
+    pheno_map.init(2025, 4)
+    values = {f"individual_{i}": {"key1": f"value{i}"} for i in range(10)}
+
+    pheno_map.process_change({"year": 2025, "values": values})
+    pheno_map.process_change(
+        {"year": 2025, "values": {"individual_1": {"key1": pheno_map.DELETE_TOKEN}}}
+    )
+
+    assert pheno_map.read_map(2025) == {**values, "individual_1": {}}
+    for i in range(10):
+        shard = f.get_document(
+            pheno_map.shard_collection(2025),
+            str(pheno_map.shard(f"individual_{i}", 4)),
+        )
+        assert f"individual_{i}" in shard["data"]
+    manifest = f.get_document("maps", "2025")
+    assert "data" not in manifest
+    assert set(manifest["modified"]) <= {"0", "1", "2", "3"}
+
+
+def test_delete__sharded():
+    pheno_map.init(2025, 4)
+    pheno_map.process_change(
+        {"year": 2025, "values": {"individual_1": {"key1": "value1"}}}
+    )
+    pheno_map.process_change(
+        {"year": 2025, "values": {"individual_2": {"key1": "value2"}}}
+    )
+
+    pheno_map.delete(2025, "individual_1")
+
+    assert pheno_map.read_map(2025) == {"individual_2": {"key1": "value2"}}
+
+
+def add_individual(individual_id: str, year: int, **values) -> None:
+    d.write_individual(
+        individual_id,
+        {
+            "year": year,
+            "type": "individual",
+            "geopos": {"lat": 46.0, "lng": 7.0},
+            "source": "globe",
+            **values,
+        },
+    )
+
+
+def test_individual_values():
+    assert pheno_map.individual_values(
+        {
+            "type": "station",
+            "geopos": {"lat": 46.0, "lng": 7.0},
+            "source": "meteoswiss",
+            "station_species": ["HS"],
+            "deveui": "deveui1",
+            "last_phenophase": None,
+        }
+    ) == {
+        "t": "station",
+        "g": {"lat": 46.0, "lng": 7.0},
+        "so": "meteoswiss",
+        "ss": ["HS"],
+        "hs": True,
+    }
+
+
+def test_compare():
+    assert pheno_map.compare(
+        {"a": {"p": "BEA"}, "b": {"p": "BEA"}, "c": {"p": "BEA"}},
+        {"b": {"p": "BEA"}, "c": {"p": "BFA"}, "d": {}},
+    ) == {"missing": ["a"], "unexpected": ["d"], "changed": ["c"]}
+
+
+def test_rebuild(capwarnings):
+    add_individual("2020_1", 2020, last_phenophase="BEA", species="HS")
+    add_individual("2020_2", 2020, station_species=["HS"], deveui="deveui1")
+    add_individual("2020_3", 2020)
+    add_individual("2021_1", 2021, last_phenophase="BEA")
+    pheno_map.init(2020, 4)
+    pheno_map.process_change(
+        {"year": 2020, "values": {"2020_1": {"t": "individual"}, "2020_4": {}}}
+    )
+
+    report = pheno_map.rebuild(2020, shards=2)
+
+    assert report["individuals"] == 2
+    assert (report["missing"], report["unexpected"], report["changed"]) == (1, 1, 1)
+    assert len(capwarnings.records) == 3
+    assert pheno_map.shard_count(2020) == 2
+    assert pheno_map.read_map(2020) == {
+        "2020_1": {
+            "t": "individual",
+            "g": {"lat": 46.0, "lng": 7.0},
+            "so": "globe",
+            "p": "BEA",
+            "sp": "HS",
+        },
+        "2020_2": {
+            "t": "individual",
+            "g": {"lat": 46.0, "lng": 7.0},
+            "so": "globe",
+            "ss": ["HS"],
+            "hs": True,
+        },
+    }
+    assert len(f.get_collection_documents(pheno_map.shard_collection(2020))) == 2
+    assert pheno_map.rebuild(2020, shards=2)["changed"] == 0
+
+
+def test_rebuild__on_map_without_phenophase():
+    add_individual("2020_1", 2020, species="HS")
+    add_individual("2020_2", 2020, species="HS")
+    add_individual("2020_3", 2020, station_species=[])
+    pheno_map.init(2020, 4)
+    # added to the map by an update of a map relevant field
+    pheno_map.process_change({"year": 2020, "values": {"2020_1": {"sp": "BA"}}})
+
+    report = pheno_map.rebuild(2020)
+
+    assert (report["missing"], report["unexpected"], report["changed"]) == (1, 0, 1)
+    assert set(pheno_map.read_map(2020)) == {"2020_1", "2020_3"}
+    assert pheno_map.read_map(2020)["2020_1"]["sp"] == "HS"
+
+
+def test_rebuild__dry_run():
+    add_individual("2020_1", 2020, last_phenophase="BEA")
+    pheno_map.init(2020, 4)
+
+    report = pheno_map.rebuild(2020, dry_run=True)
+
+    assert report["missing"] == 1
+    assert pheno_map.read_map(2020) == {}
+
+
+def test_rebuild__not_sharded(mapdata):
+    add_individual("2020_1", 2020, last_phenophase="BEA")
+
+    report = pheno_map.rebuild(2020)
+
+    assert report["unexpected"] == 2
+    assert pheno_map.shard_count(2020) == pheno_map.SHARDS
+    assert list(pheno_map.read_map(2020)) == ["2020_1"]
+    assert "data" not in f.get_document("maps", "2020")
+
+
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        ({"year": 2020}, (2020, False)),
+        ({"year": 2020, "dry_run": True}, (2020, True)),
+        (None, (2000, False)),
+    ],
+)
+def test_main_rebuild(mocker, phenoyear, data, expected):
+    rebuild_mock = mocker.patch("phenoback.functions.map.rebuild")
+
+    pheno_map.main_rebuild(data, None)
+
+    rebuild_mock.assert_called_once_with(expected[0], dry_run=expected[1])
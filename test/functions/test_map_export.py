@@ -0,0 +1,159 @@
+import gzip
+import json
+
+import pytest
+
+from phenoback.functions import map as pheno_map
+from phenoback.functions import map_export
+from phenoback.utils import firestore as f
+
+YEAR = 2025
+
+
+@pytest.fixture
+def upload_mock(mocker):
+    return mocker.patch("phenoback.utils.storage.upload_string")
+
+
+@pytest.fixture
+def export_mock(mocker):
+    return mocker.patch("phenoback.functions.map_export.export")
+
+
+def values(i: int) -> dict:
+    return {"t": "individual", "p": "BEA", "g": {"lat": 46.0 + i, "lng": 7.0 + i}}
+
+
+def event(updated_fields: list[str], created: bool = False) -> dict:
+    return {
+        "oldValue": {} if created else {"fields": {}},
+        "value": {"fields": {}},
+        "updateMask": {"fieldPaths": updated_fields},
+    }
+
+
+def uploaded(upload_mock) -> dict[str, bytes]:
+    return {c.args[1]: c.args[2] for c in upload_mock.call_args_list}
+
+
+@pytest.mark.parametrize(
+    "updated_fields, expected",
+    [
+        (["modified.1", "modified.3"], {1, 3}),
+        (["data.individual_1.p"], {0}),
+        (["export.1"], set()),
+    ],
+)
+def test_modified_shards(updated_fields, expected):
+    assert map_export.modified_shards(updated_fields, False) == expected
+
+
+def test_modified_shards__created():
+    assert map_export.modified_shards([], True) is None
+
+
+def test_main(mocker, export_mock):
+    context = mocker.Mock(resource="projects/p/databases/(default)/documents/maps/2025")
+
+    map_export.main(event(["modified.2"]), context)
+    map_export.main(event(["export.2"]), context)
+    map_export.main(event([], created=True), context)
+
+    assert [c.args for c in export_mock.call_args_list] == [
+        (YEAR, {2}),
+        (YEAR, None),
+    ]
+
+
+def test_main_export(export_mock, phenoyear):
+    map_export.main_export({"year": 2020}, None)
+    map_export.main_export(None, None)
+
+    assert [c.args for c in export_mock.call_args_list] == [(2020,), (phenoyear,)]
+
+
+def test_render():
+    data = {
+        "individual_2": {**values(2), "ss": ["HS"], "other": "x"},
+        "individual_1": values(1),
+        "no_geopos": {"t": "individual"},
+    }
+
+    result = json.loads(map_export.render(data))
+
+    assert result["type"] == "FeatureCollection"
+    assert [feature["id"] for feature in result["features"]] == [
+        "individual_1",
+        "individual_2",
+    ]
+    assert result["features"][0]["geometry"] == {
+        "type": "Point",
+        "coordinates": [8.0, 47.0],
+    }
+    assert result["features"][1]["properties"] == {
+        "t": "individual",
+        "p": "BEA",
+        "ss": ["HS"],
+    }
+
+
+def test_export(upload_mock):
+    pheno_map.init(YEAR, 4)
+    data = {f"individual_{i}": values(i) for i in range(10)}
+    pheno_map.process_change({"year": YEAR, "values": data})
+
+    manifest = map_export.export(YEAR)
+
+    files = uploaded(upload_mock)
+    assert len(files) == 5
+    assert set(manifest["shards"]) == {"0", "1", "2", "3"}
+    assert json.loads(files[map_export.manifest_path(YEAR)]) == manifest
+    features = [
+        feature["id"]
+        for path in manifest["shards"].values()
+        for feature in json.loads(gzip.decompress(files[path]))["features"]
+    ]
+    assert sorted(features) == sorted(data)
+    assert upload_mock.call_args_list[0].kwargs == {
+        "content_type": "application/geo+json",
+        "cache_control": map_export.SHARD_CACHE_CONTROL,
+        "content_encoding": "gzip",
+    }
+    assert f.get_document("maps", str(YEAR))["export"] == manifest["shards"]
+
+
+def test_export__incremental(upload_mock):
+    pheno_map.init(YEAR, 4)
+    pheno_map.process_change(
+        {"year": YEAR, "values": {f"individual_{i}": values(i) for i in range(10)}}
+    )
+    manifest = map_export.export(YEAR)
+    upload_mock.reset_mock()
+
+    assert map_export.export(YEAR)["shards"] == manifest["shards"]
+    upload_mock.assert_not_called()
+
+    shard = pheno_map.shard("individual_1", 4)
+    pheno_map.process_change({"year": YEAR, "values": {"individual_1": {"p": "BFA"}}})
+    updated = map_export.export(YEAR, {shard})
+
+    assert list(uploaded(upload_mock)) == [
+        updated["shards"][str(shard)],
+        map_export.manifest_path(YEAR),
+    ]
+    assert updated["version"] != manifest["version"]
+    assert {n: path for n, path in updated["shards"].items() if n != str(shard)} == {
+        n: path for n, path in manifest["shards"].items() if n != str(shard)
+    }
+
+
+def test_export__not_sharded(upload_mock):
+    f.write_document(
+        "maps", str(YEAR), {"year": YEAR, "data": {"individual_1": values(1)}}
+    )
+
+    manifest = map_export.export(YEAR)
+
+    assert list(manifest["shards"]) == ["0"]
+    content = uploaded(upload_mock)[manifest["shards"]["0"]]
+    assert json.loads(gzip.decompress(content))["features"][0]["id"] == "individual_1"
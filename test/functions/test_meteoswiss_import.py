@@ -12,6 +12,7 @@ import pytz
 from phenoback.functions import meteoswiss_import as meteoswiss
 from phenoback.utils import data as d
 from phenoback.utils import firestore as f
+from phenoback.utils.importreport import ImportReport
 
 HASH_COLLECTION = "definitions"
 HASH_DOCUMENT = "meteoswiss_import"
@@ -74,6 +75,21 @@ class TestCommon:
         stations_mock.assert_called_once()
         observations_mock.assert_called_once()
 
+    def test_main__dry_run(self, mocker, context):
+        stations_mock = mocker.patch(
+            "phenoback.functions.meteoswiss_import.process_stations"
+        )
+        observations_mock = mocker.patch(
+            "phenoback.functions.meteoswiss_import.process_observations"
+        )
+        upload_mock = mocker.patch("phenoback.utils.importreport.ImportReport.upload")
+
+        meteoswiss.main({"dry_run": True}, context)
+
+        assert stations_mock.call_args.kwargs["report"].dry_run
+        assert observations_mock.call_args.kwargs["report"].dry_run
+        upload_mock.assert_called_once()
+
     def test_get_hash(self):
         assert meteoswiss._get_hash("string1") == meteoswiss._get_hash("string1")
         assert meteoswiss._get_hash("string1") != meteoswiss._get_hash("string2")
@@ -164,7 +180,9 @@ class TestObservations:
         )
 
         assert meteoswiss.process_observations()
-        process_response_mock.assert_called_once_with(response_text, response_elapsed)
+        process_response_mock.assert_called_once_with(
+            response_text, response_elapsed, report=None
+        )
 
     def test_process_observations__nok(self, mocker):
         mocker.patch(
@@ -176,6 +194,22 @@ class TestObservations:
         except meteoswiss.ResourceNotFoundException:
             pass  # expected
 
+    def test_process_observations_response__dry_run(
+        self, observation_data, meteoswiss_mapping
+    ):
+        report = ImportReport("meteoswiss", dry_run=True)
+
+        assert meteoswiss.process_observations_response(
+            observation_data, 0.1, report=report
+        )
+
+        assert meteoswiss_mapping
+        assert not f.get_collection_documents(OBSERVATION_COLLECTION)
+        assert not f.get_document(HASH_COLLECTION, HASH_DOCUMENT)
+        assert report.collections[OBSERVATION_COLLECTION]["new"] > 0
+        assert report.collections[STATION_COLLECTION]["new"] > 0
+        assert report.info["observations_file_changed"]
+
     @pytest.mark.parametrize(
         "data1, data2, is_processed_expected",
         [
@@ -274,7 +308,7 @@ class TestStations:
         year = 2000
         assert meteoswiss.process_stations(year)
         process_response_mock.assert_called_once_with(
-            year, response_text, response_elapsed
+            year, response_text, response_elapsed, report=None
         )
 
     def test_process_stations__nok(self, mocker):
@@ -287,6 +321,23 @@ class TestStations:
         except meteoswiss.ResourceNotFoundException:
             pass  # expected
 
+    def test_process_stations_response__dry_run(self, station_data):
+        phenoyear = d.get_phenoyear(True)
+        meteoswiss.process_stations_response(phenoyear, station_data, 0)
+        d.update_individual(f"{phenoyear}_ADB", {"name": "changed"})
+        report = ImportReport("meteoswiss", dry_run=True)
+
+        assert not meteoswiss.process_stations_response(
+            phenoyear, station_data, 0, report=report
+        )
+
+        assert d.get_individual(f"{phenoyear}_ADB")["name"] == "changed"
+        assert report.collections[STATION_COLLECTION] == {
+            "new": 0,
+            "changed": 1,
+            "unchanged": 2,
+        }
+
     def test_process_stations_response__write(self, station_data):
         phenoyear = d.get_phenoyear(True)
         meteoswiss.process_stations_response(phenoyear, station_data, 0)
@@ -1,4 +1,5 @@
 # pylint: disable=unused-argument
+import google.api_core.exceptions
 import pytest
 
 import phenoback.functions.map
@@ -126,53 +127,235 @@ def get_amt(year: int, field: str = None):
     return len(list(query.stream()))
 
 
+@pytest.fixture()
+def client_mock(mocker):
+    return mocker.patch("phenoback.functions.rollover.client")
+
+
+def enqueued_stages(client_mock) -> list[str]:
+    return [c.args[0]["stage"] for c in client_mock.return_value.send.call_args_list]
+
+
 def test_main(mocker, data, context):
-    rollover_mock = mocker.patch("phenoback.functions.rollover.rollover")
+    start_rollover_mock = mocker.patch("phenoback.functions.rollover.start_rollover")
     rollover.main(data, context)
-    rollover_mock.assert_called_once()
+    start_rollover_mock.assert_called_once()
 
 
-def test_get_rollover_individuals__roll_amt(current_phenoyear):
-    roll_amt = get_amt(current_phenoyear, "_rolled")
+def test_main_process(mocker):
+    process_stage_mock = mocker.patch("phenoback.functions.rollover.process_stage")
+    request = mocker.Mock()
+    request.get_json.return_value = {"year": 2012, "stage": "init_map", "run": 1}
 
-    roll_individuals = rollover.get_rollover_individuals(
-        current_phenoyear, current_phenoyear + 1
-    )
+    result = rollover.main_process(request)
+
+    assert result.status_code == 200
+    process_stage_mock.assert_called_once_with(2012, "init_map", 1)
+
+
+def test_client(mocker):
+    task_mock = mocker.patch("phenoback.utils.tasks.GCFClient")
+    rollover.client.cache_clear()
+
+    rollover.client()
+
+    task_mock.assert_called_with(rollover.QUEUE_NAME, rollover.FUNCTION_NAME)
 
-    assert len(roll_individuals) == roll_amt
 
+def test_function_name(gcf_names):
+    assert rollover.FUNCTION_NAME in gcf_names
 
-def test_get_rollover_individuals__keys(current_phenoyear):
-    roll_individuals = rollover.get_rollover_individuals(
-        current_phenoyear, current_phenoyear + 1
+
+def test_start_rollover(client_mock, current_phenoyear):
+    rollover.start_rollover()
+
+    progress = rollover.get_progress(current_phenoyear)
+    assert progress["run"] == 1
+    assert progress["target_year"] == current_phenoyear + 1
+    assert progress["stages"].keys() == rollover.STAGES.keys()
+    assert sorted(enqueued_stages(client_mock)) == ["init_map", "statistics_1y"]
+
+
+def test_start_rollover__resume(client_mock, current_phenoyear):
+    rollover.start_rollover()
+    rollover.set_stage_progress(current_phenoyear, "init_map", {"status": "done"})
+    client_mock.reset_mock()
+
+    rollover.start_rollover()
+
+    progress = rollover.get_progress(current_phenoyear)
+    assert progress["run"] == 2
+    assert progress["stages"]["init_map"]["status"] == "done"
+    assert sorted(enqueued_stages(client_mock)) == [
+        "copy_individuals",
+        "statistics_1y",
+    ]
+    assert "-2-" in client_mock.return_value.send.call_args.kwargs["task_name"]
+
+
+def test_start_rollover__finished(client_mock, current_phenoyear, capwarnings):
+    f.write_document(
+        rollover.PROGRESS_COLLECTION, str(current_phenoyear), {"finished": True}
     )
-    assert len(roll_individuals) > 0
-    assert (
-        individual["id"] == "2013_" + individual["individual"]
-        for individual in roll_individuals
+
+    rollover.start_rollover()
+
+    client_mock.return_value.send.assert_not_called()
+    assert len(capwarnings.records) == 1
+
+
+@pytest.mark.parametrize(
+    "done, expected",
+    [
+        ([], ["init_map", "statistics_1y"]),
+        (["init_map"], ["copy_individuals", "statistics_1y"]),
+        (
+            ["init_map", "copy_individuals", "statistics_1y"],
+            ["clear_sensors", "statistics_5y_30y"],
+        ),
+        (
+            ["init_map", "copy_individuals", "statistics_1y", "clear_sensors"],
+            ["statistics_5y_30y"],
+        ),
+        (list(rollover.STAGES)[:-1], ["update_phenoyear"]),
+        (list(rollover.STAGES), []),
+    ],
+)
+def test_ready_stages(done, expected):
+    progress = {
+        "stages": {
+            stage: {"status": "done" if stage in done else "pending"}
+            for stage in rollover.STAGES
+        }
+    }
+    assert rollover.ready_stages(progress) == expected
+
+
+def test_enqueue_stage__already_exists(client_mock):
+    client_mock.return_value.send.side_effect = (
+        google.api_core.exceptions.AlreadyExists("exists")
     )
+    rollover.enqueue_stage(2012, "update_phenoyear", 1)
+    client_mock.return_value.send.assert_called_once()
+
+
+def test_process_stage__outdated_run(mocker, client_mock, current_phenoyear):
+    run_stage_mock = mocker.patch("phenoback.functions.rollover.run_stage")
+    rollover.start_rollover()
+
+    rollover.process_stage(current_phenoyear, "init_map", 0)
+
+    run_stage_mock.assert_not_called()
+
+
+def test_process_stage__copy_chunked(mocker, client_mock, current_phenoyear):
+    mocker.patch.object(rollover, "COPY_PAGE_SIZE", 2)
+    mocker.patch.object(rollover, "COPY_TIME_BUDGET", 0)
+    roll_amt = get_amt(current_phenoyear, "_rolled")
+    rollover.start_rollover()
+    rollover.process_stage(current_phenoyear, "init_map", 1)
+
+    chunks = 0
+    while (
+        rollover.get_progress(current_phenoyear)["stages"]["copy_individuals"]["status"]
+        != "done"
+    ):
+        rollover.process_stage(current_phenoyear, "copy_individuals", 1)
+        chunks += 1
+
+    assert chunks > 1
+    assert get_amt(current_phenoyear + 1) == roll_amt
+    state = rollover.get_progress(current_phenoyear)["stages"]["copy_individuals"]
+    assert state["copied"] == roll_amt
+    assert "clear_sensors" in enqueued_stages(client_mock)
+
+
+def test_process_stage__all(client_mock, current_phenoyear):
+    roll_amt = get_amt(current_phenoyear, "_rolled")
+    rollover.start_rollover()
+
+    processed = []
+    while client_mock.return_value.send.call_count > len(processed):
+        payload = client_mock.return_value.send.call_args_list[len(processed)].args[0]
+        rollover.process_stage(payload["year"], payload["stage"], payload["run"])
+        processed.append(payload["stage"])
+
+    # stages are enqueued more than once, deduplicated by task name in cloud tasks
+    assert set(processed) == set(rollover.STAGES)
+    assert rollover.get_progress(current_phenoyear)["finished"]
+    assert d.get_phenoyear(True) == current_phenoyear + 1
+    assert get_amt(current_phenoyear + 1) == roll_amt
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 500])
+def test_copy_individuals(mocker, current_phenoyear, page_size):
+    mocker.patch.object(rollover, "COPY_PAGE_SIZE", page_size)
+    roll_amt = get_amt(current_phenoyear, "_rolled")
+
+    copied, cursor = rollover.copy_individuals(current_phenoyear, current_phenoyear + 1)
+
+    assert copied == roll_amt
+    assert cursor is None
+    assert get_amt(current_phenoyear + 1) == roll_amt
 
 
-def test_get_rollover_individuals__documents(current_phenoyear):
-    roll_individuals = rollover.get_rollover_individuals(
-        current_phenoyear, current_phenoyear + 1
+def test_copy_individuals__projection(current_phenoyear):
+    rollover.copy_individuals(current_phenoyear, current_phenoyear + 1)
+
+    individual = d.get_individual(f"{current_phenoyear + 1}_4_globe")
+    assert individual == {
+        "individual": "4_globe",
+        "source": "globe",
+        "year": current_phenoyear + 1,
+        "deveui": "deveui_4_globe",
+        "sensor": {},
+    }
+
+
+def test_copy_individuals__time_budget(mocker, current_phenoyear):
+    mocker.patch.object(rollover, "COPY_PAGE_SIZE", 2)
+    roll_amt = get_amt(current_phenoyear, "_rolled")
+
+    copied, cursor = rollover.copy_individuals(
+        current_phenoyear, current_phenoyear + 1, time_budget=0
     )
-    assert len(roll_individuals) > 0
-    for individual in roll_individuals:
-        assert individual["_rolled"], individual
-        assert "last_phenophase" not in individual, individual
-        assert "last_observation_date" not in individual, individual
-        assert "reprocess" not in individual, individual
+    assert cursor is not None
+    total = copied
+    while cursor is not None:
+        copied, cursor = rollover.copy_individuals(
+            current_phenoyear, current_phenoyear + 1, cursor=cursor, time_budget=0
+        )
+        total += copied
 
+    assert total == roll_amt
 
-def test_get_rollover_individuals__single_individual(current_phenoyear):
-    roll_individuals = rollover.get_rollover_individuals(
-        current_phenoyear, current_phenoyear + 1, "2_globe"
+
+def test_run_stage__unknown():
+    with pytest.raises(ValueError):
+        rollover.run_stage("unknown", 2012, {})
+
+
+def test_rollover_individual():
+    individual = rollover.rollover_individual(
+        {
+            "individual": "1_globe",
+            "year": 2012,
+            "last_phenophase": "BEA",
+            "last_observation_date": "a value",
+            "created": "a value",
+            "modified": "a value",
+            "reprocess": 1,
+            "sensor": {"ss": 1},
+        },
+        2013,
     )
-    assert len(roll_individuals) == 1
-    for individual in roll_individuals:
-        assert individual["id"] == f'{current_phenoyear + 1}_{individual["individual"]}'
-        assert individual["individual"] == "2_globe"
+
+    assert individual == {
+        "id": "2013_1_globe",
+        "individual": "1_globe",
+        "year": 2013,
+        "sensor": {},
+    }
 
 
 def test_get_stale_individuals__removed_amt(current_phenoyear):
@@ -184,6 +367,40 @@ def test_get_stale_individuals__removed_amt(current_phenoyear):
     assert len(stale_individuals) == removed_amt, stale_individuals
 
 
+@pytest.mark.parametrize("shards", [2, 3, len(rollover.SHARD_ALPHABET)])
+def test_get_stale_individuals__sharded(current_phenoyear, shards):
+    d.write_individual(f"{current_phenoyear}_zzz", {"year": current_phenoyear})
+    d.write_individual(f"{current_phenoyear}_AAA", {"year": current_phenoyear})
+    d.write_individual(f"{current_phenoyear}_-", {"year": current_phenoyear})
+    expected = rollover.get_stale_individuals(current_phenoyear)
+
+    sharded = [
+        rollover.get_stale_individuals(current_phenoyear, shard, shards)
+        for shard in range(shards)
+    ]
+
+    assert sorted(i for shard in sharded for i in shard) == sorted(expected)
+
+
+@pytest.mark.parametrize(
+    "shard, shards, expected",
+    [
+        (0, 1, (None, None)),
+        (0, 3, (None, "2012_L")),
+        (1, 3, ("2012_L", "2012_f")),
+        (2, 3, ("2012_f", None)),
+    ],
+)
+def test_shard_bounds(shard, shards, expected):
+    assert rollover.shard_bounds(2012, shard, shards) == expected
+
+
+@pytest.mark.parametrize("shard, shards", [(1, 1), (-1, 2), (0, 0), (0, 100)])
+def test_shard_bounds__invalid(shard, shards):
+    with pytest.raises(ValueError):
+        rollover.shard_bounds(2012, shard, shards)
+
+
 def test_rollover__individuals_created(current_phenoyear):
     roll_amt = get_amt(current_phenoyear, "_rolled")
     rollover.rollover()
@@ -206,6 +423,53 @@ def test_remove_stale_individuals__specific_phenoyear(current_phenoyear):
     assert get_amt(2011) == individuals_kept_amt
 
 
+def test_remove_stale_individuals__sharded(current_phenoyear):
+    removed_amt = get_amt(2011, "_remove")
+    individuals_kept_amt = get_amt(2011) - removed_amt
+    removed = sum(
+        rollover.remove_stale_individuals(2011, shard, 3) for shard in range(3)
+    )
+    assert removed == removed_amt
+    assert get_amt(2011) == individuals_kept_amt
+
+
+def test_enqueue_remove_stale_individuals(client_mock, current_phenoyear):
+    rollover.enqueue_remove_stale_individuals(shards=3)
+
+    assert [c.args[0] for c in client_mock.return_value.send.call_args_list] == [
+        {"year": current_phenoyear - 1, "shard": shard, "shards": 3}
+        for shard in range(3)
+    ]
+
+
+def test_main_process__stale(mocker):
+    remove_mock = mocker.patch("phenoback.functions.rollover.remove_stale_individuals")
+    request = mocker.Mock()
+    request.get_json.return_value = {"year": 2011, "shard": 1, "shards": 3}
+
+    rollover.main_process(request)
+
+    remove_mock.assert_called_once_with(2011, 1, 3)
+
+
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        (None, (None, rollover.STALE_SHARDS)),
+        ({"year": "2011"}, (2011, rollover.STALE_SHARDS)),
+        ({"year": 2011, "shards": 8}, (2011, 8)),
+    ],
+)
+def test_main_remove_stale(mocker, data, expected):
+    enqueue_mock = mocker.patch(
+        "phenoback.functions.rollover.enqueue_remove_stale_individuals"
+    )
+
+    rollover.main_remove_stale(data, None)
+
+    enqueue_mock.assert_called_once_with(*expected)
+
+
 def test_rollover__update_year(current_phenoyear):
     rollover.rollover()
     assert d.get_phenoyear(True) == current_phenoyear + 1
@@ -245,4 +509,4 @@ def test_rollover__update_maps(mocker, current_phenoyear):
     doc = f.get_document("maps", str(current_phenoyear + 1))
     assert doc
     assert doc["year"] == current_phenoyear + 1
-    assert doc["data"] == {}
+    assert phenoback.functions.map.read_map(current_phenoyear + 1) == {}
@@ -1,5 +1,6 @@
 # pylint: disable=unused-argument
 import io
+import json
 import test
 from zipfile import ZipFile
 
@@ -10,13 +11,6 @@ import phenoback.utils.firestore as f
 from phenoback.functions import wld_import
 
 
-@pytest.fixture(autouse=True, scope="function")
-def cache_clear():
-    wld_import.site_users.cache_clear()
-    wld_import.station_species.cache_clear()
-    wld_import.tree_species.cache_clear()
-
-
 @pytest.fixture()
 def zippath():
     return test.get_resource_path("wld_import_test.zip")
@@ -38,10 +32,9 @@ def input_io(input_blob):
 
 
 @pytest.fixture()
-def data_loaded(input_io):
+def loaded_data(input_io) -> dict[str, list[dict]]:
     with ZipFile(input_io, mode="r") as input_zip:
-        wld_import.loaded_data = wld_import.load_data(input_zip)
-    return True
+        return wld_import.load_data(input_zip)
 
 
 @pytest.mark.parametrize(
@@ -67,11 +60,33 @@ def test_main(mocker, context, pathfile, called):
     d.update_phenoyear(current_phenoyear)
     wld_import.main({"name": pathfile}, context)
     if called:
-        mock.assert_called_once_with(pathfile, current_phenoyear - 1)
+        mock.assert_called_once_with(pathfile, current_phenoyear - 1, dry_run=False)
     else:
         assert not mock.called
 
 
+@pytest.mark.parametrize(
+    "pathfile, dry_run",
+    [
+        ("private/wld_import/all_years/archive.zip", False),
+        ("private/wld_import/dry_run/all_years/archive.zip", True),
+        ("private/wld_import/all_years/dry_run/archive.zip", True),
+    ],
+)
+def test_main__all_years(mocker, context, pathfile, dry_run):
+    mock = mocker.patch("phenoback.functions.wld_import.import_data")
+    wld_import.main({"name": pathfile}, context)
+    mock.assert_called_once_with(pathfile, dry_run=dry_run)
+
+
+def test_main__dry_run(mocker, context):
+    mock = mocker.patch("phenoback.functions.wld_import.import_data")
+    d.update_phenoyear(2002)
+    pathfile = "private/wld_import/dry_run/archive.zip"
+    wld_import.main({"name": pathfile}, context)
+    mock.assert_called_once_with(pathfile, 2001, dry_run=True)
+
+
 def test_check_zip_archive(zippath):
     with ZipFile(zippath, mode="r") as zip_file:
         wld_import.check_zip_archive(zip_file)
@@ -148,22 +163,49 @@ def test_members_by_basename__duplicates(mocker):
     assert all(p.endswith("user_id.csv") for p in members["user_id.csv"])
 
 
-def test_check_data_integrity(data_loaded):
-    assert data_loaded
-    assert wld_import.loaded_data
-    wld_import.check_data_integrity()
+def test_import_context(loaded_data):
+    ctx = wld_import.ImportContext(loaded_data)
+    assert ctx.user_ids == {u["user_id"] for u in loaded_data["user_id.csv"]}
+    assert ctx.site_ids == {s["site_id"] for s in loaded_data["site.csv"]}
+    assert ctx.tree_cnt == len(loaded_data["tree.csv"])
+    for tree in loaded_data["tree.csv"]:
+        assert ctx.has_tree(tree["site_id"], tree["tree_id"])
+        assert ctx.get_tree_species(
+            tree["site_id"], tree["tree_id"]
+        ) == wld_import.map_species(tree["species_id"])
+    for obs in loaded_data["observation_phaeno.csv"]:
+        assert ctx.get_user(obs["site_id"], obs["year"]) == obs["user_id"]
+        assert ctx.get_user(obs["site_id"], int(obs["year"])) == obs["user_id"]
+    assert ctx.get_user("unknown_site", 2001) is None
+
+
+def test_import_context__not_shared(loaded_data):
+    ctx1 = wld_import.ImportContext(loaded_data)
+    ctx2 = wld_import.ImportContext({**loaded_data, "observation_phaeno.csv": []})
+    assert ctx1.site_users
+    assert not ctx2.site_users
+
+
+def test_import_context__years(loaded_data):
+    ctx = wld_import.ImportContext(loaded_data)
+    assert ctx.years == [2001, 9999]
+    assert sum(len(obs) for obs in ctx.year_observations.values()) == len(
+        loaded_data["observation_phaeno.csv"]
+    )
+
+
+def test_check_data_integrity(loaded_data):
+    wld_import.check_data_integrity(wld_import.ImportContext(loaded_data))
 
 
 @pytest.mark.parametrize(
     "filename, fieldname",
     [("user_id.csv", "user_id"), ("site.csv", "site_id")],
 )
-def test_check_data_integrity__empty(data_loaded, caperrors, filename, fieldname):
-    assert data_loaded
-    assert wld_import.loaded_data
-    wld_import.loaded_data[filename] = []
+def test_check_data_integrity__empty(loaded_data, caperrors, filename, fieldname):
+    loaded_data[filename] = []
     with pytest.raises(ValueError):
-        wld_import.check_data_integrity()
+        wld_import.check_data_integrity(wld_import.ImportContext(loaded_data))
     assert f"{fieldname} not found" in caperrors.text, caperrors.text
 
 
@@ -178,28 +220,28 @@ def test_check_data_integrity__empty(data_loaded, caperrors, filename, fieldname
     ],
 )
 def test_check_data_integrity__reference_error(
-    data_loaded, caperrors, filename, fieldname, value
+    loaded_data, caperrors, filename, fieldname, value
 ):
-    assert data_loaded
-    assert wld_import.loaded_data
-    wld_import.loaded_data[filename][0][fieldname] = value
+    loaded_data[filename][0][fieldname] = value
     with pytest.raises(ValueError):
-        wld_import.check_data_integrity()
+        wld_import.check_data_integrity(wld_import.ImportContext(loaded_data))
     assert len(caperrors.records) >= 1
 
 
-def test_check_data_integrity__duplicate_tree_error(data_loaded, caperrors):
-    assert data_loaded
-    assert wld_import.loaded_data
-    wld_import.loaded_data["tree.csv"].append(wld_import.loaded_data["tree.csv"][0])
+def test_check_data_integrity__duplicate_tree_error(loaded_data, caperrors):
+    loaded_data["tree.csv"].append(loaded_data["tree.csv"][0])
     with pytest.raises(ValueError):
-        wld_import.check_data_integrity()
+        wld_import.check_data_integrity(wld_import.ImportContext(loaded_data))
     assert len(caperrors.records) >= 1
 
 
 def test_import_data(mocker, input_blob):
     mocker.patch("phenoback.utils.storage.get_blob", return_value=input_blob)
-    wld_import.import_data("mocked", 2001)  # assume test data from 2001
+    update_statistics_mock = mocker.patch(
+        "phenoback.functions.wld_import.update_statistics"
+    )
+    assert wld_import.import_data("mocked", 2001) == [2001]  # test data from 2001
+    update_statistics_mock.assert_not_called()
     assert len(f.get_collection_documents("users")) == 4
     assert len(f.get_collection_documents("public_users")) == 4
     assert len(f.get_collection_documents("individuals")) == 2
@@ -214,3 +256,75 @@ def test_import_data__no_data(mocker, caperrors, input_blob):
     assert len(f.get_collection_documents("individuals")) == 0
     assert len(f.get_collection_documents("observations")) == 0
     assert len(caperrors.records) >= 1, caperrors
+
+
+def test_import_data__all_years(mocker, input_blob):
+    mocker.patch("phenoback.utils.storage.get_blob", return_value=input_blob)
+    update_statistics_mock = mocker.patch(
+        "phenoback.functions.wld_import.update_statistics"
+    )
+    assert wld_import.import_data("mocked") == [2001, 9999]
+    assert len(f.get_collection_documents("users")) == 4
+    assert len(f.get_collection_documents("public_users")) == 4
+    assert len(f.get_collection_documents("individuals")) == 4
+    assert len(f.get_collection_documents("observations")) == 8
+    update_statistics_mock.assert_called_once_with([2001, 9999])
+
+
+def test_update_statistics(mocker):
+    d.update_phenoyear(2010)
+    process_1y_mock = mocker.patch(
+        "phenoback.functions.statistics.weekly.process_1y_aggregate_statistics"
+    )
+    process_5y_30y_mock = mocker.patch(
+        "phenoback.functions.statistics.weekly.process_5y_30y_aggregate_statistics"
+    )
+
+    wld_import.update_statistics([2001, 2003])
+
+    assert [c.args[0] for c in process_1y_mock.call_args_list] == [2001, 2003]
+    assert [c.args[0] for c in process_5y_30y_mock.call_args_list] == list(
+        range(2002, 2011)
+    )
+    for call in process_5y_30y_mock.call_args_list:
+        assert call.kwargs == {"stat_start_range": 1972, "stat_end_range": 2010}
+
+
+def test_update_statistics__no_years(mocker):
+    process_1y_mock = mocker.patch(
+        "phenoback.functions.statistics.weekly.process_1y_aggregate_statistics"
+    )
+    wld_import.update_statistics([])
+    process_1y_mock.assert_not_called()
+
+
+def test_import_data__dry_run(mocker, input_blob):
+    mocker.patch("phenoback.utils.storage.get_blob", return_value=input_blob)
+    upload_mock = mocker.patch("phenoback.utils.storage.upload_string")
+    update_statistics_mock = mocker.patch(
+        "phenoback.functions.wld_import.update_statistics"
+    )
+    wld_import.import_data("mocked", 2001)
+    f.write_document("users", "wld_user1", {"firstname": "changed"})
+
+    assert wld_import.import_data("mocked", dry_run=True) == [2001, 9999]
+
+    assert len(f.get_collection_documents("individuals")) == 2
+    assert len(f.get_collection_documents("observations")) == 4
+    update_statistics_mock.assert_not_called()
+    upload_mock.assert_called_once()
+    report = json.loads(upload_mock.call_args.args[2])
+    assert report["dry_run"]
+    assert report["info"]["statistics_years"] == [2001, 9999]
+    assert report["collections"]["users"] == {"new": 0, "changed": 1, "unchanged": 3}
+    assert report["collections"]["individuals"] == {
+        "new": 2,
+        "changed": 0,
+        "unchanged": 2,
+    }
+    assert report["collections"]["observations"] == {
+        "new": 4,
+        "changed": 0,
+        "unchanged": 4,
+    }
+    assert {"load", "validate", "transform", "write"} == report["stages"].keys()
@@ -33,6 +33,10 @@ def test_invoke__exception(data, context):
                 "phenoback.functions.rollover.main",
             ],
         ),
+        (
+            main.ps_remove_stale_individuals,
+            ["phenoback.functions.rollover.main_remove_stale"],
+        ),
         (
             main.ps_export_meteoswiss_data,
             ["phenoback.functions.meteoswiss_export.main"],
@@ -45,6 +49,22 @@ def test_invoke__exception(data, context):
                 # "phenoback.functions.iot.permarobotics.main", -> not called: only for productive environment
             ],
         ),
+        (
+            main.ps_rebuild_map,
+            ["phenoback.functions.map.main_rebuild"],
+        ),
+        (
+            main.ps_export_map,
+            ["phenoback.functions.map_export.main_export"],
+        ),
+        (
+            main.ps_iot_uplink_schedule,
+            ["phenoback.functions.iot.app.main_uplink_schedule"],
+        ),
+        (
+            main.ps_compact_sensor_history,
+            ["phenoback.functions.iot.history.main"],
+        ),
         (
             main.ps_process_statistics,
             [
@@ -99,6 +119,10 @@ def test_executes__ps_iot_dragino__environments(mocker, project, pubsub_event, c
             main.fs_invites_write,
             ["phenoback.functions.invite.invite.main"],
         ),
+        (
+            main.fs_maps_write,
+            ["phenoback.functions.map_export.main"],
+        ),
         (
             main.fs_individuals_write,
             [
@@ -159,6 +183,24 @@ def test_executes__firestore(mocker, entrypoint, functions, data, context):
                 "phenoback.functions.iot.dragino.main",
             ],
         ),
+        (
+            main.http_rollover_phenoyear,
+            [
+                "phenoback.functions.rollover.main_process",
+            ],
+        ),
+        (
+            main.http_iot_dragino_batch,
+            [
+                "phenoback.functions.iot.batch.main",
+            ],
+        ),
+        (
+            main.http_sensor_history,
+            [
+                "phenoback.functions.iot.history.main_read",
+            ],
+        ),
     ],
 )
 def test_executes__http(mocker, entrypoint, functions):
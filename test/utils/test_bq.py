@@ -1,5 +1,25 @@
+import pytest
+
 from phenoback.utils import bq
 
+TABLE = "some_table"
+
+
+@pytest.fixture(autouse=True)
+def sleep_mock(mocker):
+    return mocker.patch("time.sleep")
+
+
+@pytest.fixture
+def client_mock(mocker):
+    client_mock = mocker.patch("phenoback.utils.bq.client")
+    client_mock.return_value.insert_rows_json.return_value = []
+    return client_mock
+
+
+def row_error(index: int, reason: str) -> dict:
+    return {"index": index, "errors": [{"reason": reason, "message": "msg"}]}
+
 
 def test_client(mocker):
     task_mock = mocker.patch("phenoback.utils.bq.client")
@@ -27,7 +47,7 @@ def test_insert_data__array(mocker, caperrors):
     client_mock = mocker.patch("phenoback.utils.bq.client")
     client_mock.return_value.insert_rows_json.return_value = []
 
-    bq.insert_data(table, data_array)
+    assert not bq.insert_data(table, data_array)
 
     client_mock.return_value.insert_rows_json.assert_called_with(table, data_array)
     assert len(caperrors.records) == 0
@@ -39,6 +59,59 @@ def test_insert_data__error(mocker, caperrors):
     client_mock = mocker.patch("phenoback.utils.bq.client")
     client_mock.return_value.insert_rows_json.return_value = [{"error": "value"}]
 
-    bq.insert_data(table, data_dict)
+    assert bq.insert_data(table, data_dict) == [data_dict]
 
     assert len(caperrors.records) == 1
+
+
+def test_insert_data__retry(client_mock, sleep_mock, caperrors):
+    rows = [{"row": 0}, {"row": 1}, {"row": 2}]
+    client_mock.return_value.insert_rows_json.side_effect = [
+        [row_error(0, "stopped"), row_error(1, "invalid"), row_error(2, "stopped")],
+        [],
+    ]
+
+    assert bq.insert_data(TABLE, rows) == [{"row": 1}]
+
+    assert client_mock.return_value.insert_rows_json.call_args_list[1].args == (
+        TABLE,
+        [{"row": 0}, {"row": 2}],
+    )
+    sleep_mock.assert_called_once()
+    assert len(caperrors.records) == 1  # invalid row
+
+
+def test_insert_data__retry_exhausted(client_mock, sleep_mock, caperrors):
+    client_mock.return_value.insert_rows_json.return_value = [
+        row_error(0, "backendError")
+    ]
+
+    assert bq.insert_data(TABLE, {"foo": "bar"}, retries=2) == [{"foo": "bar"}]
+
+    assert client_mock.return_value.insert_rows_json.call_count == 3
+    assert [c.args[0] for c in sleep_mock.call_args_list] == [
+        bq.RETRY_DELAY,
+        bq.RETRY_DELAY * 2,
+    ]
+    assert len(caperrors.records) == 1
+
+
+def test_insert_data__row_ids(client_mock):
+    rows = [{"row": 0}, {"row": 1}]
+    client_mock.return_value.insert_rows_json.side_effect = [
+        [row_error(1, "stopped")],
+        [],
+    ]
+
+    bq.insert_data(TABLE, rows, row_ids=["id0", "id1"])
+
+    assert client_mock.return_value.insert_rows_json.call_args_list[0].kwargs == {
+        "row_ids": ["id0", "id1"]
+    }
+    assert client_mock.return_value.insert_rows_json.call_args_list[1].args == (
+        TABLE,
+        [{"row": 1}],
+    )
+    assert client_mock.return_value.insert_rows_json.call_args_list[1].kwargs == {
+        "row_ids": ["id1"]
+    }
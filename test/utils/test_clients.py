@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from phenoback.utils import clients
+
+
+def test_get(mocker):
+    factory = mocker.Mock()
+    mocker.patch.dict(clients.FACTORIES, {"test": factory})
+
+    client = clients.get("test")
+
+    assert clients.get("test") is client
+    factory.assert_called_once()
+    assert "test" in clients.creation_times()
+
+
+def test_get__factory(mocker):
+    factory = mocker.Mock()
+
+    assert clients.get("custom", factory) is factory.return_value
+    assert clients.get("custom", factory) is factory.return_value
+    factory.assert_called_once()
+
+
+def test_get__unknown():
+    with pytest.raises(KeyError):
+        clients.get("unknown")
+
+
+def test_get__concurrent():
+    created = threading.Event()
+
+    def factory():
+        created.wait(1)
+        return object()
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(clients.get("slow", factory)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    created.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 5
+    assert all(result is results[0] for result in results)
+
+
+def test_cloudtasks(mocker):
+    client_mock = mocker.patch("google.cloud.tasks_v2.CloudTasksClient")
+
+    assert clients.get("cloudtasks") is client_mock.return_value
+    assert clients.get("cloudtasks") is client_mock.return_value
+    client_mock.assert_called_once()
+
+
+def test_warm(mocker):
+    factory = mocker.Mock()
+    mocker.patch.dict(clients.FACTORIES, {"test": factory})
+
+    clients.warm("test").join()
+
+    factory.assert_called_once()
+    assert clients.get("test") is factory.return_value
+
+
+def test_warm__failure(mocker, capwarnings):
+    factory = mocker.Mock(side_effect=ValueError("no credentials"))
+    mocker.patch.dict(clients.FACTORIES, {"test": factory})
+
+    clients.warm("test").join()
+
+    assert "test" not in clients.creation_times()
+    assert len(capwarnings.records) == 1
+
+
+def test_reset(mocker):
+    factory = mocker.Mock(side_effect=[object(), object()])
+
+    client = clients.get("test", factory)
+    clients.reset()
+
+    assert clients.get("test", factory) is not client
+    assert factory.call_count == 2
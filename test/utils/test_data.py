@@ -1,10 +1,11 @@
 # pylint: disable=protected-access
 import json
 import test
-from datetime import datetime, date
+from datetime import date, datetime
 
 import pytest
 import pytz
+from google.cloud.firestore_v1.document import DocumentReference
 
 from phenoback.utils import data as d
 from phenoback.utils import firestore as f
@@ -16,7 +17,7 @@ def config_static():
     To update resource files needed for tests from phaenonet test instance
     see maintenance repo @ maintenance/config/generate_config_static.py.
     """
-    d._get_static_config.cache_clear()
+    d.reset_config_cache()
     with open(test.get_resource_path("config_static.json"), encoding="utf-8") as file:
         data = json.loads(file.read())
         f.write_document("definitions", "config_static", data)
@@ -58,19 +59,85 @@ def test_has_observation_date(individual, expected):
     assert d.has_observations(individual) == expected
 
 
-def test_get_phenophase__cache(mocker):
-    spy = mocker.spy(d, "get_document")
+@pytest.fixture
+def collection_spy(mocker):
+    return mocker.spy(d, "collection")
+
+
+@pytest.fixture
+def monotonic_mock(mocker):
+    return mocker.patch("time.monotonic", return_value=1000.0)
+
+
+def test_get_phenophase__cache(collection_spy):
     assert d.get_phenophase("HS", "BEA")
     assert d.get_phenophase("HS", "BES")
     assert d.get_phenophase("BA", "BEA")
-    spy.assert_called_once()  # assert results are cached
+    collection_spy.assert_called_once()  # assert results are cached
 
 
-def test_get_species__cache(mocker):
-    spy = mocker.spy(d, "get_document")
+def test_get_species__cache(collection_spy):
     assert d.get_species("HS")
     assert d.get_species("BA")
-    spy.assert_called_once()  # assert results are cached
+    collection_spy.assert_called_once()  # assert results are cached
+
+
+def test_get_config__ttl_unchanged(mocker, collection_spy, monotonic_mock):
+    config = d._get_static_config()
+    monotonic_mock.return_value += d.CONFIG_TTL["config_static"] + 1
+    get_spy = mocker.spy(DocumentReference, "get")
+
+    assert d._get_static_config() is config  # parsed config is kept
+    assert collection_spy.call_count == 2
+    get_spy.assert_called_once()
+    assert get_spy.call_args.kwargs == {"field_paths": []}  # metadata only
+
+
+def test_get_config__ttl_changed(monotonic_mock, config_dynamic):
+    assert d.get_phenoyear() == config_dynamic["phenoyear"]
+    f.update_document("definitions", "config_dynamic", {"phenoyear": 1999})
+    assert d.get_phenoyear() == config_dynamic["phenoyear"]
+
+    monotonic_mock.return_value += d.CONFIG_TTL["config_dynamic"] + 1
+    assert d.get_phenoyear() == 1999
+
+
+def test_get_names(config_static):
+    assert d.get_species_name("HS") == config_static["species"]["HS"]["de"]
+    assert (
+        d.get_phenophase_name("HS", "BEA")
+        == config_static["species"]["HS"]["phenophases"]["BEA"]["de"]
+    )
+
+
+def test_get_names__changed(monotonic_mock):
+    d.get_species_name("HS")
+    f.update_document("definitions", "config_static", {"species.HS.de": "changed"})
+    monotonic_mock.return_value += d.CONFIG_TTL["config_static"] + 1
+
+    assert d.get_species_name("HS") == "changed"
+
+
+def test_update_sensors_version():
+    assert d.get_sensors_version() == 0
+    d.update_sensors_version()
+    d.update_sensors_version()
+    assert d.get_sensors_version() == 2
+
+
+def test_get_token_user_id(mocker):
+    verify_mock = mocker.patch(
+        "firebase_admin.auth.verify_id_token", return_value={"uid": "user_id"}
+    )
+
+    assert d.get_token_user_id("token") == "user_id"
+    verify_mock.assert_called_once_with("token")
+
+
+def test_get_token_user_id__invalid(mocker):
+    mocker.patch("firebase_admin.auth.verify_id_token", side_effect=ValueError())
+
+    assert d.get_token_user_id("token") is None
 
 
 def test_follow_user__not_found():
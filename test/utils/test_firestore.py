@@ -257,3 +257,95 @@ def test_get_collection_documents(collection):
 def test_get_count(collection, doc_id, doc):
     f.write_document(collection, doc_id, doc)
     assert f.get_count(f.collection(collection)) == 1
+
+
+def test_get_documents(collection, doc_id, doc_id2, doc, doc2):
+    f.write_document(collection, doc_id, doc)
+    f.write_document(collection, doc_id2, doc2)
+
+    result = f.get_documents(collection, [doc_id, doc_id2, "unknown"], chunk_size=2)
+
+    assert result == {doc_id: doc, doc_id2: doc2, "unknown": None}
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 3, 10])
+def test_stream_pages(collection, page_size):
+    for i in range(5):
+        f.write_document(collection, f"doc_{i}", {"value": i, "other": True})
+    query = f.collection(collection).order_by("__name__")
+
+    pages = list(f.stream_pages(query, page_size))
+
+    assert all(0 < len(page) <= page_size for page in pages)
+    assert [doc.id for page in pages for doc in page] == [f"doc_{i}" for i in range(5)]
+
+
+def test_stream_pages__start_after(collection):
+    for i in range(5):
+        f.write_document(collection, f"doc_{i}", {"value": i})
+    query = f.collection(collection).order_by("__name__")
+    start_after = f.collection(collection).document("doc_1")
+
+    pages = list(f.stream_pages(query, 2, start_after))
+
+    assert [doc.id for page in pages for doc in page] == ["doc_2", "doc_3", "doc_4"]
+
+
+@pytest.mark.parametrize("commit_size", [1, 2, 500])
+def test_update_batch(collection, commit_size):
+    for i in range(3):
+        f.write_document(collection, f"doc_{i}", {"value": i, "other": True})
+
+    result = f.update_batch(
+        collection,
+        {f"doc_{i}": {"value": f.DELETE_FIELD, "new": i} for i in range(3)},
+        commit_size=commit_size,
+    )
+
+    assert result == 3
+    for i in range(3):
+        assert f.get_document(collection, f"doc_{i}") == {"other": True, "new": i}
+
+
+def test_update_batch__non_existing(collection):
+    with pytest.raises(google.api_core.exceptions.NotFound):
+        f.update_batch(collection, {"unknown": {"value": 1}})
+
+
+@pytest.mark.parametrize("commit_size", [1, 2, 500])
+def test_delete_documents(collection, commit_size):
+    for i in range(5):
+        f.write_document(collection, f"doc_{i}", {"value": i})
+
+    result = f.delete_documents(
+        collection, ["doc_0", "doc_2", "doc_4", "unknown"], commit_size=commit_size
+    )
+
+    assert result == 4
+    assert sorted(doc["value"] for doc in f.get_collection_documents(collection)) == [
+        1,
+        3,
+    ]
+
+
+def test_batch_commit(collection):
+    with f.batch_commit() as writebatch:
+        writebatch.set(f.collection(collection).document("doc"), {"value": 1})
+        assert not f.get_document(collection, "doc")
+
+    assert f.get_document(collection, "doc") == {"value": 1}
+
+
+def test_batch_commit__given_batch(collection):
+    writebatch = f.firestore_client().batch()
+    with f.batch_commit(writebatch) as batch:
+        assert batch is writebatch
+        batch.set(f.collection(collection).document("doc"), {"value": 1})
+
+    assert not f.get_document(collection, "doc")
+    writebatch.commit()
+    assert f.get_document(collection, "doc") == {"value": 1}
+
+
+def test_delete_documents__empty(collection):
+    assert f.delete_documents(collection, []) == 0
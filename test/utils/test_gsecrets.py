@@ -1,3 +1,6 @@
+# pylint: disable=protected-access
+import threading
+
 import pytest
 
 from phenoback.utils import gsecrets
@@ -5,26 +8,121 @@ from phenoback.utils import gsecrets
 
 @pytest.fixture(autouse=True)
 def clear_cache():
-    gsecrets.get_secret.cache_clear()
+    gsecrets.reset()
 
 
-def test_get_secret__cache(mocker):
-    assert gsecrets.get_secret.cache_info().currsize == 0
-    mocker.patch("google.cloud.secretmanager.SecretManagerServiceClient")
-    gsecrets.get_secret("some_key")
+@pytest.fixture
+def client_mock(mocker):
+    client_mock = mocker.patch("google.cloud.secretmanager.SecretManagerServiceClient")
+    access = client_mock.return_value.access_secret_version
+    access.side_effect = lambda name: mocker.Mock(
+        payload=mocker.Mock(data=f"value of {name}".encode())
+    )
+    return client_mock
+
+
+@pytest.fixture
+def monotonic_mock(mocker):
+    return mocker.patch("time.monotonic", return_value=1000.0)
+
+
+@pytest.fixture
+def refresh_async_mock(mocker):
+    return mocker.patch("phenoback.utils.gsecrets._refresh_async")
+
+
+def access_calls(client_mock) -> list[str]:
+    return [
+        c.kwargs["name"]
+        for c in client_mock.return_value.access_secret_version.call_args_list
+    ]
+
+
+def test_get_secret__cache(client_mock):
+    assert gsecrets.get_secret("some_key").endswith("some_key/versions/latest")
     gsecrets.get_secret("other_key")
     gsecrets.get_secret("some_key")
     gsecrets.get_secret("other_key")
-    assert gsecrets.get_secret.cache_info().currsize == 2
-    assert gsecrets.get_secret.cache_info().hits == 2
-    assert gsecrets.get_secret.cache_info().misses == 2
 
+    assert len(access_calls(client_mock)) == 2
 
-def test_get_secret__reset(mocker):
-    assert gsecrets.get_secret.cache_info().currsize == 0
-    mocker.patch("google.cloud.secretmanager.SecretManagerServiceClient")
+
+def test_get_secret__reset(client_mock):
     gsecrets.get_secret("some_key")
     gsecrets.reset()
-    assert gsecrets.get_secret.cache_info().misses == 0
     gsecrets.get_secret("some_key")
-    assert gsecrets.get_secret.cache_info().misses == 1
+
+    assert len(access_calls(client_mock)) == 2
+
+
+def test_get_secret__shared_client(client_mock):
+    gsecrets.get_secret("some_key")
+    gsecrets.get_secret("other_key")
+
+    client_mock.assert_called_once()
+
+
+def test_get_secret__stale_while_revalidate(
+    client_mock, monotonic_mock, refresh_async_mock
+):
+    value = gsecrets.get_secret("some_key")
+    monotonic_mock.return_value += gsecrets.SECRET_TTL - 1
+    assert gsecrets.get_secret("some_key") == value
+    refresh_async_mock.assert_not_called()
+
+    monotonic_mock.return_value += 2
+    assert gsecrets.get_secret("some_key") == value
+
+    refresh_async_mock.assert_called_once_with("some_key", gsecrets.LATEST)
+    assert len(access_calls(client_mock)) == 1
+
+
+def test_get_secret__max_age(client_mock, monotonic_mock, refresh_async_mock):
+    gsecrets.get_secret("some_key")
+    monotonic_mock.return_value += gsecrets.SECRET_MAX_AGE + 1
+    gsecrets.get_secret("some_key")
+
+    refresh_async_mock.assert_not_called()
+    assert len(access_calls(client_mock)) == 2
+
+
+def test_get_secret__pinned(client_mock, monotonic_mock, refresh_async_mock):
+    assert gsecrets.get_secret("some_key", "3").endswith("some_key/versions/3")
+    monotonic_mock.return_value += gsecrets.SECRET_MAX_AGE + 1
+    gsecrets.get_secret("some_key", "3")
+
+    refresh_async_mock.assert_not_called()
+    assert len(access_calls(client_mock)) == 1
+
+
+@pytest.mark.usefixtures("client_mock")
+def test_get_secret__pinned_env(monkeypatch):
+    monkeypatch.setenv("some_key_version", "2")
+
+    assert gsecrets.get_secret("some_key").endswith("some_key/versions/2")
+
+
+def test_refresh_async(client_mock, mocker):
+    thread_mock = mocker.patch("threading.Thread")
+
+    gsecrets._refresh_async("some_key", gsecrets.LATEST)
+    gsecrets._refresh_async("some_key", gsecrets.LATEST)
+
+    thread_mock.assert_called_once()
+    thread_mock.call_args.kwargs["target"]()
+    assert gsecrets.get_secret("some_key")
+    assert len(access_calls(client_mock)) == 1
+    assert not gsecrets._refreshing
+
+
+def test_refresh_async__failure(client_mock, capwarnings):
+    client_mock.return_value.access_secret_version.side_effect = ValueError()
+
+    gsecrets._refresh_async("some_key", gsecrets.LATEST)
+    for thread in threading.enumerate():
+        if thread.name == "refresh-some_key":
+            thread.join()
+
+    assert not gsecrets._refreshing
+    assert ("some_key", gsecrets.LATEST) not in gsecrets._cache
+    assert len(capwarnings.records) == 1
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from phenoback.utils import firestore as f
+from phenoback.utils import importreport
+from phenoback.utils.importreport import ImportReport
+
+COLLECTION = "collection"
+
+
+@pytest.fixture
+def report() -> ImportReport:
+    return ImportReport("name", dry_run=True)
+
+
+@pytest.mark.parametrize(
+    "current, data, merge, expected",
+    [
+        (None, {"a": 1}, False, importreport.NEW),
+        (None, {"a": 1}, True, importreport.NEW),
+        ({"a": 1}, {"a": 1}, False, importreport.UNCHANGED),
+        ({"a": 1, "b": 2}, {"a": 1}, False, importreport.CHANGED),
+        (
+            {"a": 1, "created": 1, "modified": 2},
+            {"a": 1},
+            False,
+            importreport.UNCHANGED,
+        ),
+        ({"a": 1, "created": 1, "modified": 2}, {"a": 2}, False, importreport.CHANGED),
+        ({"a": 1, "b": 2}, {"a": 1}, True, importreport.UNCHANGED),
+        ({"a": 1}, {"a": 2}, True, importreport.CHANGED),
+        ({"a": {"x": 1, "y": 2}}, {"a": {"x": 1}}, True, importreport.UNCHANGED),
+        ({"a": {"x": 1}}, {"a": {"x": 2}}, True, importreport.CHANGED),
+        ({"a": ["x", "y"]}, {"a": f.ArrayUnion(["x"])}, True, importreport.UNCHANGED),
+        ({"a": ["x"]}, {"a": f.ArrayUnion(["x", "y"])}, True, importreport.CHANGED),
+        ({}, {"a": f.ArrayUnion(["x"])}, True, importreport.CHANGED),
+    ],
+)
+def test_diff_state(current, data, merge, expected):
+    assert importreport.diff_state(current, data, merge) == expected
+
+
+def test_write_batch__dry_run(report: ImportReport):
+    f.write_document(COLLECTION, "unchanged", {"a": 1})
+    f.write_document(COLLECTION, "changed", {"a": 1})
+
+    report.write_batch(
+        COLLECTION,
+        "id",
+        [
+            {"id": "unchanged", "a": 1},
+            {"id": "changed", "a": 2},
+            {"id": "new", "a": 1},
+        ],
+    )
+
+    assert report.collections[COLLECTION] == {"new": 1, "changed": 1, "unchanged": 1}
+    assert f.get_document(COLLECTION, "changed") == {"a": 1}
+    assert f.get_document(COLLECTION, "new") is None
+
+
+def test_write_batch__dry_run_timestamps(report: ImportReport):
+    f.write_document(COLLECTION, "unchanged", {"a": 1, "created": 1, "modified": 2})
+
+    report.write_batch(COLLECTION, "id", [{"id": "unchanged", "a": 1}])
+
+    assert report.collections[COLLECTION] == {"new": 0, "changed": 0, "unchanged": 1}
+
+
+def test_write_batch__write():
+    report = ImportReport("name")
+
+    report.write_batch(COLLECTION, "id", [{"id": "new", "a": 1}])
+
+    assert not report.collections
+    assert f.get_document(COLLECTION, "new") == {"a": 1}
+
+
+def test_stage(report: ImportReport):
+    with report.stage("stage1"):
+        pass
+    with report.stage("stage1"):
+        pass
+    with pytest.raises(KeyError):
+        with report.stage("stage2"):
+            raise KeyError()
+
+    assert report.stages.keys() == {"stage1", "stage2"}
+
+
+def test_upload(mocker, report: ImportReport):
+    upload_mock = mocker.patch("phenoback.utils.storage.upload_string")
+    report.info["foo"] = "bar"
+
+    path = report.upload()
+
+    assert path.startswith(f"{importreport.REPORT_PATH}/name/")
+    args = upload_mock.call_args.args
+    assert args[1] == path
+    assert json.loads(args[2])["info"] == {"foo": "bar"}
+    assert upload_mock.call_args.kwargs["content_type"] == "application/json"
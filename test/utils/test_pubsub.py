@@ -35,6 +35,66 @@ def test_init(publisher: pubsub.Publisher):
     client_mock.topic_path.assert_called_with(PROJECT, TOPIC)
 
 
+def test_init__batch_settings(mocker, fkn_env):
+    client_mock = mocker.patch("google.cloud.pubsub_v1.PublisherClient")
+
+    pubsub.Publisher(TOPIC, max_messages=10, max_bytes=1000, max_latency=0.5)
+
+    batch_settings = client_mock.call_args.kwargs["batch_settings"]
+    assert batch_settings.max_messages == 10
+    assert batch_settings.max_bytes == 1000
+    assert batch_settings.max_latency == 0.5
+
+
+def test_publish(publisher: pubsub.Publisher):
+    client_mock = publisher.client
+    payload = {"foo": "bar"}
+
+    future = publisher.publish(payload, {"bar": "baz"})
+
+    assert future == client_mock.publish.return_value
+    client_mock.publish.assert_called_with(
+        TOPIC_PATH, json.dumps(payload).encode("utf-8"), bar="baz"
+    )
+    future.result.assert_not_called()
+    future.add_done_callback.assert_called_once()
+
+
+def test_flush(publisher: pubsub.Publisher, mocker, caperrors):
+    ok_future = mocker.Mock()
+    failed_future = mocker.Mock()
+    failed_future.result.side_effect = Exception("failed")
+    publisher.client.publish.side_effect = [ok_future, failed_future]
+    publisher.publish("foo")
+    publisher.publish("bar")
+
+    assert publisher.flush() == 1
+    assert publisher.flush() == 0
+
+    ok_future.result.assert_called_once()
+    failed_future.result.assert_called_once()
+    assert len(caperrors.records) == 1
+
+
+def test_published__stats(publisher: pubsub.Publisher, mocker):
+    ok_future = mocker.Mock()
+    ok_future.exception.return_value = None
+    failed_future = mocker.Mock()
+    failed_future.exception.return_value = Exception("failed")
+    mocker.patch("time.perf_counter", return_value=10.0)
+
+    publisher._published(ok_future, 8.0)  # pylint: disable=protected-access
+    publisher._published(ok_future, 9.0)  # pylint: disable=protected-access
+    publisher._published(failed_future, 9.0)  # pylint: disable=protected-access
+
+    assert publisher.stats == {
+        "published": 2,
+        "failed": 1,
+        "latency_sum": 3.0,
+        "latency_max": 2.0,
+    }
+
+
 def test_send__string(publisher: pubsub.Publisher):
     client_mock = publisher.client
     payload = "foo"
@@ -65,3 +125,65 @@ def test_send__metadata(publisher: pubsub.Publisher):
         TOPIC_PATH, payload.encode("utf-8"), bar="baz"
     )
     client_mock.publish.return_value.result.assert_called()
+
+
+SUBSCRIPTION = "subscription"
+SUBSCRIPTION_PATH = "subscription_path"
+
+
+@pytest.fixture
+def subscriber(mocker, fkn_env) -> pubsub.Subscriber:
+    client_mock = mocker.patch.object(
+        google.cloud.pubsub_v1, "SubscriberClient", autospec=True
+    )
+    client_mock.subscription_path.return_value = SUBSCRIPTION_PATH
+    mocker.patch("google.cloud.pubsub_v1.SubscriberClient", return_value=client_mock)
+    return pubsub.Subscriber(SUBSCRIPTION)
+
+
+def test_subscriber_init(subscriber: pubsub.Subscriber):
+    assert subscriber.subscription == SUBSCRIPTION
+    assert subscriber.subscription_path == SUBSCRIPTION_PATH
+    subscriber.client.subscription_path.assert_called_with(PROJECT, SUBSCRIPTION)
+
+
+def test_pull(subscriber: pubsub.Subscriber):
+    client_mock = subscriber.client
+    client_mock.pull.return_value.received_messages = ["msg1", "msg2"]
+
+    assert subscriber.pull(10) == ["msg1", "msg2"]
+    client_mock.pull.assert_called_with(
+        request={"subscription": SUBSCRIPTION_PATH, "max_messages": 10}, timeout=10
+    )
+
+
+def test_acknowledge(subscriber: pubsub.Subscriber):
+    subscriber.acknowledge(["ack1", "ack2"])
+
+    subscriber.client.acknowledge.assert_called_with(
+        request={"subscription": SUBSCRIPTION_PATH, "ack_ids": ["ack1", "ack2"]}
+    )
+
+
+def test_acknowledge__empty(subscriber: pubsub.Subscriber):
+    subscriber.acknowledge([])
+
+    subscriber.client.acknowledge.assert_not_called()
+
+
+def test_nack(subscriber: pubsub.Subscriber):
+    subscriber.nack(["ack1"])
+
+    subscriber.client.modify_ack_deadline.assert_called_with(
+        request={
+            "subscription": SUBSCRIPTION_PATH,
+            "ack_ids": ["ack1"],
+            "ack_deadline_seconds": 0,
+        }
+    )
+
+
+def test_nack__empty(subscriber: pubsub.Subscriber):
+    subscriber.nack([])
+
+    subscriber.client.modify_ack_deadline.assert_not_called()
@@ -61,3 +61,11 @@ def test_send(gcf_client: tasks.GCFClient):
     gcf_client.http_client.send.assert_called_with(
         payload=payload, task_name=task_name, at=at, deadline=deadline
     )
+
+
+def test_send_batch(gcf_client: tasks.GCFClient):
+    requests = [tasks.TaskRequest("foo")]
+
+    gcf_client.send_batch(requests, max_workers=2)
+
+    gcf_client.http_client.send_batch.assert_called_with(requests, max_workers=2)
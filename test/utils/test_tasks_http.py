@@ -1,6 +1,7 @@
 # pylint: disable=unused-argument,protected-access
 from datetime import datetime
 
+import google.api_core.exceptions
 import google.cloud.tasks_v2
 import pytest
 
@@ -32,6 +33,10 @@ def test_init(http_client: tasks.HTTPClient, gcp_project, gcp_location):
     assert http_client.url == URL
 
 
+def test_init__shared_client(http_client: tasks.HTTPClient):
+    assert tasks.HTTPClient("other", URL).client is http_client.client
+
+
 def test_send__headers(http_client: tasks.HTTPClient):
     http_client.send("foo")
     check_default_headers(http_client)
@@ -99,6 +104,54 @@ def test_send__params(http_client: tasks.HTTPClient):
     assert task_req_arg["http_request"]["url"] == f"{http_client.url}?foo=bar"
 
 
+def test_send_batch(http_client: tasks.HTTPClient):
+    requests = [
+        tasks.TaskRequest({"id": i}, params={"i": i}, task_name=f"task{i}")
+        for i in range(20)
+    ]
+
+    assert http_client.send_batch(requests, max_workers=4) == 20
+
+    task_requests = [
+        c.kwargs["request"]["task"]
+        for c in http_client.client.create_task.call_args_list  # type: ignore
+    ]
+    assert sorted(task["http_request"]["url"] for task in task_requests) == sorted(
+        f"{URL}?i={i}" for i in range(20)
+    )
+    assert all(request.result for request in requests)
+    assert all(
+        task["http_request"]["oidc_token"] is http_client.oidc_token
+        for task in task_requests
+    )
+
+
+def test_send_batch__already_exists(http_client: tasks.HTTPClient):
+    http_client.client.create_task.side_effect = [  # type: ignore
+        "task",
+        google.api_core.exceptions.AlreadyExists("exists"),
+    ]
+    requests = [tasks.TaskRequest("foo", task_name=f"task{i}") for i in range(2)]
+
+    assert http_client.send_batch(requests, max_workers=1) == 1
+    assert requests[0].result == "task"
+    assert requests[1].result is None
+
+
+def test_send_batch__empty(http_client: tasks.HTTPClient):
+    assert http_client.send_batch([]) == 0
+    http_client.client.create_task.assert_not_called()  # type: ignore
+
+
+def test_build_task(http_client: tasks.HTTPClient):
+    task = http_client.build_task({"foo": "bar"}, params={"p": "v"}, deadline=10)
+
+    assert task["http_request"]["url"] == f"{URL}?p=v"
+    assert task["http_request"]["body"] == b'{"foo": "bar"}'
+    assert task["dispatch_deadline"]
+    http_client.client.create_task.assert_not_called()  # type: ignore
+
+
 @pytest.mark.parametrize(
     "params, expected", [({"p1": "v1", "p2": "v2"}, "?p1=v1&p2=v2"), (None, "")]
 )